@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+# Binary command log for robot recordings
+# See more at https://github.com/oomwoo/
+#
+# Copyright (C) 2016 oomwoo.com
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version 3.0
+# as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License <http://www.gnu.org/licenses/> for details.
+"""
+Binary command log (rec*.cmd)
+    - 8-byte header, then fixed 16-byte records:
+      float64 time.time(), command letter, command value, source, padding
+    - the caller only packs a record and appends it to an in-memory queue,
+      a background thread writes queued records to disk periodically
+    - export_text() writes the "<time> <command>" rec*.txt format
+Usage: python cmdlog.py rec00000.cmd [rec00000.txt]
+    Convert binary command log to text
+"""
+
+import sys
+import time
+import struct
+import threading
+import collections
+import numpy as np
+
+
+magic = b"DORACMD1"
+record = struct.Struct("<dBBB5x")
+record_dtype = np.dtype([("time", "<f8"), ("cmd", "u1"), ("value", "u1"), ("source", "u1"), ("pad", "V5")])
+cmdlog_ext = ".cmd"
+
+# Where a command came from
+SOURCE_WEB = 0  # WebIOPi joystick
+SOURCE_UART = 1  # VEX Cortex over UART
+SOURCE_AUTONOMOUS = 2  # Neural network
+
+
+class CommandLog(object):
+    """Background binary log writer. write() never touches the file."""
+    def __init__(self, file_name, flush_period=1.0):
+        self.file = open(file_name, "wb")
+        self.file.write(magic)
+        self.flush_period = flush_period
+        self.queue = collections.deque()
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def write(self, cmd, value, source=SOURCE_WEB, t=None):
+        if t is None:
+            t = time.time()
+        self.queue.append(record.pack(t, ord(cmd), value, source))
+
+    def run(self):
+        while not self.stop_event.wait(self.flush_period):
+            self.flush()
+
+    def flush(self):
+        n = len(self.queue)
+        if n:
+            self.file.write(b"".join([self.queue.popleft() for i in range(n)]))
+            self.file.flush()
+
+    def close(self):
+        self.stop_event.set()
+        self.thread.join()
+        self.flush()
+        self.file.close()
+
+
+def is_cmdlog(file_name):
+    with open(file_name, "rb") as f:
+        return f.read(len(magic)) == magic
+
+
+def read_cmdlog(file_name):
+    """Structured array of records with fields time, cmd, value, source.
+    A record cut short by a crash is ignored."""
+    with open(file_name, "rb") as f:
+        data = f.read()
+    if data[:len(magic)] != magic:
+        raise ValueError(file_name + " is not a command log")
+    n = (len(data) - len(magic)) // record.size
+    return np.frombuffer(data, dtype=record_dtype, count=n, offset=len(magic))
+
+
+def export_text(cmd_file_name, txt_file_name):
+    with open(txt_file_name, "w") as f:
+        for r in read_cmdlog(cmd_file_name):
+            f.write("%r %s%02X\n" % (float(r["time"]), chr(r["cmd"]), r["value"]))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(2)
+    cmd_file_name = sys.argv[1]
+    txt_file_name = sys.argv[2] if len(sys.argv) > 2 else cmd_file_name.replace(cmdlog_ext, ".txt")
+    export_text(cmd_file_name, txt_file_name)
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# Stand-in for the VEX Cortex side of the Raspberry Pi UART link
+# See more at https://github.com/oomwoo/
+#
+# Copyright (C) 2016 oomwoo.com
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version 3.0
+# as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License <http://www.gnu.org/licenses/> for details.
+"""
+Cortex side of vex/uart_lib.c and the vex/bot.c control loop, in Python
+    - send() writes a link or user command frame, optionally corrupted
+    - step() is one loop iteration: decodes drive command frames from the
+      Pi without waiting, expires a command not refreshed for max_age loops
+Used by rpi2vex/test/cortex_sim.py and common/test/vexlink_test.py.
+"""
+
+import random
+from vexlink import FrameDecoder, encode_frame, CORTEX
+
+
+class CortexStandIn(object):
+    """port: serial-port-like object whose read() does not block"""
+    def __init__(self, port, max_age=10, corrupt_pct=0):
+        self.port = port
+        self.max_age = max_age  # bot.c USER_CMD_MAX_AGE
+        self.corrupt_pct = corrupt_pct
+        self.decoder = FrameDecoder()
+        self.age = 0
+        self.cmd_from_rpi = None
+        self.commands = []  # Drive commands received, in order
+        self.sent = 0
+        self.corrupted = 0
+        self.expired = 0
+
+    def send(self, frame_type, value):
+        frame = bytearray(encode_frame(frame_type, bytearray([value])))
+        if random.uniform(0, 100) < self.corrupt_pct:
+            frame[random.randrange(1, len(frame))] ^= 0x10
+            self.corrupted += 1
+        self.port.write(bytes(frame))
+        self.sent += 1
+
+    def step(self):
+        # bot.c GetUartFrame(), never waits
+        for frame_type, payload in self.decoder.feed(self.port.read(4096)):
+            if frame_type == CORTEX:
+                self.cmd_from_rpi = bytearray(payload)[0]
+                self.commands.append(self.cmd_from_rpi)
+                self.age = self.max_age
+        if self.age == 0:
+            if self.cmd_from_rpi is not None:
+                self.expired += 1
+            self.cmd_from_rpi = None
+        else:
+            self.age -= 1
@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+# Data set lists and timing for evaluating DORA neural networks
+# See more at https://github.com/oomwoo/
+#
+# Copyright (C) 2016 oomwoo.com
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version 3.0
+# as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License <http://www.gnu.org/licenses/> for details.
+"""
+Shared by quantize.py, graphopt.py and the training scripts
+    - read_file_list(): image files and labels of a Neon BatchWriter list
+      (train_file.csv.gz, val_file.csv.gz) in a local data set directory
+    - load_samples(): CNN inputs of image files, preprocessed like on the robot
+    - time_per_decision(): seconds per classify() call, one image at a time
+"""
+
+import os
+import gzip
+import time
+import numpy as np
+
+
+def read_file_list(csv_file_name, dataset_dir):
+    # Neon BatchWriter lists hold absolute paths from the PC that wrote them,
+    # keep class directory and file name only
+    file_names = []
+    labels = []
+    with gzip.open(csv_file_name) as f:
+        lines = f.read().decode().splitlines()[1:]
+    for l in lines:
+        path, label = l.rsplit(',', 1)
+        file_names.append(os.path.join(dataset_dir, *path.split('/')[-2:]))
+        labels.append(int(label))
+    return file_names, np.array(labels)
+
+
+def load_samples(file_names, W, H):
+    from preprocess import load_sample
+    return np.concatenate([load_sample(f, W, H) for f in file_names])
+
+
+def time_per_decision(model, x):
+    start_time = time.time()
+    for i in range(len(x)):
+        model.classify(x[i:i+1])
+    return (time.time() - start_time) / len(x)
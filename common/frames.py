@@ -0,0 +1,240 @@
+#!/usr/bin/env python
+# Stream camera frames into a small ring of preallocated buffers
+# See more at https://github.com/oomwoo/
+#
+# Copyright (C) 2016 oomwoo.com
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version 3.0
+# as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License <http://www.gnu.org/licenses/> for details.
+"""
+Continuous video-port frame capture
+    - the camera keeps streaming unencoded RGB frames from its video port
+    - each frame is copied into one of a few preallocated buffers
+    - the consumer (neural network) always takes the newest frame,
+      stale frames are dropped instead of queued
+    - recordings can save the capture time of every encoded frame
+Run this file to exercise the capture pipeline with a fake camera (no Pi needed).
+"""
+
+import threading
+import time
+import glob
+import numpy as np
+
+
+class FrameRing(object):
+    """Triple-buffered store of camera frames. The writer never blocks,
+    the reader always gets the newest complete frame."""
+    def __init__(self, height, width, nbuf=3):
+        self.frames = [np.empty((height, width, 3), dtype=np.uint8) for i in range(nbuf)]
+        self.times = [0.0] * nbuf
+        self.cond = threading.Condition()
+        self.write_idx = 0
+        self.latest = -1
+        self.reading = -1
+        self.seq = 0
+        self.last_read_seq = 0
+        self.dropped = 0
+
+    def next_buffer(self):
+        # Buffer the writer may fill, never the one being read
+        return self.frames[self.write_idx]
+
+    def commit(self, frame_time):
+        with self.cond:
+            self.times[self.write_idx] = frame_time
+            self.latest = self.write_idx
+            self.seq += 1
+            for i in range(len(self.frames)):
+                if i != self.latest and i != self.reading:
+                    self.write_idx = i
+                    break
+            self.cond.notify()
+
+    def get(self, timeout=1.0):
+        """Wait for a frame newer than the last one read.
+        Returns (frame, capture time) or (None, 0) on timeout.
+        The frame stays valid until the next call to get()."""
+        with self.cond:
+            if self.seq == self.last_read_seq:
+                self.cond.wait(timeout)
+            if self.seq == self.last_read_seq:
+                return None, 0
+            if self.last_read_seq > 0:
+                self.dropped += self.seq - self.last_read_seq - 1
+            self.last_read_seq = self.seq
+            self.reading = self.latest
+            return self.frames[self.reading], self.times[self.reading]
+
+
+class VideoPortOutput(object):
+    """picamera custom output, copies each unencoded RGB frame into a FrameRing
+    Usage: camera.start_recording(VideoPortOutput(ring, w, h), format='rgb')"""
+    def __init__(self, ring, width, height):
+        self.ring = ring
+        self.width = width
+        self.height = height
+        # picamera pads raw frames to multiples of 32 x 16 pixels
+        self.padded_width = (width + 31) // 32 * 32
+        self.padded_height = (height + 15) // 16 * 16
+        self.frame_size = self.padded_width * self.padded_height * 3
+        self.partial = bytearray()
+
+    def write(self, buf):
+        n = len(buf)
+        if not self.partial and n == self.frame_size:
+            # One whole frame, the usual case
+            self.store(buf)
+            return n
+        # Frames arrived in pieces or several at once, reassemble
+        self.partial.extend(buf)
+        while len(self.partial) >= self.frame_size:
+            self.store(self.partial[:self.frame_size])
+            del self.partial[:self.frame_size]
+        return n
+
+    def store(self, buf):
+        frame = np.frombuffer(buf, dtype=np.uint8, count=self.frame_size)
+        frame = frame.reshape(self.padded_height, self.padded_width, 3)
+        self.ring.next_buffer()[...] = frame[:self.height, :self.width]
+        self.ring.commit(time.time())
+
+    def flush(self):
+        pass
+
+
+class TimestampedOutput(object):
+    """picamera custom output, writes H.264 to video_file_name and the capture
+    time of each encoded frame, on the time.time() clock, one line per frame
+    to times_file_name
+    Usage: camera.start_recording(TimestampedOutput(camera, ...), format='h264')
+    camera.frame reports on splitter port 1, record on that port.
+    Open the camera with clock_mode='raw' (see hal.open_camera()); with
+    picamera's default 'reset', create the output right before start_recording()"""
+    def __init__(self, camera, video_file_name, times_file_name):
+        self.camera = camera
+        self.video = open(video_file_name, "wb")
+        self.times = open(times_file_name, "w")
+        if getattr(camera, "clock_mode", "reset") == "raw":
+            # Frame timestamps are microseconds on the camera clock
+            self.clock_offset = time.time() - camera.timestamp / 1e6
+        else:
+            # Microseconds since the recording started
+            self.clock_offset = time.time()
+        self.last_index = -1
+        self.frames = 0
+        self.dropped = 0
+
+    def write(self, buf):
+        self.video.write(buf)
+        frame = self.camera.frame
+        # Skip SPS headers (no timestamp) and frames written in pieces
+        if frame.complete and frame.timestamp is not None and frame.index != self.last_index:
+            if self.last_index >= 0:
+                self.dropped += max(0, frame.index - self.last_index - 1)
+            self.last_index = frame.index
+            self.frames += 1
+            self.times.write("%.6f\n" % (self.clock_offset + frame.timestamp / 1e6))
+        return len(buf)
+
+    def flush(self):
+        self.video.flush()
+        self.times.flush()
+
+    def close(self):
+        self.video.close()
+        self.times.close()
+
+
+class FakeCamera(object):
+    """Stand-in for picamera.PiCamera producing unencoded RGB frames
+    at the set frame rate, from a directory of images or synthetic"""
+    def __init__(self, image_dir=None):
+        self.resolution = (160, 120)
+        self.framerate = 30
+        self.hflip = False
+        self.vflip = False
+        self.led = False
+        self.exposure_mode = 'auto'
+        self.recording = False
+        self.image_file_names = []
+        if image_dir is not None:
+            self.image_file_names = sorted(glob.glob(image_dir + "*.jpg"))
+        self.thread = []
+
+    def start_recording(self, output, format='rgb', **kwargs):
+        if format != 'rgb':
+            raise ValueError("FakeCamera supports format='rgb' only")
+        self.recording = True
+        self.thread = threading.Thread(target=self.stream, args=(output,))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop_recording(self, **kwargs):
+        self.recording = False
+        if self.thread != []:
+            self.thread.join()
+            self.thread = []
+
+    def close(self):
+        self.stop_recording()
+
+    def frames(self):
+        w, h = self.resolution
+        pw = (w + 31) // 32 * 32
+        ph = (h + 15) // 16 * 16
+        padded = np.zeros((ph, pw, 3), dtype=np.uint8)
+        n = 0
+        while True:
+            if self.image_file_names:
+                from PIL import Image
+                name = self.image_file_names[n % len(self.image_file_names)]
+                image = Image.open(name).convert("RGB").resize((w, h))
+                padded[:h, :w] = np.asarray(image)
+            else:
+                # Moving gradient
+                padded[:h, :w] = ((np.arange(w) + 4 * n) % 256).astype(np.uint8)[None, :, None]
+            n += 1
+            yield padded.tobytes()
+
+    def stream(self, output):
+        period = 1.0 / self.framerate
+        next_time = time.time()
+        for buf in self.frames():
+            if not self.recording:
+                break
+            output.write(buf)
+            next_time += period
+            time.sleep(max(0, next_time - time.time()))
+
+
+if __name__ == "__main__":
+    # Consume fake camera frames with a slow "neural network",
+    # report decision rate, latency and dropped frames
+    w = 160
+    h = 120
+    seconds = 5
+    decision_time = 0.05
+    camera = FakeCamera()
+    camera.resolution = (w, h)
+    ring = FrameRing(h, w)
+    camera.start_recording(VideoPortOutput(ring, w, h), format='rgb')
+    start_time = time.time()
+    decisions = 0
+    latency = 0
+    while time.time() - start_time < seconds:
+        frame, frame_time = ring.get()
+        if frame is None:
+            continue
+        time.sleep(decision_time)
+        latency += time.time() - frame_time
+        decisions += 1
+    camera.stop_recording()
+    print("%.1f decisions/s, %.1f ms capture-to-decision, %d frames dropped" %
+          (decisions / (time.time() - start_time), 1000 * latency / max(decisions, 1), ring.dropped))
@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+# Compile a trained Neon model into an inference-only model at load time
+# See more at https://github.com/oomwoo/
+#
+# Copyright (C) 2016 oomwoo.com
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version 3.0
+# as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License <http://www.gnu.org/licenses/> for details.
+"""
+Load-time graph optimization for the Neon engine
+    - reads the layers and weights of an existing .prm file, any architecture
+    - batch norm statistics folded into convolution/linear weights and biases
+      (same folding as the NumPy engine, see fold_layers() in npengine.py)
+    - rectified linear activation fused with the bias into one elementwise pass
+    - builds an equivalent Neon model without BatchNorm/Activation layers,
+      usable for inference only
+Usage: python graphopt.py [options] model.prm
+    Compares the compiled model with the model as trained on test images
+    and the validation set: output difference, decisions, time per decision.
+"""
+
+import os
+import sys
+import getopt
+import time
+import numpy as np
+from neon.initializers import Constant
+from neon.layers import Activation, Bias, Convolution, Linear, Pooling
+from neon.models import Model
+from neon.transforms import Softmax
+from npengine import load_prm, fold_layers
+
+
+def usage():
+    print("python graphopt.py [options] model.prm")
+    print("  Compare compiled (batch norm folded, ReLU fused) model with the model as trained")
+    print("  -t image_dir: unlabeled test images *.jpg, default train/test/image")
+    print("  -d dataset_dir: validation images, default train/dataset")
+    print("  -n neon_dir: directory with val_file.csv.gz, default train/neon")
+    print("  -?: print usage")
+
+
+class BiasRectlin(Bias):
+    """Bias followed by rectified linear activation, one pass over the outputs"""
+    def fprop(self, inputs, inference=False):
+        self.outputs = self.inputs = inputs
+        if self.y is None or self.y.base is not self.outputs:
+            # Bias per channel: (K*P*Q, N) outputs viewed as (K, P*Q*N)
+            self.y = self.outputs.reshape((self.W.shape[0], -1))
+        self.y[:] = self.be.maximum(self.y + self.W, 0)
+        return self.outputs
+
+
+def compile_model(param_file_name):
+    """Inference-only Neon model equivalent to the one saved in param_file_name.
+    Call gen_backend() first."""
+    prm = load_prm(param_file_name)
+    ops = fold_layers(prm)
+    layers = []
+    params = []  # (layer, folded weights) set once buffers are allocated
+    for i, op in enumerate(ops):
+        if op['op'] in ['conv', 'affine']:
+            K = op['W'].shape[0]
+            if op['op'] == 'conv':
+                layer = Convolution((op['R'], op['S'], K), strides=op['stride'],
+                                    padding=op['pad'], init=Constant(0))
+                params.append((layer, op['W'].T))  # Neon layout (C*R*S, K)
+            else:
+                layer = Linear(nout=K, init=Constant(0))
+                params.append((layer, op['W']))
+            bias = BiasRectlin(init=Constant(0)) if op['relu'] else Bias(init=Constant(0))
+            params.append((bias, op['b'].reshape(K, 1)))
+            layers += [layer, bias]
+        elif op['op'] == 'pool':
+            layers.append(Pooling((op['R'], op['S']), op=op['mode'], strides=op['stride']))
+        elif op['op'] == 'softmax':
+            layers.append(Activation(Softmax()))
+    model = Model(layers=layers)
+    model.initialize(tuple(prm['train_input_shape']))
+    for layer, value in params:
+        layer.W.set(np.ascontiguousarray(value, dtype=np.float32))
+    return model
+
+
+if __name__ == "__main__":
+    import glob
+    from neon.backends import gen_backend
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+    from inference import InferenceSession
+    from preprocess import load_sample
+    from evaluate import read_file_list, load_samples, time_per_decision
+
+    my_dir = os.path.expanduser("~") + "/dora/train/"
+    image_dir = my_dir + "test/image/"
+    dataset_dir = my_dir + "dataset/"
+    neon_dir = my_dir + "neon/"
+    opts, args = getopt.getopt(sys.argv[1:], "t:d:n:?")
+    for opt, arg in opts:
+        if opt == '-t':
+            image_dir = arg
+        elif opt == '-d':
+            dataset_dir = arg
+        elif opt == '-n':
+            neon_dir = arg
+        elif opt == '-?':
+            usage()
+            sys.exit(2)
+    if len(args) != 1:
+        usage()
+        sys.exit(2)
+    param_file_name = args[0]
+
+    gen_backend(backend='cpu', batch_size=1)
+    lshape = tuple(load_prm(param_file_name)['train_input_shape'])
+    C, H, W = lshape
+    start_time = time.time()
+    trained = InferenceSession(Model(layers=param_file_name), lshape)
+    trained_load_time = time.time() - start_time
+    start_time = time.time()
+    compiled = InferenceSession(compile_model(param_file_name), lshape)
+    compiled_load_time = time.time() - start_time
+    print("Loaded in %.2f s as trained, %.2f s compiled" % (trained_load_time, compiled_load_time))
+
+    def compare(name, x, labels=None):
+        out = np.array([trained.classify(x[i:i+1]) for i in range(len(x))])
+        out_compiled = np.array([compiled.classify(x[i:i+1]) for i in range(len(x))])
+        decisions = out.argmax(axis=1)
+        print("%s: %d images" % (name, len(x)))
+        print("  max output difference %g, compiled agrees on %.1f%% of decisions" %
+              (np.max(np.abs(out - out_compiled)), 100.0 * np.mean(decisions == out_compiled.argmax(axis=1))))
+        if labels is not None:
+            print("  misclassification as trained %.1f%%, compiled %.1f%%" %
+                  (100.0 * np.mean(decisions != labels), 100.0 * np.mean(out_compiled.argmax(axis=1) != labels)))
+        trained_time = time_per_decision(trained, x)
+        compiled_time = time_per_decision(compiled, x)
+        print("  as trained %.3f ms, compiled %.3f ms per decision, %.2fx faster" %
+              (1000 * trained_time, 1000 * compiled_time, trained_time / compiled_time))
+
+    file_names = sorted(glob.glob(os.path.join(image_dir, "*.jpg")))
+    if file_names:
+        compare("Test images", np.concatenate([load_sample(f, W, H) for f in file_names]))
+    val_file_name = neon_dir + "val_file.csv.gz"
+    if os.path.exists(val_file_name):
+        file_names, labels = read_file_list(val_file_name, dataset_dir)
+        compare("Validation set", load_samples(file_names, W, H), labels)
@@ -0,0 +1,371 @@
+#!/usr/bin/env python
+# Hardware abstraction: camera, motor HAT and serial port, real or simulated
+# See more at https://github.com/oomwoo/
+#
+# Copyright (C) 2016 oomwoo.com
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version 3.0
+# as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License <http://www.gnu.org/licenses/> for details.
+"""
+Robot hardware behind one switch, so the control, recording and autonomy
+code runs (and can be profiled) on a Linux PC
+    - camera: "picamera", or replay of an .h264 recording or a directory
+      of images, or "fake" (moving gradient), at camera.framerate
+    - motors: "adafruit" (Motor HAT) or "sim", which records each command
+      with its time, saved to motor_log at exit if set
+    - serial: a device such as /dev/ttyAMA0, or "pty" (a pseudo-terminal,
+      the peer opens the printed /dev/pts/N), or "pipe" (in-process, the
+      peer is port.peer)
+    - webiopi: the real module, or a shim where macros are plain functions
+The defaults below may be overridden by environment variables
+DORA_CAMERA, DORA_MOTORS, DORA_SERIAL, DORA_MOTOR_LOG, e.g.
+    DORA_CAMERA=~/dora/train/video/rec00001.h264 DORA_MOTORS=sim python ...
+"""
+
+import os
+import io
+import re
+import time
+import glob
+import select
+import atexit
+import threading
+import collections
+import numpy as np
+
+
+camera_source = os.environ.get("DORA_CAMERA", "picamera")
+motor_backend = os.environ.get("DORA_MOTORS", "adafruit")
+serial_device = os.environ.get("DORA_SERIAL", "/dev/ttyAMA0")
+motor_log = os.environ.get("DORA_MOTOR_LOG", "")
+
+
+def open_camera(source=None, clock_mode='raw'):
+    """picamera.PiCamera, or a ReplayCamera for any other source.
+    clock_mode 'raw': frame timestamps on the camera clock, like
+    camera.timestamp, whenever recordings on other ports started"""
+    if source is None:
+        source = camera_source
+    if source == "picamera":
+        import picamera
+        return picamera.PiCamera(clock_mode=clock_mode)
+    return ReplayCamera(None if source == "fake" else os.path.expanduser(source), clock_mode)
+
+
+class FrameInfo(object):
+    """Subset of picamera.PiVideoFrame used by TimestampedOutput"""
+    def __init__(self):
+        self.index = -1
+        self.timestamp = None
+        self.complete = False
+
+
+def split_nal_units(data):
+    """Annex B H.264 byte stream into NAL units, start codes included"""
+    starts = [m.start() for m in re.finditer(b"\x00\x00\x01", data)]
+    starts = [s - 1 if s > 0 and data[s - 1:s] == b"\x00" else s for s in starts]
+    return [data[a:b] for a, b in zip(starts, starts[1:] + [len(data)])]
+
+
+def is_picture(nal):
+    # Coded slice NAL unit types; the Pi encoder writes one slice per frame
+    i = nal.index(b"\x00\x00\x01") + 3
+    return bytearray(nal[i:i + 1])[0] & 0x1f in (1, 5)
+
+
+class ReplayCamera(object):
+    """Stand-in for picamera.PiCamera replaying a recording, images or
+    synthetic frames. Supports start_recording() on any splitter port with
+    format 'rgb' (padded like picamera), 'mjpeg' and, for .h264 sources,
+    'h264': the recorded NAL units are passed through, with camera.frame
+    set like picamera does. Frames loop at the end of the source.
+    hflip and vflip are ignored, recordings are mirrored already.
+    Like picamera, clock_mode 'reset' makes frame timestamps microseconds
+    since the recording started, 'raw' the camera clock (camera.timestamp)."""
+    def __init__(self, source=None, clock_mode='reset'):
+        self.source = source
+        self.clock_mode = clock_mode
+        self.resolution = (160, 120)
+        self.framerate = 30
+        self.hflip = False
+        self.vflip = False
+        self.led = False
+        self.iso = 0
+        self.exposure_mode = 'auto'
+        self.frame = FrameInfo()
+        self.start_time = time.time()
+        self.outputs = {}
+        self.lock = threading.Lock()
+        self.thread = []
+        self.running = False
+        self.nal_units = None
+        if source is not None and source.endswith(".h264"):
+            with open(source, "rb") as f:
+                self.nal_units = split_nal_units(f.read())
+
+    @property
+    def timestamp(self):
+        # Camera clock, microseconds since the camera was opened
+        return int((time.time() - self.start_time) * 1e6)
+
+    @property
+    def recording(self):
+        return 1 in self.outputs
+
+    def start_recording(self, output, format='h264', splitter_port=1, resize=None, **kwargs):
+        if format not in ['rgb', 'mjpeg', 'h264']:
+            raise ValueError("ReplayCamera does not support format '%s'" % format)
+        if format == 'h264' and self.nal_units is None:
+            raise ValueError("h264 recording needs an .h264 replay source")
+        with self.lock:
+            if splitter_port in self.outputs:
+                raise RuntimeError("Port %d is already in use" % splitter_port)
+            self.outputs[splitter_port] = (output, format, resize or self.resolution, time.time())
+            if not self.running:
+                self.running = True
+                self.thread = threading.Thread(target=self.stream)
+                self.thread.daemon = True
+                self.thread.start()
+
+    def stop_recording(self, splitter_port=1):
+        with self.lock:
+            self.outputs.pop(splitter_port, None)
+            stop = not self.outputs and self.running
+            if stop:
+                self.running = False
+        if stop:
+            self.thread.join()
+            self.thread = []
+
+    def close(self):
+        for port in list(self.outputs):
+            self.stop_recording(port)
+
+    def images(self):
+        """Endless (h, w, 3) uint8 frames of the source"""
+        w, h = self.resolution
+        n = 0
+        while True:
+            if self.source is None:
+                # Moving gradient
+                frame = np.zeros((h, w, 3), dtype=np.uint8)
+                frame[...] = ((np.arange(w) + 4 * n) % 256).astype(np.uint8)[None, :, None]
+                n += 1
+                yield frame
+            elif self.nal_units is not None:
+                from video import probe_video, decode_frames
+                nframes, vw, vh = probe_video(self.source)
+                for frame in decode_frames(self.source, vw, vh, nframes=nframes):
+                    yield frame
+            else:
+                from PIL import Image
+                file_names = sorted(glob.glob(os.path.join(self.source, "*.jpg")) +
+                                    glob.glob(os.path.join(self.source, "*.png")))
+                if not file_names:
+                    raise IOError("No images in " + self.source)
+                for file_name in file_names:
+                    yield np.asarray(Image.open(file_name).convert("RGB"))
+
+    def pictures(self):
+        """Endless lists of NAL units, each list ends with one coded picture"""
+        while True:
+            units = []
+            for nal in self.nal_units:
+                units.append(nal)
+                if is_picture(nal):
+                    yield units
+                    units = []
+
+    def stream(self):
+        from PIL import Image
+        period = 1.0 / self.framerate
+        next_time = time.time()
+        images = self.images()
+        pictures = self.pictures() if self.nal_units is not None else None
+        while self.running:
+            frame = next(images)
+            units = next(pictures) if pictures is not None else []
+            image = None
+            with self.lock:
+                outputs = list(self.outputs.values())
+            for output, format, (w, h), start_time in outputs:
+                if format == 'h264':
+                    self.write_h264(output, units, start_time)
+                    continue
+                if image is None or image.size != (w, h):
+                    image = Image.fromarray(frame)
+                    if image.size != (w, h):
+                        image = image.resize((w, h), Image.BILINEAR)
+                if format == 'rgb':
+                    padded = np.zeros(((h + 15) // 16 * 16, (w + 31) // 32 * 32, 3), dtype=np.uint8)
+                    padded[:h, :w] = np.asarray(image)
+                    output.write(padded.tobytes())
+                else:
+                    jpeg = io.BytesIO()
+                    image.save(jpeg, "JPEG")
+                    output.write(jpeg.getvalue())
+            next_time += period
+            time.sleep(max(0, next_time - time.time()))
+        images.close()  # Stops the decoder
+
+    def write_h264(self, output, units, start_time):
+        if self.clock_mode == 'raw':
+            timestamp = self.timestamp
+        else:
+            timestamp = int((time.time() - start_time) * 1e6)
+        for nal in units:
+            picture = is_picture(nal)
+            if picture:
+                self.frame.index += 1
+            self.frame.timestamp = timestamp if picture else None
+            self.frame.complete = True
+            output.write(nal)
+
+
+class SimMotor(object):
+    def __init__(self, hat, num):
+        self.hat = hat
+        self.num = num
+
+    def run(self, command):
+        self.hat.record(self.num, "run", command)
+
+    def setSpeed(self, speed):
+        self.hat.record(self.num, "speed", speed)
+
+
+class SimMotorHAT(object):
+    """Stand-in for Adafruit_MotorHAT, records (time, motor, what, value)"""
+    FORWARD = 1
+    BACKWARD = 2
+    BRAKE = 3
+    RELEASE = 4
+
+    def __init__(self, addr=0x60, log_file_name=None):
+        self.motors = [SimMotor(self, num) for num in range(1, 5)]
+        self.commands = collections.deque(maxlen=100000)
+        if log_file_name is None:
+            log_file_name = motor_log
+        if log_file_name:
+            atexit.register(self.save, log_file_name)
+
+    def getMotor(self, num):
+        return self.motors[num - 1]
+
+    def record(self, num, what, value):
+        self.commands.append((time.time(), num, what, value))
+
+    def save(self, file_name):
+        with open(file_name, "w") as f:
+            for t, num, what, value in list(self.commands):
+                f.write("%.6f M%d %s %d\n" % (t, num, what, value))
+
+
+def motor_hat_class(backend=None):
+    """Adafruit_MotorHAT, or SimMotorHAT; imported on use, rpi2vex has no HAT"""
+    if (backend or motor_backend) == "sim":
+        return SimMotorHAT
+    from Adafruit_MotorHAT import Adafruit_MotorHAT
+    return Adafruit_MotorHAT
+
+
+class StreamPort(object):
+    """Serial-port-like file descriptor pair: readline(), read(), write()
+    with pyserial's timeout semantics"""
+    def __init__(self, fd_in, fd_out, timeout=None, name=None):
+        self.fd_in = fd_in
+        self.fd_out = fd_out
+        self.timeout = timeout
+        self.name = name
+        self.buffer = b""
+        self.peer = None
+        self.fds = [fd_in, fd_out]
+
+    def fill(self, deadline):
+        # Read what is available, False on timeout or end of file
+        wait = None if deadline is None else max(0, deadline - time.time())
+        if not select.select([self.fd_in], [], [], wait)[0]:
+            return False
+        data = os.read(self.fd_in, 4096)
+        self.buffer += data
+        return len(data) > 0
+
+    def read(self, size=1):
+        deadline = None if self.timeout is None else time.time() + self.timeout
+        while len(self.buffer) < size and self.fill(deadline):
+            pass
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+    def readline(self):
+        deadline = None if self.timeout is None else time.time() + self.timeout
+        while b"\n" not in self.buffer and self.fill(deadline):
+            pass
+        i = self.buffer.find(b"\n") + 1 or len(self.buffer)
+        data, self.buffer = self.buffer[:i], self.buffer[i:]
+        return data
+
+    def write(self, data):
+        if not isinstance(data, bytes):
+            data = data.encode()
+        n = 0
+        while n < len(data):
+            n += os.write(self.fd_out, data[n:])
+        return n
+
+    @property
+    def in_waiting(self):
+        return len(self.buffer)
+
+    def close(self):
+        for fd in set(self.fds):
+            os.close(fd)
+
+
+def open_serial(device=None, baudrate=115200, timeout=3.0):
+    """pyserial port for a device, else a StreamPort"""
+    if device is None:
+        device = serial_device
+    if device == "pty":
+        import tty
+        master, slave = os.openpty()
+        tty.setraw(slave)
+        port = StreamPort(master, master, timeout, os.ttyname(slave))
+        port.fds.append(slave)  # Keep open, else reads fail until the peer opens it
+        print("Serial port simulated on pseudo-terminal " + port.name)
+        return port
+    if device == "pipe":
+        r1, w1 = os.pipe()
+        r2, w2 = os.pipe()
+        port = StreamPort(r1, w2, timeout, "pipe")
+        port.peer = StreamPort(r2, w1, timeout, "pipe peer")
+        return port
+    import serial
+    return serial.Serial(device, baudrate=baudrate, timeout=timeout)
+
+
+class WebiopiShim(object):
+    """Stands in for the webiopi module off the Pi: macros are plain functions"""
+    @staticmethod
+    def macro(func):
+        return func
+
+    @staticmethod
+    def debug(s):
+        print(s)
+
+    @staticmethod
+    def sleep(seconds):
+        time.sleep(seconds)
+
+
+try:
+    import webiopi
+except ImportError:
+    webiopi = WebiopiShim()
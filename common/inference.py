@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+# Run a trained neural network on one camera frame at a time
+# See more at https://github.com/oomwoo/
+#
+# Copyright (C) 2016 oomwoo.com
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version 3.0
+# as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License <http://www.gnu.org/licenses/> for details.
+"""
+Persistent inference session for a loaded Neon model
+    - owns a fixed backend input tensor, allocated once
+    - each frame is copied into it and the model's forward pass is called directly
+    - no ArrayIterator and no backend buffers created per frame
+"""
+
+import numpy as np
+
+
+class InferenceSession(object):
+    """Drop-in replacement for building an ArrayIterator and calling
+    model.get_outputs() for every frame"""
+    def __init__(self, model, lshape):
+        self.model = model
+        self.be = model.be
+        self.nin = int(np.prod(lshape))
+        self.model.initialize(lshape)
+        self.x = self.be.iobuf(self.nin)
+        self.x.lshape = lshape
+        self.host = np.zeros((self.nin, self.be.bsz), dtype=np.float32)
+
+    def classify(self, x):
+        """x: (1, C*H*W) CNN input, returns softmax output vector"""
+        self.host[:, 0] = x[0]
+        self.x.set(self.host)
+        out = self.model.fprop(self.x, inference=True)
+        return out.get()[:, 0]
+
+    def get_outputs(self, x):
+        """x: (N, C*H*W) CNN input, N up to the backend batch size,
+        returns (N, nclasses) softmax outputs"""
+        n = len(x)
+        self.host[:, :n] = x.T
+        self.x.set(self.host)
+        out = self.model.fprop(self.x, inference=True)
+        return out.get()[:, :n].T
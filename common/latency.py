@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# Per-stage latency of autonomous decisions, from frame capture to motor command
+# See more at https://github.com/oomwoo/
+#
+# Copyright (C) 2016 oomwoo.com
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version 3.0
+# as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License <http://www.gnu.org/licenses/> for details.
+"""
+Decision latency instrumentation
+    - the autonomous thread records one time.time() timestamp per stage
+      for every decision into a preallocated ring, no lock, no allocation
+    - stages: frame capture, frame taken by the thread, preprocessed,
+      network output, decision, motor (I2C) or serial command written
+    - summary() gives percentiles and histograms of each stage's duration,
+      dump() saves raw timestamps as CSV
+Usage: python latency.py latency.csv
+    Prints the summary of a dump.
+"""
+
+import sys
+import numpy as np
+
+
+stages = ["capture", "start", "preprocess", "inference", "decision", "actuate"]
+percentiles = [50, 90, 99]
+histogram_bins = [0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000]  # ms
+
+
+class LatencyRecorder(object):
+    """Ring of the last size decisions. One writer thread; readers take
+    a snapshot, skipping the row the writer may be overwriting."""
+    def __init__(self, size=4096):
+        self.times = np.zeros((size, len(stages)))
+        self.size = size
+        self.count = 0
+
+    def record(self, *times):
+        """One timestamp per stage, in order"""
+        self.times[self.count % self.size] = times
+        self.count += 1
+
+    def snapshot(self):
+        count = self.count
+        if count <= self.size - 1:
+            return self.times[:count].copy()
+        # Oldest first; the oldest row may be half overwritten, skip it
+        i = count % self.size
+        return np.concatenate((self.times[i + 1:], self.times[:i]))
+
+    def summary(self):
+        return summarize(self.snapshot())
+
+    def dump(self, file_name):
+        save(file_name, self.snapshot())
+
+
+def durations(times):
+    """ms spent in each stage after capture, and capture to actuation"""
+    d = 1000 * np.diff(times, axis=1)
+    total = 1000 * (times[:, -1] - times[:, 0])
+    return [("wait", d[:, 0])] + list(zip(stages[2:], d[:, 1:].T)) + [("total", total)]
+
+
+def summarize(times):
+    """{stage: {"50": ms, ..., "max": ms, "histogram": counts per bin}}"""
+    summary = {"decisions": len(times), "histogram_bins_ms": histogram_bins}
+    if len(times) == 0:
+        return summary
+    for name, d in durations(times):
+        stats = dict((str(p), round(float(v), 2)) for p, v in zip(percentiles, np.percentile(d, percentiles)))
+        stats["max"] = round(float(d.max()), 2)
+        stats["histogram"] = np.histogram(np.clip(d, 0, histogram_bins[-1]), histogram_bins)[0].tolist()
+        summary[name] = stats
+    return summary
+
+
+def save(file_name, times):
+    with open(file_name, "w") as f:
+        f.write(",".join(stages) + "\n")
+        for row in times:
+            f.write(",".join(["%.6f" % t for t in row]) + "\n")
+
+
+def load(file_name):
+    return np.loadtxt(file_name, delimiter=",", skiprows=1, ndmin=2)
+
+
+def print_summary(summary):
+    print("%d decisions, ms:   " % summary["decisions"] +
+          "".join(["%8s" % (p + "%") for p in map(str, percentiles)]) + "     max")
+    for name in ["wait"] + stages[2:] + ["total"]:
+        if name in summary:
+            s = summary[name]
+            print("%-20s" % name + "".join(["%8.2f" % s[str(p)] for p in percentiles]) + "%8.2f" % s["max"])
+    print("Histogram, ms: " + " ".join(["<%d" % b for b in histogram_bins[1:-1]] + [">=%d" % histogram_bins[-2]]))
+    for name in ["wait"] + stages[2:] + ["total"]:
+        if name in summary:
+            print("%-20s" % name + " ".join(["%d" % n for n in summary[name]["histogram"]]))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("python latency.py latency.csv")
+        sys.exit(2)
+    print_summary(summarize(load(sys.argv[1])))
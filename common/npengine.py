@@ -0,0 +1,251 @@
+#!/usr/bin/env python
+# Run trained DORA neural network using NumPy only, without Neon
+# See more at https://github.com/oomwoo/
+#
+# Copyright (C) 2016 oomwoo.com
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version 3.0
+# as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License <http://www.gnu.org/licenses/> for details.
+"""
+Pure-NumPy inference engine for models trained by Neon
+    - export a Neon .prm file into a flat .npz file
+      (batch norm folded into convolution/linear weights and biases)
+    - run the exported model using im2col (stride tricks) and matrix products
+Usage: python npengine.py [-o model.npz] [-t image_dir] model.prm
+"""
+
+import os
+import sys
+import getopt
+import json
+import pickle
+import time
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+
+
+bn_eps = 1e-3  # Neon BatchNorm default
+
+
+def usage():
+    print("python npengine.py [options] model.prm")
+    print("  Export Neon model for the NumPy inference engine")
+    print("  -o file_name.npz: output file, default model file name with .npz extension")
+    print("  -t image_dir: classify images in image_dir/<class>/*.jpg, report accuracy and time")
+    print("  -?: print usage")
+
+
+def load_prm(file_name):
+    # Neon .prm files are pickled dictionaries of NumPy arrays, no Neon needed to read
+    with open(file_name, 'rb') as f:
+        if sys.version_info[0] > 2:
+            return pickle.load(f, encoding='latin1')
+        return pickle.load(f)
+
+
+def get_param(config, name, key, default):
+    # Neon accepts strides/padding as int or {'str_h': ..., 'pad_h': ...} dict
+    value = config.get(name, default)
+    if isinstance(value, dict):
+        return value.get(key, default)
+    return value
+
+
+def fold_layers(prm):
+    """Convert serialized Neon layers into a list of inference ops.
+    Batch norm is folded into the preceding convolution/linear op
+    and rectified linear activation is fused into it."""
+    ops = []
+    for layer in prm['model']['config']['layers']:
+        kind = layer['type'].split('.')[-1]
+        config = layer['config']
+        params = layer.get('params', {})
+        if kind == 'Convolution':
+            R, S, K = config['fshape']
+            ops.append({'op': 'conv', 'R': R, 'S': S,
+                        'stride': get_param(config, 'strides', 'str_h', 1),
+                        'pad': get_param(config, 'padding', 'pad_h', 0),
+                        'W': np.array(params['W'], dtype=np.float32).T.copy(),
+                        'b': np.zeros(K, dtype=np.float32), 'relu': False})
+        elif kind == 'Linear':
+            ops.append({'op': 'affine',
+                        'W': np.array(params['W'], dtype=np.float32),
+                        'b': np.zeros(config['nout'], dtype=np.float32), 'relu': False})
+        elif kind == 'Bias':
+            ops[-1]['b'] += params['W'].ravel()
+        elif kind == 'BatchNorm':
+            op = ops[-1]
+            if op['relu']:
+                raise ValueError("Cannot fold batch norm following an activation")
+            scale = params['gamma'].ravel() / np.sqrt(params['gvar'].ravel() + config.get('eps', bn_eps))
+            op['W'] *= scale[:, None]
+            op['b'] = (op['b'] - params['gmean'].ravel()) * scale + params['beta'].ravel()
+        elif kind == 'Activation':
+            transform = config['transform']['type'].split('.')[-1]
+            if transform == 'Rectlin':
+                ops[-1]['relu'] = True
+            elif transform == 'Softmax':
+                ops.append({'op': 'softmax'})
+            else:
+                raise ValueError("Unsupported activation " + transform)
+        elif kind == 'Pooling':
+            fshape = config['fshape']
+            if isinstance(fshape, int):
+                fshape = (fshape, fshape)
+            ops.append({'op': 'pool', 'R': fshape[0], 'S': fshape[1],
+                        'stride': get_param(config, 'strides', 'str_h', fshape[0]),
+                        'mode': config.get('op', 'max')})
+        else:
+            raise ValueError("Unsupported layer " + kind)
+    return ops
+
+
+def export_prm(prm_file_name, npz_file_name):
+    prm = load_prm(prm_file_name)
+    ops = fold_layers(prm)
+    arrays = {}
+    for i, op in enumerate(ops):
+        for key in ['W', 'b']:
+            if key in op:
+                arrays[key + str(i)] = op.pop(key)
+    config = {'lshape': list(prm['train_input_shape']), 'ops': ops}
+    np.savez(npz_file_name, config=np.array(json.dumps(config)), **arrays)
+
+
+def conv(x, op):
+    # x: (C, N, H, W); im2col as a strided view, then one matrix product
+    if op['pad']:
+        p = op['pad']
+        x = np.pad(x, ((0, 0), (0, 0), (p, p), (p, p)), 'constant')
+    C, N, H, W = x.shape
+    R, S, stride = op['R'], op['S'], op['stride']
+    P = (H - R) // stride + 1
+    Q = (W - S) // stride + 1
+    sc, sn, sh, sw = x.strides
+    cols = as_strided(x, shape=(C, R, S, N, P, Q),
+                      strides=(sc, sh, sw, sn, sh * stride, sw * stride))
+    y = np.dot(op['W'], cols.reshape(C * R * S, N * P * Q))
+    y += op['b'][:, None]
+    if op['relu']:
+        np.maximum(y, 0, out=y)
+    return y.reshape(-1, N, P, Q)
+
+
+def pool(x, op):
+    C, N, H, W = x.shape
+    R, S, stride = op['R'], op['S'], op['stride']
+    P = (H - R) // stride + 1
+    Q = (W - S) // stride + 1
+    sc, sn, sh, sw = x.strides
+    windows = as_strided(x, shape=(C, N, P, Q, R, S),
+                         strides=(sc, sn, sh * stride, sw * stride, sh, sw))
+    if op['mode'] == 'max':
+        return windows.max(axis=(4, 5))
+    return windows.mean(axis=(4, 5))
+
+
+def affine(x, op):
+    if x.ndim == 4:
+        # (C, N, H, W) -> (N, C*H*W), same order as Neon
+        x = x.transpose(1, 0, 2, 3).reshape(x.shape[1], -1)
+    y = np.dot(x, op['W'].T)
+    y += op['b']
+    if op['relu']:
+        np.maximum(y, 0, out=y)
+    return y
+
+
+def softmax(x, op):
+    y = np.exp(x - x.max(axis=1, keepdims=True))
+    y /= y.sum(axis=1, keepdims=True)
+    return y
+
+
+def load_model(param_file_name):
+    """Load model exported next to the .prm file, or the .prm file itself"""
+    npz_file_name = os.path.splitext(param_file_name)[0] + ".npz"
+    if os.path.exists(npz_file_name):
+        return NumpyModel(npz_file_name)
+    return NumpyModel(param_file_name)
+
+
+class NumpyModel(object):
+    """Loads .npz exported by export_prm() (or a .prm file directly)
+    and runs inference on (N, C*H*W) float32 CNN input"""
+    def __init__(self, file_name):
+        if file_name.endswith('.prm'):
+            prm = load_prm(file_name)
+            self.ops = fold_layers(prm)
+            self.lshape = tuple(prm['train_input_shape'])
+        else:
+            data = np.load(file_name)
+            config = json.loads(str(data['config']))
+            self.ops = config['ops']
+            self.lshape = tuple(config['lshape'])
+            for i, op in enumerate(self.ops):
+                for key in ['W', 'b']:
+                    if key + str(i) in data:
+                        op[key] = data[key + str(i)]
+        self.fprops = {'conv': conv, 'pool': pool, 'affine': affine, 'softmax': softmax}
+
+    def get_outputs(self, x):
+        """x: (N, C*H*W) CNN input, returns (N, nclasses) softmax outputs"""
+        x = x.reshape((-1,) + self.lshape).transpose(1, 0, 2, 3)
+        for op in self.ops:
+            x = self.fprops[op['op']](x, op)
+        return x
+
+    def classify(self, x):
+        """x: (1, C*H*W) CNN input, returns softmax output vector"""
+        return self.get_outputs(x)[0]
+
+
+if __name__ == "__main__":
+    import glob
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+    from preprocess import load_sample
+
+    out_file_name = []
+    image_dir = []
+    opts, args = getopt.getopt(sys.argv[1:], "o:t:?")
+    for opt, arg in opts:
+        if opt == '-o':
+            out_file_name = arg
+        elif opt == '-t':
+            image_dir = arg
+        elif opt == '-?':
+            usage()
+            sys.exit(2)
+    if len(args) != 1:
+        usage()
+        sys.exit(2)
+
+    prm_file_name = args[0]
+    if out_file_name == []:
+        out_file_name = os.path.splitext(prm_file_name)[0] + ".npz"
+    export_prm(prm_file_name, out_file_name)
+    print("Exported " + out_file_name)
+
+    if image_dir != []:
+        model = NumpyModel(out_file_name)
+        C, H, W = model.lshape
+        correct = 0
+        total = 0
+        elapsed = 0
+        for label_dir in sorted(glob.glob(os.path.join(image_dir, "[0-9]*"))):
+            label = int(os.path.basename(label_dir))
+            for file_name in sorted(glob.glob(os.path.join(label_dir, "*.jpg"))):
+                x = load_sample(file_name, W, H)
+                start_time = time.time()
+                decision = model.classify(x).argmax()
+                elapsed += time.time() - start_time
+                correct += decision == label
+                total += 1
+        print("%d images, %.1f%% classified as labeled, %.3f ms per decision" %
+              (total, 100.0 * correct / max(total, 1), 1000 * elapsed / max(total, 1)))
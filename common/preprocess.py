@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+# Convert camera frames into neural network input
+# See more at https://github.com/oomwoo/
+#
+# Copyright (C) 2016 oomwoo.com
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version 3.0
+# as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License <http://www.gnu.org/licenses/> for details.
+"""
+Convert an RGB camera frame into CNN input, same transform for driving and training
+    - area-downsample w x h to W x H
+    - swap RGB to BGR
+    - lay out as channel, height, width (what ArrayIterator expects)
+    - subtract mean
+Downsampling is done as two small matrix products writing into a preallocated
+float32 buffer, no intermediate PIL images.
+Run this file to compare against the former PIL resize/split/merge chain.
+"""
+
+import numpy as np
+
+
+mean = 127
+
+
+def area_weights(n_in, n_out):
+    # (n_out, n_in) matrix averaging input pixels covered by each output pixel
+    scale = float(n_in) / n_out
+    m = np.zeros((n_out, n_in), dtype=np.float32)
+    for i in range(n_out):
+        start = i * scale
+        end = start + scale
+        for j in range(int(start), min(int(np.ceil(end)), n_in)):
+            m[i, j] = min(end, j + 1) - max(start, j)
+    return m / scale
+
+
+class Preprocessor(object):
+    """Converts (h, w, 3) uint8 RGB frames into a reused (1, 3*H*W) float32 CNN input"""
+    def __init__(self, W, H, w=160, h=120):
+        self.W = W
+        self.H = H
+        self.w = w
+        self.h = h
+        self.rows = area_weights(h, H)
+        self.cols = area_weights(w, W).T.copy()
+        self.rgb = np.empty((h, w * 3), dtype=np.float32)
+        self.tmp = np.empty((H, w * 3), dtype=np.float32)
+        self.x = np.empty((1, 3 * H * W), dtype=np.float32)
+        self.chw = self.x.reshape(3, H, W)
+
+    def __call__(self, frame):
+        """Returns CNN input; the buffer is overwritten by the next call"""
+        np.copyto(self.rgb, frame.reshape(self.h, self.w * 3))
+        np.dot(self.rows, self.rgb, out=self.tmp)
+        tmp = self.tmp.reshape(self.H, self.w, 3)
+        for c in range(3):
+            # BGR channel order
+            np.dot(tmp[:, :, 2 - c], self.cols, out=self.chw[c])
+        self.x -= mean
+        return self.x
+
+
+preprocessors = {}
+
+
+def preprocess(image, W, H):
+    """Convert a PIL image or (h, w, 3) RGB array of any size into CNN input"""
+    frame = np.asarray(image)
+    h, w = frame.shape[0:2]
+    key = (W, H, w, h)
+    if key not in preprocessors:
+        preprocessors[key] = Preprocessor(W, H, w, h)
+    return preprocessors[key](frame)
+
+
+def load_sample(file_name, W, H):
+    """Load image file as a (1, 3*H*W) CNN input"""
+    from PIL import Image
+    image = Image.open(file_name).convert("RGB")
+    return preprocess(image, W, H).copy()
+
+
+def to_image(x, W, H):
+    """CNN input back to a PIL image - this is what neural network "sees" """
+    from PIL import Image
+    image = x.reshape(3, H, W)[[2, 1, 0], :, :]
+    image = np.transpose(image, (1, 2, 0)) + mean
+    return Image.fromarray(np.uint8(np.clip(np.round(image), 0, 255)))
+
+
+if __name__ == "__main__":
+    # Compare against PIL ANTIALIAS resize on training images
+    import glob
+    import os
+    import sys
+    import time
+    from PIL import Image
+
+    W = 32
+    H = W
+    image_dir = os.path.expanduser("~") + "/dora/train/dataset/"
+    if len(sys.argv) > 1:
+        image_dir = sys.argv[1]
+    file_names = sorted(glob.glob(image_dir + "*/*.jpg"))[:200]
+
+    def pil_preprocess(image):
+        image = image.resize((W, H), Image.ANTIALIAS if hasattr(Image, "ANTIALIAS") else Image.LANCZOS)
+        r, g, b = image.split()
+        image = Image.merge("RGB", (b, g, r))
+        image = np.asarray(image, dtype=np.float32)
+        image = np.transpose(image, (2, 0, 1))
+        return image.reshape(1, 3*W*H) - mean
+
+    images = [Image.open(f).convert("RGB") for f in file_names]
+    frames = [np.asarray(image) for image in images]
+    diff = [np.abs(pil_preprocess(i) - preprocess(f, W, H)) for i, f in zip(images, frames)]
+    print("%d images: mean abs diff %.2f, max abs diff %.2f (pixel levels)" %
+          (len(diff), np.mean(diff), np.max(diff)))
+
+    start_time = time.time()
+    for image in images:
+        pil_preprocess(image)
+    pil_time = (time.time() - start_time) / len(images)
+    start_time = time.time()
+    for frame in frames:
+        preprocess(frame, W, H)
+    np_time = (time.time() - start_time) / len(images)
+    print("PIL %.3f ms, NumPy %.3f ms per frame" % (pil_time * 1000, np_time * 1000))
@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+# Live MJPEG preview of the robot camera
+# See more at https://github.com/oomwoo/
+#
+# Copyright (C) 2016 oomwoo.com
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version 3.0
+# as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License <http://www.gnu.org/licenses/> for details.
+"""
+MJPEG preview for the web UI
+    - the camera GPU encodes JPEG on its own splitter port, no CPU encoding
+    - JpegFrameOutput keeps only the newest complete JPEG
+    - PreviewServer streams it as multipart/x-mixed-replace to any number
+      of browsers, at most max_fps frames per second each
+    - /stream.mjpg?token=<token> only, like the joystick, see webauth.py
+"""
+
+import io
+import time
+import threading
+from webauth import new_token, authorized
+try:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+except ImportError:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+
+
+class JpegFrameOutput(object):
+    """picamera custom output for format='mjpeg'"""
+    def __init__(self):
+        self.frame = None
+        self.frames = 0
+        self.buffer = io.BytesIO()
+        self.cond = threading.Condition()
+
+    def write(self, buf):
+        if buf.startswith(b"\xff\xd8"):
+            # Start of a new JPEG, the buffered one is complete
+            self.buffer.truncate()
+            if self.buffer.tell():
+                with self.cond:
+                    self.frame = self.buffer.getvalue()
+                    self.frames += 1
+                    self.cond.notify_all()
+            self.buffer.seek(0)
+        return self.buffer.write(buf)
+
+    def flush(self):
+        pass
+
+    def wait(self, last_frames, timeout=1.0):
+        """(jpeg, frame count) newer than last_frames, or (None, last_frames)"""
+        with self.cond:
+            if self.frames == last_frames:
+                self.cond.wait(timeout)
+            if self.frames == last_frames:
+                return None, last_frames
+            return self.frame, self.frames
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class PreviewServer(object):
+    """Serves http://<robot>:port/stream.mjpg?token=<token>,
+    a new random token if None"""
+    def __init__(self, output, port, max_fps=10, token=None):
+        self.output = output
+        self.max_fps = max_fps
+        self.token = token or new_token()
+        self.sent = 0
+        self.rejected = 0
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/stream.mjpg":
+                    self.send_error(404)
+                    return
+                headers = dict((k.lower(), v) for k, v in self.headers.items())
+                if not authorized(self.path, headers, server.token):
+                    server.rejected += 1
+                    self.send_error(403)
+                    return
+                self.send_response(200)
+                self.send_header("Cache-Control", "no-cache")
+                self.send_header("Content-Type", "multipart/x-mixed-replace; boundary=FRAME")
+                self.end_headers()
+                server.stream(self.wfile)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("", port), Handler)
+        self.thread = threading.Thread(target=self.httpd.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stream(self, wfile):
+        last_frames = 0
+        next_time = time.time()
+        try:
+            while True:
+                # Throttle, frames arriving meanwhile are skipped
+                time.sleep(max(0, next_time - time.time()))
+                next_time = time.time() + 1.0 / self.max_fps
+                jpeg, last_frames = self.output.wait(last_frames)
+                if jpeg is None:
+                    continue
+                wfile.write(b"--FRAME\r\nContent-Type: image/jpeg\r\n")
+                wfile.write(("Content-Length: %d\r\n\r\n" % len(jpeg)).encode())
+                wfile.write(jpeg)
+                wfile.write(b"\r\n")
+                self.sent += 1
+        except IOError:
+            pass  # Browser went away
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
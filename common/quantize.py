@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+# Quantize trained DORA neural network to 8-bit integers
+# See more at https://github.com/oomwoo/
+#
+# Copyright (C) 2016 oomwoo.com
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version 3.0
+# as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License <http://www.gnu.org/licenses/> for details.
+"""
+Post-training int8 quantization for the NumPy inference engine
+    - weights: int8 with one scale per output channel
+    - activations: int8 with one scale per layer input, calibrated on training images
+    - convolution/linear layers multiply and accumulate in integers,
+      results are rescaled to the next layer's int8 scale
+    - NumPy has no fast integer matrix product, so when every possible sum of
+      int8 x int8 products is exactly representable in float32 the product
+      runs on float32 BLAS (still exact integer arithmetic), otherwise int32
+Usage: python quantize.py [options] model.prm
+    Writes model_int8.npz, reports agreement with the float model
+    on the validation set and time per decision.
+"""
+
+import os
+import sys
+import getopt
+import json
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+from npengine import NumpyModel, conv, pool, affine, softmax
+from evaluate import read_file_list, load_samples, time_per_decision
+
+
+qmax = 127
+exact_float_sum = 2 ** 24  # Integers up to this are exact in float32
+
+
+def usage():
+    print("python quantize.py [options] model.prm")
+    print("  Quantize model to int8, compare with float model")
+    print("  -d dir: image data set directory, default ~/dora/train/dataset/")
+    print("  -n dir: Neon data directory with train_file.csv.gz, val_file.csv.gz, default ~/dora/train/neon/")
+    print("  -c n: number of calibration images, default 500")
+    print("  -o file_name.npz: output file, default model file name with _int8.npz")
+    print("  -?: print usage")
+
+
+def quantize(x, scale):
+    return np.clip(np.round(x / scale), -qmax, qmax).astype(np.int32)
+
+
+def calibrate(model, x):
+    """Largest absolute input to each convolution/linear op of a float NumpyModel"""
+    ranges = []
+    x = x.reshape((-1,) + model.lshape).transpose(1, 0, 2, 3)
+    fprops = {'conv': conv, 'pool': pool, 'affine': affine, 'softmax': softmax}
+    for op in model.ops:
+        if op['op'] in ('conv', 'affine'):
+            ranges.append(float(np.max(np.abs(x))))
+        x = fprops[op['op']](x, op)
+    return ranges
+
+
+def quantize_ops(ops, ranges):
+    """Per-channel int8 weights, int32 biases and requantization multipliers"""
+    qops = []
+    in_scales = [r / qmax for r in ranges]
+    i = 0
+    for op in ops:
+        op = dict(op)
+        if op['op'] in ('conv', 'affine'):
+            s_in = in_scales[i]
+            s_w = np.abs(op['W']).max(axis=1) / qmax
+            s_w[s_w == 0] = 1
+            op['W'] = np.round(op['W'] / s_w[:, None]).astype(np.int8)
+            op['b'] = np.round(op['b'] / (s_w * s_in)).astype(np.int32)
+            # Accumulator scale, rescaled to the next layer input scale (float output if last)
+            op['scale'] = (s_w * s_in).astype(np.float32)
+            op['s_out'] = in_scales[i + 1] if i + 1 < len(in_scales) else 0
+            i += 1
+        qops.append(op)
+    return qops, in_scales[0]
+
+
+def save_quantized(file_name, qops, s_in, lshape):
+    arrays = {}
+    config_ops = []
+    for i, op in enumerate(qops):
+        op = dict(op)
+        for key in ['W', 'b', 'scale']:
+            if key in op:
+                arrays[key + str(i)] = op.pop(key)
+        config_ops.append(op)
+    config = {'lshape': list(lshape), 's_in': s_in, 'ops': config_ops}
+    np.savez(file_name, config=np.array(json.dumps(config)), **arrays)
+
+
+def qconv(q, op):
+    # q: (C, N, H, W) int8 activations; integer im2col matrix product
+    if op['pad']:
+        # Symmetric quantization, zero point is 0
+        p = op['pad']
+        q = np.pad(q, ((0, 0), (0, 0), (p, p), (p, p)), 'constant')
+    C, N, H, W = q.shape
+    R, S, stride = op['R'], op['S'], op['stride']
+    P = (H - R) // stride + 1
+    Q = (W - S) // stride + 1
+    sc, sn, sh, sw = q.strides
+    cols = as_strided(q, shape=(C, R, S, N, P, Q),
+                      strides=(sc, sh, sw, sn, sh * stride, sw * stride))
+    acc = np.dot(op['Wq'], cols.reshape(C * R * S, N * P * Q).astype(op['Wq'].dtype))
+    acc += op['b'][:, None]
+    return requantize(acc, op, op['scale'][:, None]).reshape(-1, N, P, Q)
+
+
+def qaffine(q, op):
+    if q.ndim == 4:
+        q = q.transpose(1, 0, 2, 3).reshape(q.shape[1], -1)
+    acc = np.dot(q.astype(op['Wq'].dtype), op['Wq'].T)
+    acc += op['b']
+    return requantize(acc, op, op['scale'])
+
+
+def requantize(acc, op, scale):
+    if op['relu']:
+        np.maximum(acc, 0, out=acc)
+    if not op['s_out']:
+        return acc * scale
+    return np.clip(np.round(acc * (scale / op['s_out'])), -qmax, qmax).astype(np.int8)
+
+
+class QuantizedModel(object):
+    """Loads model_int8.npz written by save_quantized(),
+    same interface as NumpyModel"""
+    def __init__(self, file_name):
+        data = np.load(file_name)
+        config = json.loads(str(data['config']))
+        self.lshape = tuple(config['lshape'])
+        self.s_in = config['s_in']
+        self.ops = config['ops']
+        for i, op in enumerate(self.ops):
+            for key in ['W', 'b', 'scale']:
+                if key + str(i) in data:
+                    op[key] = data[key + str(i)]
+            if 'W' in op:
+                exact = op['W'].shape[1] * qmax * qmax < exact_float_sum
+                op['Wq'] = op['W'].astype(np.float32 if exact else np.int32)
+        self.fprops = {'conv': qconv, 'pool': pool, 'affine': qaffine, 'softmax': softmax}
+
+    def get_outputs(self, x):
+        """x: (N, C*H*W) float CNN input, returns (N, nclasses) softmax outputs"""
+        q = quantize(x, self.s_in).astype(np.int8)
+        q = q.reshape((-1,) + self.lshape).transpose(1, 0, 2, 3)
+        for op in self.ops:
+            q = self.fprops[op['op']](q, op)
+        return q
+
+    def classify(self, x):
+        return self.get_outputs(x)[0]
+
+
+if __name__ == "__main__":
+    my_dir = os.path.expanduser("~") + "/dora/train/"
+    dataset_dir = my_dir + "dataset/"
+    neon_dir = my_dir + "neon/"
+    ncalib = 500
+    out_file_name = []
+    opts, args = getopt.getopt(sys.argv[1:], "d:n:c:o:?")
+    for opt, arg in opts:
+        if opt == '-d':
+            dataset_dir = arg
+        elif opt == '-n':
+            neon_dir = arg
+        elif opt == '-c':
+            ncalib = int(arg)
+        elif opt == '-o':
+            out_file_name = arg
+        elif opt == '-?':
+            usage()
+            sys.exit(2)
+    if len(args) != 1:
+        usage()
+        sys.exit(2)
+    param_file_name = args[0]
+    if out_file_name == []:
+        out_file_name = os.path.splitext(param_file_name)[0] + "_int8.npz"
+
+    model = NumpyModel(param_file_name)
+    C, H, W = model.lshape
+
+    # Calibrate on training images
+    file_names, labels = read_file_list(neon_dir + "train_file.csv.gz", dataset_dir)
+    idx = np.random.RandomState(0).permutation(len(file_names))[:ncalib]
+    x_calib = load_samples([file_names[i] for i in idx], W, H)
+    qops, s_in = quantize_ops(model.ops, calibrate(model, x_calib))
+    save_quantized(out_file_name, qops, s_in, model.lshape)
+    print("Calibrated on %d images, wrote %s" % (len(x_calib), out_file_name))
+
+    # Compare on validation set
+    qmodel = QuantizedModel(out_file_name)
+    file_names, labels = read_file_list(neon_dir + "val_file.csv.gz", dataset_dir)
+    x_val = load_samples(file_names, W, H)
+    float_decisions = model.get_outputs(x_val).argmax(axis=1)
+    int8_decisions = qmodel.get_outputs(x_val).argmax(axis=1)
+    print("Validation set: %d images" % len(x_val))
+    print("  int8 agrees with float model on %.1f%% of decisions" %
+          (100.0 * np.mean(float_decisions == int8_decisions)))
+    print("  misclassification float %.1f%%, int8 %.1f%%" %
+          (100.0 * np.mean(float_decisions != labels), 100.0 * np.mean(int8_decisions != labels)))
+    print("  float %.3f ms, int8 %.3f ms per decision" %
+          (1000 * time_per_decision(model, x_val), 1000 * time_per_decision(qmodel, x_val)))
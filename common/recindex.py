@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+# Index of robot recordings
+# See more at https://github.com/oomwoo/
+#
+# Copyright (C) 2016 oomwoo.com
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version 3.0
+# as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License <http://www.gnu.org/licenses/> for details.
+"""
+Recording index, kept next to the recordings
+    - next_id: next free recording number, allocating one is a tiny file write
+    - index.json: finished recordings with files, size, duration, command
+      counts, and whether they were uploaded
+Both files are replaced by atomic rename. The directory is scanned only once,
+at startup, to pick up recordings copied, deleted or left behind by a crash.
+Readers (bot2neon.py, replay.py) list recordings from the index; they rescan
+only if there is no index or files were added or removed since it was written
+(the directory is newer than index.json, two stat calls).
+Usage: python recindex.py [video_dir]
+    Print recordings in the index
+"""
+
+import os
+import sys
+import glob
+import json
+import threading
+from recordings import find_log, read_log
+
+
+index_file = "index.json"
+counter_file = "next_id"
+recording_exts = [".h264", ".cmd", ".txt", ".pts"]
+
+
+def write_atomic(file_name, s):
+    # Readers and a crash see the old or the new file, never a partial one
+    with open(file_name + ".tmp", "w") as f:
+        f.write(s)
+    os.rename(file_name + ".tmp", file_name)
+    # Newer than the directory entry change the rename made, see index_stale()
+    os.utime(file_name, None)
+
+
+def load_index(video_dir):
+    """Recordings in the index, None if there is no index"""
+    file_name = os.path.join(video_dir, index_file)
+    if not os.path.exists(file_name):
+        return None
+    with open(file_name) as f:
+        return json.load(f)
+
+
+def index_stale(video_dir):
+    """True if there is no index or files were added to or removed from
+    video_dir after the index was written"""
+    file_name = os.path.join(video_dir, index_file)
+    if not os.path.exists(file_name):
+        return True
+    return os.path.getmtime(video_dir) > os.path.getmtime(file_name)
+
+
+def list_recordings(video_dir, video_ext=".h264", prefix="rec", rescan=False):
+    """Video files of all recordings, from the index; the directory is scanned
+    and the index rewritten only if it is stale or rescan is set"""
+    if rescan or index_stale(video_dir):
+        index = RecordingIndex(os.path.join(video_dir, prefix), video_ext).recordings
+    else:
+        index = load_index(video_dir)
+    return sorted([os.path.join(video_dir, r["video"]) for r in index.values()])
+
+
+class RecordingIndex(object):
+    """Allocates recording file names prefix + 5 digits, indexes finished recordings"""
+    def __init__(self, prefix, video_ext=".h264"):
+        self.video_dir = os.path.dirname(prefix)
+        self.prefix = prefix
+        self.video_ext = video_ext
+        self.lock = threading.Lock()
+        if not os.path.isdir(self.video_dir):
+            os.makedirs(self.video_dir)
+        self.recordings = load_index(self.video_dir) or {}
+        self.next_id = 0
+        counter_file_name = os.path.join(self.video_dir, counter_file)
+        if os.path.exists(counter_file_name):
+            with open(counter_file_name) as f:
+                self.next_id = int(f.read())
+        self.reconcile()
+
+    def reconcile(self):
+        # Only scan of the directory
+        found = set()
+        for file_name in glob.glob(self.prefix + "[0-9]" * 5 + ".*"):
+            found.add(os.path.basename(file_name).split(".")[0])
+        name_len = len(os.path.basename(self.prefix))
+        ids = [int(name[name_len:]) + 1 for name in found]
+        self.next_id = max([self.next_id] + ids)
+        for name in list(self.recordings):
+            if name not in found:
+                del self.recordings[name]
+        for name in found:
+            if name not in self.recordings and os.path.exists(self.prefix + name[name_len:] + self.video_ext):
+                self.recordings[name] = self.describe(self.prefix + name[name_len:])
+        self.save_counter()
+        self.save()
+
+    def allocate(self):
+        """File name, without extension, for a new recording"""
+        with self.lock:
+            n = self.next_id
+            self.next_id += 1
+            self.save_counter()
+        return self.prefix + str(n).zfill(5)
+
+    def describe(self, base):
+        name = os.path.basename(base)
+        files = [name + ext for ext in recording_exts if os.path.exists(base + ext)]
+        entry = {"video": name + self.video_ext, "files": files,
+                 "size": sum([os.path.getsize(os.path.join(self.video_dir, f)) for f in files])}
+        try:
+            times, values, start_time, end_time = read_log(find_log(base + self.video_ext))
+            entry["time"] = start_time
+            entry["duration"] = end_time - start_time
+            entry["commands"] = dict((str(v), int((values == v).sum())) for v in set(values.tolist()))
+        except (IOError, OSError, IndexError, ValueError):
+            pass  # No log or empty log
+        return entry
+
+    def add(self, base):
+        """Index a finished recording"""
+        with self.lock:
+            self.recordings[os.path.basename(base)] = self.describe(base)
+            self.save()
+
+    def remove(self, base):
+        with self.lock:
+            self.recordings.pop(os.path.basename(base), None)
+            self.save()
+
+    def not_uploaded(self):
+        """{recording name: file names} of recordings not uploaded yet"""
+        with self.lock:
+            return dict((name, r["files"]) for name, r in self.recordings.items() if not r.get("uploaded"))
+
+    def mark_uploaded(self, names):
+        with self.lock:
+            for name in names:
+                if name in self.recordings:
+                    self.recordings[name]["uploaded"] = True
+            self.save()
+
+    def save_counter(self):
+        write_atomic(os.path.join(self.video_dir, counter_file), str(self.next_id))
+
+    def save(self):
+        write_atomic(os.path.join(self.video_dir, index_file),
+                     json.dumps(self.recordings, indent=1, sort_keys=True))
+
+
+if __name__ == "__main__":
+    video_dir = sys.argv[1] if len(sys.argv) > 1 else os.path.expanduser("~") + "/dora/rpi2/video/"
+    index = load_index(video_dir) or {}
+    for name in sorted(index):
+        r = index[name]
+        print("%s %8d bytes %6.1f s %s" % (name, r["size"], r.get("duration", 0), r.get("commands", {})))
+    print("%d recordings" % len(index))
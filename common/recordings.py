@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# Read robot recordings: command logs and video frame timing
+# See more at https://github.com/oomwoo/
+#
+# Copyright (C) 2016 oomwoo.com
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version 3.0
+# as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License <http://www.gnu.org/licenses/> for details.
+"""
+Read robot recordings
+    - parse command logs, binary (rec*.cmd) or text (rec*.txt),
+      one "<time> <command>" line per entry
+    - read capture times of video frames (rec*.pts), if recorded
+    - match each logged command to the video frame nearest in time
+    - or label each frame with the command in effect at its capture time
+"""
+
+import os
+import numpy as np
+from cmdlog import read_cmdlog, is_cmdlog, cmdlog_ext
+
+
+frame_times_ext = ".pts"  # One capture time per encoded frame
+
+
+def extract_command_value(s, cmd):
+    i = s.find(cmd)
+    if i == -1:
+        return -1
+    return int(s[i+1:i+3], 16)
+
+
+def extract_time(s):
+    i = s.find(' ')
+    return float(s[0:i])
+
+
+def find_log(video_file_name):
+    """Command log of a recording, binary if there is one"""
+    base = os.path.splitext(video_file_name)[0]
+    if os.path.exists(base + cmdlog_ext):
+        return base + cmdlog_ext
+    return base + ".txt"
+
+
+def read_log(log_file_name, cmd='u'):
+    """Returns (times, values) arrays of commands cmd in the log,
+    and times of the first and last log entries"""
+    if is_cmdlog(log_file_name):
+        records = read_cmdlog(log_file_name)
+        selected = records[records["cmd"] == ord(cmd)]
+        return (selected["time"].astype(np.float64), selected["value"].astype(np.int32),
+                float(records["time"][0]), float(records["time"][-1]))
+    with open(log_file_name) as f:
+        lines = f.read().splitlines()
+    times = []
+    values = []
+    for l in lines:
+        i = extract_command_value(l, cmd)
+        if i < 0:
+            continue
+        times.append(extract_time(l))
+        values.append(i)
+    return (np.array(times), np.array(values, dtype=np.int32),
+            extract_time(lines[0]), extract_time(lines[-1]))
+
+
+def read_frame_times(video_file_name):
+    """Capture time of each video frame, None if not recorded"""
+    file_name = os.path.splitext(video_file_name)[0] + frame_times_ext
+    if not os.path.exists(file_name):
+        return None
+    with open(file_name) as f:
+        return np.array([float(l) for l in f.read().split()])
+
+
+def align_frames(command_times, frame_times):
+    """Index of the frame nearest in time to each command.
+    frame_times must be sorted; on a tie the earlier frame wins."""
+    frame_times = np.asarray(frame_times)
+    command_times = np.asarray(command_times)
+    if len(frame_times) < 2:
+        return np.zeros(len(command_times), dtype=np.intp)
+    idx = np.searchsorted(frame_times, command_times)
+    np.clip(idx, 1, len(frame_times) - 1, out=idx)
+    earlier = command_times - frame_times[idx - 1] <= frame_times[idx] - command_times
+    return idx - earlier
+
+
+def commands_in_effect(command_times, values, frame_times, expiry):
+    """Value of the last command at or before each frame time, -1 where there
+    is none or it is more than expiry seconds old. command_times must be sorted."""
+    command_times = np.asarray(command_times)
+    frame_times = np.asarray(frame_times)
+    idx = np.searchsorted(command_times, frame_times, side='right') - 1
+    labels = np.full(len(frame_times), -1, dtype=np.int32)
+    valid = idx >= 0
+    valid[valid] = frame_times[valid] - command_times[idx[valid]] <= expiry
+    labels[valid] = np.asarray(values)[idx[valid]]
+    return labels
+
+
+def select_frames(frame_idx, values):
+    """(frame index, command value) pairs, each frame once, first command wins"""
+    seen = set()
+    selected = []
+    for i, value in zip(frame_idx, values):
+        if i in seen:
+            continue
+        seen.add(i)
+        selected.append((i, value))
+    return selected
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# Skip the neural network on frames that look like the last one it saw
+# See more at https://github.com/oomwoo/
+#
+# Copyright (C) 2016 oomwoo.com
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version 3.0
+# as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License <http://www.gnu.org/licenses/> for details.
+"""
+Scene-change gate for autonomous driving
+    - compares a coarse subsample of the camera frame (every step-th pixel)
+      with the same subsample of the last frame the network ran on
+    - mean absolute difference below threshold (0..255 intensity levels):
+      the cached network output is reused, preprocessing and inference skipped
+    - a cached output is never reused for longer than max_age seconds
+    - stats(): hit rate and time saved, estimated from the average time
+      of preprocessing + inference on frames that did run
+See train/replay.py -g to pick threshold and max_age on recorded drives.
+"""
+
+import numpy as np
+
+
+class SceneGate(object):
+    """check() before running the network, update() after"""
+    def __init__(self, threshold=2.0, max_age=0.3, step=8):
+        self.threshold = threshold
+        self.max_age = max_age
+        self.step = step
+        self.last = None
+        self.candidate = None
+        self.output = None
+        self.output_time = 0
+        self.hits = 0
+        self.misses = 0
+        self.infer_seconds = 0
+
+    def check(self, frame, frame_time):
+        """Cached output if the scene has not changed, else None:
+        run the network and call update()"""
+        small = frame[::self.step, ::self.step].astype(np.int16)
+        if (self.last is not None and frame_time - self.output_time <= self.max_age and
+                np.abs(small - self.last).mean() < self.threshold):
+            self.hits += 1
+            return self.output
+        self.candidate = (small, frame_time)
+        self.misses += 1
+        return None
+
+    def update(self, output, seconds=0):
+        """Network output for the frame last passed to check(), and the time it took"""
+        self.last, self.output_time = self.candidate
+        self.output = output
+        self.infer_seconds += seconds
+
+    def reset(self):
+        self.last = None
+
+    def stats(self):
+        total = self.hits + self.misses
+        saved = self.hits * self.infer_seconds / max(self.misses, 1)
+        return {"frames": total, "hit_rate": round(float(self.hits) / max(total, 1), 3),
+                "seconds_saved": round(saved, 2),
+                "percent_saved": round(100 * saved / max(saved + self.infer_seconds, 1e-9), 1)}
@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+# Tests of video frame capture times
+# See more at https://github.com/oomwoo/
+#
+# Copyright (C) 2016 oomwoo.com
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version 3.0
+# as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License <http://www.gnu.org/licenses/> for details.
+"""
+Tests of common/frames.py
+    - FrameRing: the reader gets the newest frame, the writer never
+      overwrites the frame being read
+    - VideoPortOutput: padded frames, frames split across or packed into writes
+    - TimestampedOutput recording from a ReplayCamera (common/hal.py) in both
+      picamera clock modes: frame times in the .pts file must fall between
+      the start and end of the command log, on the same clock.
+      ReplayCamera decodes its source, so these need avconv or ffmpeg;
+      skipped without one.
+Usage: python frames_test.py (or pytest)
+"""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+import numpy as np
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from frames import FrameRing, VideoPortOutput, TimestampedOutput
+from hal import ReplayCamera
+from cmdlog import CommandLog
+from recordings import read_log, read_frame_times
+from video import find_decoder
+
+
+sample_file_name = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "sample.h264")
+camera_uptime = 0.5  # Camera opened this long before recording
+seconds = 0.5
+fps = 30
+
+
+def have_decoder():
+    try:
+        find_decoder()
+        return True
+    except RuntimeError:
+        return False
+
+
+# Reported as skipped by pytest and by the runner below
+needs_decoder = unittest.skipUnless(have_decoder(), "no avconv or ffmpeg")
+
+
+def write_frame(ring, value, frame_time=0):
+    ring.next_buffer()[...] = value
+    ring.commit(frame_time)
+
+
+def padded_frame(w, h, value):
+    """Raw RGB frame as picamera writes it: padding filled with 255"""
+    frame = np.full(((h + 15) // 16 * 16, (w + 31) // 32 * 32, 3), 255, dtype=np.uint8)
+    frame[:h, :w] = value
+    return frame.tobytes()
+
+
+def test_ring_newest_wins():
+    ring = FrameRing(4, 6)
+    assert ring.get(0.01) == (None, 0)
+    write_frame(ring, 1, 1.0)
+    frame, frame_time = ring.get()
+    assert frame[0, 0, 0] == 1 and frame_time == 1.0
+    for value in (2, 3, 4):
+        write_frame(ring, value, float(value))
+    frame, frame_time = ring.get()
+    assert frame[0, 0, 0] == 4 and frame_time == 4.0
+    assert ring.dropped == 2
+    # Nothing newer yet
+    assert ring.get(0.01) == (None, 0)
+
+
+def test_ring_reading_not_overwritten():
+    ring = FrameRing(4, 6)
+    write_frame(ring, 1)
+    frame, frame_time = ring.get()
+    for value in range(2, 20):
+        assert ring.next_buffer() is not frame
+        write_frame(ring, value)
+    assert np.all(frame == 1)
+    frame, frame_time = ring.get()
+    assert np.all(frame == 19)
+
+
+def test_ring_threads():
+    # Every frame the reader gets stays whole while the writer keeps going
+    ring = FrameRing(16, 16)
+    stop = threading.Event()
+
+    def writer():
+        value = 0
+        while not stop.is_set():
+            value = (value + 1) % 256
+            write_frame(ring, value)
+    thread = threading.Thread(target=writer)
+    thread.start()
+    try:
+        for i in range(100):
+            frame, frame_time = ring.get()
+            value = frame[0, 0, 0]
+            time.sleep(0.001)
+            assert np.all(frame == value)
+    finally:
+        stop.set()
+        thread.join()
+    assert ring.dropped > 0
+
+
+def test_output_padded():
+    w, h = 100, 50  # Padded to 128 x 64
+    ring = FrameRing(h, w)
+    output = VideoPortOutput(ring, w, h)
+    data = padded_frame(w, h, 7)
+    assert len(data) == 128 * 64 * 3
+    assert output.write(data) == len(data)
+    frame, frame_time = ring.get()
+    assert frame.shape == (h, w, 3)
+    assert np.all(frame == 7)
+
+
+def test_output_pieces():
+    w, h = 64, 32
+    ring = FrameRing(h, w)
+    output = VideoPortOutput(ring, w, h)
+    data = padded_frame(w, h, 1) + padded_frame(w, h, 2)
+    # One and a half frames, then the rest
+    i = len(data) * 3 // 4
+    output.write(data[:i])
+    assert ring.seq == 1
+    output.write(data[i:])
+    assert ring.seq == 2
+    frame, frame_time = ring.get()
+    assert np.all(frame == 2)
+
+
+def test_output_several_frames():
+    w, h = 64, 32
+    ring = FrameRing(h, w)
+    output = VideoPortOutput(ring, w, h)
+    data = b"".join(padded_frame(w, h, value) for value in (1, 2, 3))
+    # A piece first: the rest of it and three frames left over in one write
+    output.write(data[:100])
+    output.write(data[100:] + padded_frame(w, h, 4)[:100])
+    assert ring.seq == 3
+    frame, frame_time = ring.get()
+    assert np.all(frame == 3)
+    assert len(output.partial) == 100
+
+
+def record(clock_mode):
+    """Records like dora.py: command log started, then the video.
+    Returns frame times, log start and end times, frames written"""
+    work_dir = tempfile.mkdtemp()
+    try:
+        camera = ReplayCamera(sample_file_name, clock_mode)
+        camera.framerate = fps
+        time.sleep(camera_uptime)
+        log = CommandLog(os.path.join(work_dir, "rec00000.cmd"))
+        log.write('L', 3)
+        video_file_name = os.path.join(work_dir, "rec00000.h264")
+        output = TimestampedOutput(camera, video_file_name, os.path.join(work_dir, "rec00000.pts"))
+        camera.start_recording(output, format='h264', splitter_port=1)
+        time.sleep(seconds)
+        camera.stop_recording(splitter_port=1)
+        output.close()
+        log.write('L', 4)
+        log.close()
+        times, values, start_time, end_time = read_log(os.path.join(work_dir, "rec00000.cmd"), 'u')
+        return read_frame_times(video_file_name), start_time, end_time, output.frames
+    finally:
+        shutil.rmtree(work_dir)
+
+
+def check_frame_times(clock_mode):
+    pts, start_time, end_time, frames = record(clock_mode)
+    assert len(pts) == frames > 0
+    # First frame right after the log started, not camera_uptime off
+    assert start_time <= pts[0] < start_time + 0.1
+    assert pts[-1] <= end_time
+    assert np.all(np.diff(pts) > 0)
+
+
+@needs_decoder
+def test_reset_clock():
+    check_frame_times('reset')
+
+
+@needs_decoder
+def test_raw_clock():
+    check_frame_times('raw')
+
+
+if __name__ == "__main__":
+    tests = sorted(name for name in dir() if name.startswith("test_"))
+    skipped = 0
+    for name in tests:
+        try:
+            globals()[name]()
+            print("%s passed" % name)
+        except unittest.SkipTest as e:
+            print("%s skipped, %s" % (name, e))
+            skipped += 1
+    print("%d tests passed, %d skipped" % (len(tests) - skipped, skipped))
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# Tests of the MJPEG preview server
+# See more at https://github.com/oomwoo/
+#
+# Copyright (C) 2016 oomwoo.com
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version 3.0
+# as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License <http://www.gnu.org/licenses/> for details.
+"""
+Tests of common/preview.py on localhost, no camera needed.
+Usage: python preview_test.py (or pytest)
+"""
+
+import os
+import sys
+import socket
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from preview import JpegFrameOutput, PreviewServer
+
+
+jpeg = b"\xff\xd8" + b"\x00" * 100 + b"\xff\xd9"
+
+
+def get(port, path, origin=None):
+    """Status and the start of the response body"""
+    sock = socket.create_connection(("localhost", port))
+    request = "GET %s HTTP/1.1\r\nHost: localhost:%d\r\n" % (path, port)
+    if origin:
+        request += "Origin: %s\r\n" % origin
+    sock.sendall((request + "\r\n").encode())
+    f = sock.makefile("rb")
+    status = int(f.readline().split()[1])
+    while f.readline().strip():
+        pass
+    body = b""
+    if status == 200:
+        # --FRAME, Content-Type, Content-Length, blank line, then the JPEG
+        body = b"".join(f.readline() for i in range(4)) + f.read(len(jpeg))
+    sock.close()
+    return status, body
+
+
+def start_server():
+    output = JpegFrameOutput()
+    # Two frames: the first is complete once the second starts
+    output.write(jpeg)
+    output.write(jpeg)
+    server = PreviewServer(output, 0, 100, token="secret")
+    return server, server.httpd.server_address[1]
+
+
+def test_stream_with_token():
+    server, port = start_server()
+    try:
+        status, body = get(port, "/stream.mjpg?token=secret")
+        assert status == 200
+        assert b"--FRAME" in body and jpeg in body
+    finally:
+        server.close()
+
+
+def test_rejected():
+    server, port = start_server()
+    try:
+        assert get(port, "/stream.mjpg")[0] == 403
+        assert get(port, "/stream.mjpg?token=guess")[0] == 403
+        assert get(port, "/stream.mjpg?token=secret", "http://example.com")[0] == 403
+        assert get(port, "/other?token=secret")[0] == 404
+        assert server.rejected == 3
+        assert server.sent == 0
+    finally:
+        server.close()
+
+
+if __name__ == "__main__":
+    tests = sorted(name for name in dir() if name.startswith("test_"))
+    for name in tests:
+        globals()[name]()
+        print("%s passed" % name)
+    print("%d tests passed" % len(tests))
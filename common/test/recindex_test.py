@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# Tests of the recording index
+# See more at https://github.com/oomwoo/
+#
+# Copyright (C) 2016 oomwoo.com
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version 3.0
+# as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License <http://www.gnu.org/licenses/> for details.
+"""
+Tests of common/recindex.py, no camera needed.
+Usage: python recindex_test.py (or pytest)
+"""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from recindex import RecordingIndex, list_recordings, load_index, index_stale
+
+
+def touch(file_name):
+    open(file_name, "w").close()
+
+
+def test_list_without_index():
+    work_dir = tempfile.mkdtemp()
+    try:
+        touch(os.path.join(work_dir, "rec00001.h264"))
+        touch(os.path.join(work_dir, "rec00000.h264"))
+        touch(os.path.join(work_dir, "rec00000.txt"))
+        assert list_recordings(work_dir) == [os.path.join(work_dir, "rec00000.h264"),
+                                             os.path.join(work_dir, "rec00001.h264")]
+    finally:
+        shutil.rmtree(work_dir)
+
+
+def test_list_from_index():
+    work_dir = tempfile.mkdtemp()
+    try:
+        index = RecordingIndex(os.path.join(work_dir, "rec"))
+        for i in range(2):
+            base = index.allocate()
+            touch(base + ".h264")
+            index.add(base)
+        assert not index_stale(work_dir)
+        # Read from the index, not the directory
+        with open(os.path.join(work_dir, "index.json"), "w") as f:
+            f.write('{"rec00005": {"video": "rec00005.h264", "files": []}}')
+        assert list_recordings(work_dir) == [os.path.join(work_dir, "rec00005.h264")]
+        assert list_recordings(work_dir, rescan=True) == [os.path.join(work_dir, "rec00000.h264"),
+                                                          os.path.join(work_dir, "rec00001.h264")]
+    finally:
+        shutil.rmtree(work_dir)
+
+
+def test_list_rescans_stale_index():
+    work_dir = tempfile.mkdtemp()
+    try:
+        index = RecordingIndex(os.path.join(work_dir, "rec"))
+        base = index.allocate()
+        touch(base + ".h264")
+        index.add(base)
+        # Copied in from another robot after the index was written, and one deleted
+        time.sleep(0.01)
+        touch(os.path.join(work_dir, "rec00007.h264"))
+        os.remove(os.path.join(work_dir, "rec00000.h264"))
+        assert index_stale(work_dir)
+        assert list_recordings(work_dir) == [os.path.join(work_dir, "rec00007.h264")]
+        assert not index_stale(work_dir)
+        assert sorted(load_index(work_dir)) == ["rec00007"]
+    finally:
+        shutil.rmtree(work_dir)
+
+
+def test_upload_marks():
+    work_dir = tempfile.mkdtemp()
+    try:
+        index = RecordingIndex(os.path.join(work_dir, "rec"))
+        for i in range(2):
+            base = index.allocate()
+            touch(base + ".h264")
+            touch(base + ".txt")
+            index.add(base)
+        assert index.not_uploaded() == {"rec00000": ["rec00000.h264", "rec00000.txt"],
+                                        "rec00001": ["rec00001.h264", "rec00001.txt"]}
+        index.mark_uploaded(["rec00000"])
+        assert list(index.not_uploaded()) == ["rec00001"]
+        # Kept across restarts
+        assert list(RecordingIndex(os.path.join(work_dir, "rec")).not_uploaded()) == ["rec00001"]
+    finally:
+        shutil.rmtree(work_dir)
+
+
+def test_reconcile():
+    work_dir = tempfile.mkdtemp()
+    try:
+        prefix = os.path.join(work_dir, "rec")
+        touch(prefix + "00003.h264")
+        index = RecordingIndex(prefix)
+        assert sorted(index.recordings) == ["rec00003"]
+        assert index.allocate() == prefix + "00004"
+    finally:
+        shutil.rmtree(work_dir)
+
+
+if __name__ == "__main__":
+    tests = sorted(name for name in dir() if name.startswith("test_"))
+    for name in tests:
+        globals()[name]()
+        print("%s passed" % name)
+    print("%d tests passed" % len(tests))
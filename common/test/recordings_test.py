@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+# Tests of command log reading and command/frame alignment
+# See more at https://github.com/oomwoo/
+#
+# Copyright (C) 2016 oomwoo.com
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version 3.0
+# as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License <http://www.gnu.org/licenses/> for details.
+"""
+Tests of common/recordings.py, no camera or video decoder needed.
+Usage: python recordings_test.py (or pytest)
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+import numpy as np
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from recordings import read_log, align_frames, select_frames, commands_in_effect
+from cmdlog import CommandLog
+
+
+def test_align_inside():
+    frame_times = [0.0, 1.0, 2.0, 3.0]
+    assert list(align_frames([0.4, 0.6, 1.5, 2.9], frame_times)) == [0, 1, 1, 3]
+
+
+def test_align_edges():
+    frame_times = [0.0, 1.0, 2.0, 3.0]
+    # Exactly on the first and last frame, and a tie (earlier frame wins)
+    assert list(align_frames([0.0, 3.0, 2.5], frame_times)) == [0, 3, 2]
+
+
+def test_commands_before_first_frame():
+    assert list(align_frames([-5.0, -0.1], [0.0, 1.0, 2.0])) == [0, 0]
+
+
+def test_commands_after_last_frame():
+    assert list(align_frames([2.1, 100.0], [0.0, 1.0, 2.0])) == [2, 2]
+
+
+def test_frames_before_first_command():
+    # Frames 0 and 1 precede every command and get no label
+    frame_times = [0.0, 1.0, 2.0, 3.0, 4.0]
+    selected = select_frames(align_frames([2.1, 3.9], frame_times), [1, 2])
+    assert selected == [(2, 1), (4, 2)]
+
+
+def test_select_nearest_frame():
+    # Irregular frame spacing, like an encoder dropping frames
+    frame_times = np.array([0.0, 0.03, 0.07, 0.2, 0.23])
+    command_times = np.array([0.01, 0.045, 0.06, 0.14, 0.22])
+    idx = align_frames(command_times, frame_times)
+    for i, t in zip(idx, command_times):
+        assert i == np.argmin(np.abs(frame_times - t))
+    assert select_frames(idx, [0, 1, 2, 3, 1]) == [(0, 0), (1, 1), (2, 2), (3, 3), (4, 1)]
+
+
+def test_select_first_command_wins():
+    frame_times = [0.0, 1.0, 2.0]
+    selected = select_frames(align_frames([0.9, 1.1, 1.2], frame_times), [1, 2, 3])
+    assert selected == [(1, 1)]
+
+
+def test_align_single_frame():
+    assert list(align_frames([0.5, 7.0], [1.0])) == [0, 0]
+
+
+def test_align_linear_time():
+    # A day of driving: 1M commands against 100k frames in well under a second
+    frame_times = np.arange(100000) / 30.0
+    command_times = np.sort(np.random.RandomState(0).uniform(0, frame_times[-1], 1000000))
+    idx = align_frames(command_times, frame_times)
+    assert np.all(np.abs(frame_times[idx] - command_times) <= 0.5 / 30 + 1e-9)
+
+
+def test_in_effect():
+    # Held commands repeat every 0.02 s; frame 2 is on a command, frame 3 between commands
+    command_times = [1.0, 1.02, 1.04, 2.0]
+    frame_times = [0.5, 1.01, 1.02, 1.03, 1.5, 2.01]
+    labels = commands_in_effect(command_times, [1, 1, 2, 3], frame_times, 0.1)
+    assert list(labels) == [-1, 1, 1, 1, -1, 3]
+
+
+def test_in_effect_expiry():
+    frame_times = [1.0, 1.05, 1.09, 1.15, 10.0]
+    assert list(commands_in_effect([1.0], [2], frame_times, 0.1)) == [2, 2, 2, -1, -1]
+    assert list(commands_in_effect([1.0], [2], frame_times, 100)) == [2, 2, 2, 2, 2]
+
+
+def test_in_effect_no_commands():
+    assert list(commands_in_effect([], [], [0.0, 1.0], 0.1)) == [-1, -1]
+
+
+def test_read_text_log():
+    work_dir = tempfile.mkdtemp()
+    try:
+        file_name = os.path.join(work_dir, "rec00000.txt")
+        with open(file_name, "w") as f:
+            f.write("100.0 L03\n100.5 u01\n101.0 u02\n101.25 L04\n")
+        times, values, start_time, end_time = read_log(file_name, 'u')
+        assert list(times) == [100.5, 101.0]
+        assert list(values) == [1, 2]
+        assert (start_time, end_time) == (100.0, 101.25)
+    finally:
+        shutil.rmtree(work_dir)
+
+
+def test_read_binary_log():
+    work_dir = tempfile.mkdtemp()
+    try:
+        file_name = os.path.join(work_dir, "rec00000.cmd")
+        log = CommandLog(file_name)
+        log.write('L', 3, t=100.0)
+        log.write('u', 1, t=100.5)
+        log.write('u', 2, t=101.0)
+        log.write('L', 4, t=101.25)
+        log.close()
+        times, values, start_time, end_time = read_log(file_name, 'u')
+        assert list(times) == [100.5, 101.0]
+        assert list(values) == [1, 2]
+        assert (start_time, end_time) == (100.0, 101.25)
+    finally:
+        shutil.rmtree(work_dir)
+
+
+if __name__ == "__main__":
+    tests = sorted(name for name in dir() if name.startswith("test_"))
+    for name in tests:
+        globals()[name]()
+        print("%s passed" % name)
+    print("%d tests passed" % len(tests))
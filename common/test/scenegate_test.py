@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# Tests of the scene-change gate
+# See more at https://github.com/oomwoo/
+#
+# Copyright (C) 2016 oomwoo.com
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version 3.0
+# as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License <http://www.gnu.org/licenses/> for details.
+"""
+Tests of common/scenegate.py, no camera needed.
+Usage: python scenegate_test.py (or pytest)
+"""
+
+import os
+import sys
+import numpy as np
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from scenegate import SceneGate
+
+
+h = 48
+w = 64
+
+
+def frame(value):
+    return np.full((h, w, 3), value, dtype=np.uint8)
+
+
+def run(gate, f, frame_time, output="out", seconds=0.01):
+    """Output of the gate, running the "network" on a miss"""
+    cached = gate.check(f, frame_time)
+    if cached is not None:
+        return cached
+    gate.update(output, seconds)
+    return None
+
+
+def test_threshold():
+    gate = SceneGate(threshold=2.0, max_age=10)
+    assert run(gate, frame(100), 0.0) is None
+    # Mean absolute difference 1 < 2: reused
+    assert run(gate, frame(101), 0.1) == "out"
+    # Compared with the frame the network ran on, not the last one checked
+    assert run(gate, frame(102), 0.2) is None
+    # A change in part of the frame only, mean 8 * 1/4 = 2, not below threshold
+    f = frame(102)
+    f[:h // 2, :w // 2] += 8
+    assert run(gate, f, 0.3) is None
+
+
+def test_dark_frame():
+    # Differences are signed: darker frames count too, no uint8 wrap-around
+    gate = SceneGate(threshold=2.0, max_age=10)
+    run(gate, frame(0), 0.0)
+    assert run(gate, frame(255), 0.1) is None
+    assert run(gate, frame(250), 0.2) is None
+
+
+def test_max_age():
+    gate = SceneGate(threshold=2.0, max_age=0.3)
+    assert run(gate, frame(100), 0.0, "a") is None
+    assert run(gate, frame(100), 0.3, "b") == "a"
+    # Same scene, but the cached output is too old
+    assert run(gate, frame(100), 0.31, "b") is None
+    assert run(gate, frame(100), 0.5, "c") == "b"
+
+
+def test_reset():
+    gate = SceneGate(threshold=2.0, max_age=10)
+    run(gate, frame(100), 0.0)
+    gate.reset()
+    assert run(gate, frame(100), 0.1) is None
+
+
+def test_stats():
+    gate = SceneGate(threshold=2.0, max_age=10)
+    assert gate.stats() == {"frames": 0, "hit_rate": 0, "seconds_saved": 0, "percent_saved": 0}
+    # 2 misses at 0.1 s each, 6 hits
+    run(gate, frame(100), 0.0, seconds=0.1)
+    for i in range(6):
+        run(gate, frame(100), 0.1 * (i + 1))
+    run(gate, frame(200), 0.7, seconds=0.1)
+    stats = gate.stats()
+    assert stats["frames"] == 8
+    assert stats["hit_rate"] == 0.75
+    # Each hit saves the average network time, 0.1 s
+    assert stats["seconds_saved"] == 0.6
+    assert stats["percent_saved"] == 75.0
+
+
+if __name__ == "__main__":
+    tests = sorted(name for name in dir() if name.startswith("test_"))
+    for name in tests:
+        globals()[name]()
+        print("%s passed" % name)
+    print("%d tests passed" % len(tests))
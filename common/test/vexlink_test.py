@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+# Tests of the framed Raspberry Pi - VEX Cortex serial link
+# See more at https://github.com/oomwoo/
+#
+# Copyright (C) 2016 oomwoo.com
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version 3.0
+# as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License <http://www.gnu.org/licenses/> for details.
+"""
+Tests of common/vexlink.py over a pseudo-terminal pair, the Cortex played
+by common/cortexsim.py. No robot needed.
+Usage: python vexlink_test.py (or pytest)
+"""
+
+import os
+import sys
+import pty
+import tty
+import time
+import threading
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from hal import StreamPort
+from vexlink import VexLink, FrameDecoder, encode_frame, LINK, USER, CORTEX
+from cortexsim import CortexStandIn
+
+
+class GatedPort(object):
+    """Port whose write() waits for the gate, like a UART that is behind"""
+    def __init__(self, port):
+        self.port = port
+        self.gate = threading.Event()
+        self.writing = threading.Event()
+
+    def write(self, data):
+        self.writing.set()
+        self.gate.wait()
+        return self.port.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self.port, name)
+
+
+class Link(object):
+    """VexLink on the slave side, the Cortex stand-in on the master side"""
+    def __init__(self, gated=False):
+        master, slave = pty.openpty()
+        tty.setraw(slave)
+        tty.setraw(master)
+        self.pi_port = StreamPort(slave, slave, timeout=0.05)
+        self.cortex_port = StreamPort(master, master, timeout=0)
+        self.port = GatedPort(self.pi_port) if gated else self.pi_port
+        self.link = VexLink(self.port)
+        self.cortex = CortexStandIn(self.cortex_port)
+
+    def receive(self, n, timeout=2.0):
+        frames = []
+        deadline = time.time() + timeout
+        while len(frames) < n and time.time() < deadline:
+            frame = self.link.receive(0.05)
+            if frame is not None:
+                frames.append(frame[:2])
+        return frames
+
+    def cortex_receive(self, n, timeout=2.0):
+        deadline = time.time() + timeout
+        while len(self.cortex.commands) < n and time.time() < deadline:
+            self.cortex.step()
+            time.sleep(0.01)
+        return self.cortex.commands
+
+    def close(self):
+        if isinstance(self.port, GatedPort):
+            self.port.gate.set()
+        self.link.close()
+        self.pi_port.close()
+        self.cortex_port.close()
+
+
+def test_frames():
+    link = Link()
+    try:
+        link.cortex.send(LINK, 3)
+        link.cortex.send(USER, 1)
+        assert link.receive(2) == [(LINK, b"\x03"), (USER, b"\x01")]
+        link.link.send(CORTEX, b"\x02")
+        assert link.cortex_receive(1) == [2]
+    finally:
+        link.close()
+
+
+def test_decoder_chunks():
+    decoder = FrameDecoder()
+    data = encode_frame(USER, b"\x01") + encode_frame(LINK, b"\x02")
+    frames = []
+    for i in range(len(data)):
+        frames += decoder.feed(data[i:i + 1])
+    assert frames == [(USER, b"\x01"), (LINK, b"\x02")]
+    assert decoder.skipped == 0
+
+
+def test_resync_after_garbage():
+    link = Link()
+    try:
+        # Noise, a stray sync byte, a sync byte followed by an impossible length
+        link.cortex_port.write(b"\x00\x13\xaa\xaa\xff\x55")
+        link.cortex.send(USER, 2)
+        assert link.receive(1) == [(USER, b"\x02")]
+        assert link.link.decoder.skipped >= 5
+        assert link.link.decoder.frames == 1
+    finally:
+        link.close()
+
+
+def test_crc_error():
+    link = Link()
+    try:
+        frame = bytearray(encode_frame(USER, b"\x01"))
+        frame[3] ^= 0x10
+        link.cortex_port.write(bytes(frame))
+        link.cortex.send(USER, 2)
+        # The corrupted frame is not delivered
+        assert link.receive(2, 0.5) == [(USER, b"\x02")]
+        assert link.link.decoder.crc_errors == 1
+    finally:
+        link.close()
+
+
+def test_truncated_frame():
+    link = Link()
+    try:
+        # Cortex reset halfway through a frame
+        link.cortex_port.write(encode_frame(LINK, b"\x03")[:3])
+        time.sleep(0.1)
+        link.cortex.send(USER, 2)
+        link.cortex.send(USER, 0)
+        frames = link.receive(3, 0.5)
+        assert (LINK, b"\x03") not in frames
+        assert frames[-1] == (USER, b"\x00")
+        assert link.link.decoder.crc_errors + link.link.decoder.skipped > 0
+    finally:
+        link.close()
+
+
+def test_latest_wins():
+    link = Link(gated=True)
+    try:
+        link.link.send(CORTEX, b"\x01")
+        # The writer thread took the first command and is stuck in write()
+        assert link.port.writing.wait(2.0)
+        for value in (2, 3, 4):
+            link.link.send(CORTEX, bytearray([value]))
+        link.link.send(LINK, b"\x05")
+        stats = link.link.stats()
+        assert stats["coalesced"] == 2
+        assert stats["outbound_queue"] == 2
+        link.port.gate.set()
+        # Only the latest drive command follows the one being sent
+        assert link.cortex_receive(2) == [1, 4]
+        time.sleep(0.1)
+        link.cortex.step()
+        assert link.cortex.commands == [1, 4]
+        assert link.cortex.decoder.frames == 3
+    finally:
+        link.close()
+
+
+def test_stats():
+    link = Link()
+    try:
+        link.link.stats()
+        link.cortex_port.write(b"\x00")
+        frame = bytearray(encode_frame(USER, b"\x01"))
+        frame[-1] ^= 0x01
+        link.cortex_port.write(bytes(frame))
+        for value in range(5):
+            link.cortex.send(USER, value)
+        assert len(link.receive(5)) == 5
+        link.link.send(CORTEX, b"\x01")
+        link.cortex_receive(1)
+        stats = link.link.stats()
+        assert stats["frames_in"] == 5
+        assert stats["frames_out"] == 1
+        assert stats["crc_errors"] == 1
+        assert stats["bytes_skipped"] >= 1
+        assert stats["coalesced"] == 0
+        assert stats["outbound_queue"] == 0
+        assert stats["inbound_queue"] == 0
+        assert stats["frames_in_per_s"] > 0 and stats["frames_out_per_s"] > 0
+        # Rates are since the last call
+        assert link.link.stats()["frames_in_per_s"] == 0
+    finally:
+        link.close()
+
+
+if __name__ == "__main__":
+    tests = sorted(name for name in dir() if name.startswith("test_"))
+    for name in tests:
+        globals()[name]()
+        print("%s passed" % name)
+    print("%d tests passed" % len(tests))
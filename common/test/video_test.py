@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# Tests of in-process video decoding
+# See more at https://github.com/oomwoo/
+#
+# Copyright (C) 2016 oomwoo.com
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version 3.0
+# as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License <http://www.gnu.org/licenses/> for details.
+"""
+Tests of common/video.py, need avconv or ffmpeg; skipped without one.
+data/sample.h264: raw H.264 byte stream like the Pi camera writes,
+64x48, 12 frames; frame n is gray level 16 + 18 * n with a red left half.
+Usage: python video_test.py (or pytest)
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from video import find_decoder, probe_video, decode_frames
+
+
+sample_file_name = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "sample.h264")
+nframes = 12
+w = 64
+h = 48
+
+
+def have_decoder():
+    try:
+        find_decoder()
+        return True
+    except RuntimeError:
+        return False
+
+
+# Reported as skipped by pytest and by the runner below
+needs_decoder = unittest.skipUnless(have_decoder(), "no avconv or ffmpeg")
+
+
+def expect_error(frames):
+    try:
+        list(frames)
+    except RuntimeError:
+        return
+    raise AssertionError("RuntimeError not raised")
+
+
+@needs_decoder
+def test_probe():
+    assert probe_video(sample_file_name) == (nframes, w, h)
+
+
+@needs_decoder
+def test_decode():
+    frames = list(decode_frames(sample_file_name, w, h, nframes=nframes))
+    assert len(frames) == nframes
+    for n, frame in enumerate(frames):
+        assert frame.shape == (h, w, 3)
+        assert abs(int(frame[:, w // 2:, 1].mean()) - (16 + 18 * n)) <= 3
+        assert abs(int(frame[:, :w // 2 - 4, 0].mean()) - 200) <= 5
+
+
+@needs_decoder
+def test_decode_mirrored():
+    frame = next(iter(decode_frames(sample_file_name, w, h, "hflip")))
+    assert frame[:, w // 2 + 4:, 0].mean() > 190
+
+
+@needs_decoder
+def test_stop_early():
+    # Breaking out of the loop stops the decoder, no error
+    for n, frame in enumerate(decode_frames(sample_file_name, w, h, nframes=nframes)):
+        if n == 2:
+            break
+    assert n == 2
+
+
+@needs_decoder
+def test_truncated():
+    work_dir = tempfile.mkdtemp()
+    try:
+        file_name = os.path.join(work_dir, "truncated.h264")
+        with open(sample_file_name, "rb") as f:
+            data = f.read()
+        with open(file_name, "wb") as f:
+            f.write(data[:len(data) // 2])
+        expect_error(decode_frames(file_name, w, h, nframes=nframes))
+    finally:
+        shutil.rmtree(work_dir)
+
+
+@needs_decoder
+def test_corrupt():
+    work_dir = tempfile.mkdtemp()
+    try:
+        file_name = os.path.join(work_dir, "corrupt.h264")
+        with open(file_name, "wb") as f:
+            f.write(b"not a video" * 100)
+        expect_error(decode_frames(file_name, w, h))
+    finally:
+        shutil.rmtree(work_dir)
+
+
+@needs_decoder
+def test_short_read():
+    # Wrong frame size: the last read comes up short
+    expect_error(decode_frames(sample_file_name, w - 4, h))
+
+
+if __name__ == "__main__":
+    tests = sorted(name for name in dir() if name.startswith("test_"))
+    skipped = 0
+    for name in tests:
+        try:
+            globals()[name]()
+            print("%s passed" % name)
+        except unittest.SkipTest as e:
+            print("%s skipped, %s" % (name, e))
+            skipped += 1
+    print("%d tests passed, %d skipped" % (len(tests) - skipped, skipped))
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# Tests of the WebSocket joystick channel
+# See more at https://github.com/oomwoo/
+#
+# Copyright (C) 2016 oomwoo.com
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version 3.0
+# as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License <http://www.gnu.org/licenses/> for details.
+"""
+Tests of common/wsjoystick.py and common/webauth.py on localhost.
+Usage: python wsjoystick_test.py (or pytest)
+"""
+
+import os
+import sys
+import socket
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from wsjoystick import JoystickServer, JoystickClient
+from webauth import url_token, same_origin, authorized
+
+
+def start_server(commands):
+    def handler(cmd):
+        commands.append(cmd)
+        return False
+    server = JoystickServer(0, handler, lambda: None, token="secret")
+    return server, server.sock.getsockname()[1]
+
+
+def handshake_status(port, path, origin=None):
+    sock = socket.create_connection(("localhost", port))
+    request = ("GET %s HTTP/1.1\r\nHost: localhost:%d\r\nUpgrade: websocket\r\n"
+               "Connection: Upgrade\r\nSec-WebSocket-Key: dGhlIHNhbXBsZSBub25jZQ==\r\n"
+               "Sec-WebSocket-Version: 13\r\n" % (path, port))
+    if origin:
+        request += "Origin: %s\r\n" % origin
+    sock.sendall((request + "\r\n").encode())
+    status = sock.makefile("rb").readline().decode("latin-1")
+    sock.close()
+    return int(status.split()[1])
+
+
+def test_url_token():
+    assert url_token("/?token=abc") == "abc"
+    assert url_token("/stream.mjpg?x=1&token=abc") == "abc"
+    assert url_token("/stream.mjpg") is None
+
+
+def test_same_origin():
+    assert same_origin({"host": "dora.local:8001"})
+    assert same_origin({"host": "dora.local:8001", "origin": "http://dora.local:8000"})
+    assert same_origin({"host": "[::1]:8001", "origin": "http://[::1]:8000"})
+    assert not same_origin({"host": "dora.local:8001", "origin": "http://example.com"})
+    assert not same_origin({"origin": "http://dora.local:8000"})
+
+
+def test_authorized():
+    assert authorized("/?token=secret", {}, "secret")
+    assert not authorized("/?token=guess", {}, "secret")
+    assert not authorized("/", {}, "secret")
+
+
+def test_command_with_token():
+    commands = []
+    server, port = start_server(commands)
+    client = JoystickClient("localhost", port, "secret")
+    seq = client.send("f")
+    assert client.receive() == seq
+    client.close()
+    assert commands == ["f"]
+
+
+def test_rejected():
+    commands = []
+    server, port = start_server(commands)
+    assert handshake_status(port, "/") == 403
+    assert handshake_status(port, "/?token=guess") == 403
+    assert handshake_status(port, "/?token=secret", "http://example.com") == 403
+    assert handshake_status(port, "/?token=secret", "http://localhost:8000") == 101
+    try:
+        JoystickClient("localhost", port, "guess")
+        raise AssertionError("IOError not raised")
+    except IOError:
+        pass
+    assert server.rejected == 4
+    assert commands == []
+
+
+if __name__ == "__main__":
+    tests = sorted(name for name in dir() if name.startswith("test_"))
+    for name in tests:
+        globals()[name]()
+        print("%s passed" % name)
+    print("%d tests passed" % len(tests))
@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+# Framed binary serial link between Raspberry Pi and VEX Cortex
+# See more at https://github.com/oomwoo/
+#
+# Copyright (C) 2016 oomwoo.com
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version 3.0
+# as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License <http://www.gnu.org/licenses/> for details.
+"""
+VEX Cortex UART link, see SendUartFrame()/GetUartFrame() in vex/uart_lib.c
+    - frame: sync byte 0xAA, type, payload length, payload, CRC-8
+      (polynomial 0x07) of type, length and payload
+    - type is the command letter of the old text protocol ('L' link
+      command, 'u' user command, 'c' command to the Cortex), the payload
+      its value byte
+    - FrameDecoder decodes frames from arbitrary chunks of bytes and
+      resynchronizes after corrupted or partial frames
+    - VexLink runs a reader thread that queues received frames and a writer
+      thread that sends queued frames; a queued frame of the same type is
+      replaced instead of queued again, so a slow link sends the latest drive
+      command only. Repeated commands are still sent: the Cortex expires
+      commands from the Pi that are not refreshed.
+"""
+
+import time
+import threading
+import collections
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+
+SYNC = 0xAA
+MAX_PAYLOAD = 16
+LINK = ord('L')  # Link command from the Cortex, see LinkCommand in vex/uart_lib.c
+USER = ord('u')  # User (joystick) command from the Cortex
+CORTEX = ord('c')  # Drive command to the Cortex
+
+
+def make_crc8_table(poly=0x07):
+    table = []
+    for i in range(256):
+        crc = i
+        for bit in range(8):
+            crc = ((crc << 1) ^ poly if crc & 0x80 else crc << 1) & 0xff
+        table.append(crc)
+    return table
+
+
+crc8_table = make_crc8_table()
+
+
+def crc8(data, crc=0):
+    for b in bytearray(data):
+        crc = crc8_table[crc ^ b]
+    return crc
+
+
+def encode_frame(frame_type, payload=b""):
+    frame = bytearray([frame_type, len(payload)]) + bytearray(payload)
+    return bytes(bytearray([SYNC]) + frame + bytearray([crc8(frame)]))
+
+
+def in_waiting(port):
+    # pyserial 2 has inWaiting() only
+    if hasattr(port, "in_waiting"):
+        return port.in_waiting
+    return port.inWaiting()
+
+
+class FrameDecoder(object):
+    """feed() bytes as they arrive, returns complete (type, payload) frames"""
+    def __init__(self):
+        self.buffer = bytearray()
+        self.frames = 0
+        self.crc_errors = 0
+        self.skipped = 0  # Bytes discarded while looking for a frame
+
+    def feed(self, data):
+        self.buffer += bytearray(data)
+        frames = []
+        while True:
+            i = self.buffer.find(bytearray([SYNC]))
+            if i < 0:
+                self.skipped += len(self.buffer)
+                del self.buffer[:]
+                break
+            if i > 0:
+                self.skipped += i
+                del self.buffer[:i]
+            if len(self.buffer) < 3:
+                break
+            n = self.buffer[2]
+            if n > MAX_PAYLOAD:
+                # Not a frame header, look for the next sync byte
+                self.skipped += 1
+                del self.buffer[:1]
+                continue
+            if len(self.buffer) < n + 4:
+                break
+            if crc8(self.buffer[1:n + 3]) != self.buffer[n + 3]:
+                self.crc_errors += 1
+                self.skipped += 1
+                del self.buffer[:1]
+                continue
+            frames.append((self.buffer[1], bytes(self.buffer[3:n + 3])))
+            self.frames += 1
+            del self.buffer[:n + 4]
+        return frames
+
+
+class VexLink(object):
+    """Reads and writes frames on a serial port in background threads.
+    receive() returns the next (type, payload, arrival time) frame,
+    send() queues one."""
+    def __init__(self, port):
+        self.port = port
+        self.decoder = FrameDecoder()
+        self.received = queue.Queue()
+        self.outbound = collections.OrderedDict()  # type: payload
+        self.cond = threading.Condition()
+        self.running = True
+        self.sent = 0
+        self.coalesced = 0
+        self.last_stats = (time.time(), 0, 0)
+        self.threads = [threading.Thread(target=self.read_frames), threading.Thread(target=self.write_frames)]
+        for t in self.threads:
+            t.daemon = True
+            t.start()
+
+    def read_frames(self):
+        while self.running:
+            data = self.port.read(1)  # Waits up to the port timeout
+            if not data:
+                continue
+            waiting = in_waiting(self.port)
+            if waiting:
+                data += self.port.read(waiting)
+            now = time.time()
+            for frame_type, payload in self.decoder.feed(data):
+                self.received.put((frame_type, payload, now))
+
+    def write_frames(self):
+        while True:
+            with self.cond:
+                while self.running and not self.outbound:
+                    self.cond.wait()
+                if not self.running:
+                    break
+                frame_type, payload = self.outbound.popitem(last=False)
+            self.port.write(encode_frame(frame_type, payload))
+            self.sent += 1
+
+    def send(self, frame_type, payload=b""):
+        with self.cond:
+            if frame_type in self.outbound:
+                self.coalesced += 1
+            self.outbound[frame_type] = payload
+            self.cond.notify()
+
+    def receive(self, timeout=None):
+        """Next (type, payload, arrival time) frame, None on timeout"""
+        try:
+            return self.received.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def stats(self):
+        """Frames per second in and out since the last call, error counts, queue depths"""
+        now = time.time()
+        t, received, sent = self.last_stats
+        dt = max(now - t, 1e-6)
+        self.last_stats = (now, self.decoder.frames, self.sent)
+        return {"frames_in_per_s": round((self.decoder.frames - received) / dt, 1),
+                "frames_out_per_s": round((self.sent - sent) / dt, 1),
+                "frames_in": self.decoder.frames, "frames_out": self.sent,
+                "crc_errors": self.decoder.crc_errors, "bytes_skipped": self.decoder.skipped,
+                "coalesced": self.coalesced, "outbound_queue": len(self.outbound),
+                "inbound_queue": self.received.qsize()}
+
+    def close(self):
+        with self.cond:
+            self.running = False
+            self.cond.notify()
+        for t in self.threads:
+            t.join(5)
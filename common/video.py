@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# Decode robot video recordings into NumPy arrays
+# See more at https://github.com/oomwoo/
+#
+# Copyright (C) 2016 oomwoo.com
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version 3.0
+# as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License <http://www.gnu.org/licenses/> for details.
+"""
+Decode .h264 recordings in-process
+    - avconv (or ffmpeg) decodes and pipes raw RGB frames over stdout
+    - frames arrive as (h, w, 3) uint8 NumPy arrays, nothing is written to disk
+"""
+
+import re
+import subprocess
+import tempfile
+import numpy as np
+try:
+    from shutil import which
+except ImportError:
+    # Python 2, distutils is gone from Python 3.12
+    from distutils.spawn import find_executable as which
+
+
+def find_decoder():
+    for name in ["avconv", "ffmpeg"]:
+        path = which(name)
+        if path:
+            return path
+    raise RuntimeError("Please install avconv (libav-tools) or ffmpeg")
+
+
+def probe_video(file_name, decoder=None):
+    """Returns (number of frames, width, height). The video is decoded only
+    if the decoder does not count frames when copying the stream."""
+    if decoder is None:
+        decoder = find_decoder()
+    for copy in [["-c", "copy"], []]:
+        cmd = [decoder, "-i", file_name] + copy + ["-f", "null", "-"]
+        p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        out, err = p.communicate()
+        err = err.decode("utf-8", "replace")
+        size = re.search(r"Video: .*?(\d{2,5})x(\d{2,5})", err)
+        frames = re.findall(r"frame=\s*(\d+)", err)
+        if frames or p.returncode != 0:
+            break
+        # Newer ffmpeg reports no frame count when copying, decode instead
+    if p.returncode != 0 or size is None or not frames:
+        raise RuntimeError("Cannot read video " + file_name)
+    return int(frames[-1]), int(size.group(1)), int(size.group(2))
+
+
+def decode_frames(file_name, width, height, video_filter=None, decoder=None, nframes=None):
+    """Yields (h, w, 3) uint8 RGB frames. video_filter, e.g. "hflip,vflip",
+    is passed to the decoder. Stop iterating to stop decoding.
+    Raises RuntimeError if the decoder fails, the last frame is cut short
+    or, with nframes (see probe_video()), fewer frames were decoded."""
+    if decoder is None:
+        decoder = find_decoder()
+    cmd = [decoder, "-loglevel", "error", "-i", file_name]
+    if video_filter:
+        cmd += ["-vf", video_filter]
+    cmd += ["-f", "rawvideo", "-pix_fmt", "rgb24", "-"]
+    # Errors to a file: a pipe nobody reads while frames stream could fill up
+    errors = tempfile.TemporaryFile()
+    p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=errors, bufsize=-1)
+    frame_size = width * height * 3
+    n = 0
+    try:
+        while True:
+            buf = p.stdout.read(frame_size)
+            if len(buf) < frame_size:
+                break
+            n += 1
+            yield np.frombuffer(buf, dtype=np.uint8).reshape(height, width, 3)
+    finally:
+        p.stdout.close()
+        if p.poll() is None:
+            p.kill()
+        p.wait()
+        errors.seek(0)
+        message = errors.read().decode("utf-8", "replace").strip()
+        errors.close()
+    # Only reached if the decoder's output ended
+    if p.returncode != 0:
+        raise RuntimeError("Decoding %s failed (exit status %d): %s" % (file_name, p.returncode, message))
+    if len(buf):
+        raise RuntimeError("Decoding %s: last frame cut short, %d of %d bytes" % (file_name, len(buf), frame_size))
+    if nframes is not None and n < nframes:
+        raise RuntimeError("Decoding %s: %d of %d frames decoded, file truncated?" % (file_name, n, nframes))
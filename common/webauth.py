@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+# Access checks for the robot's servers beside WebIOPi
+# See more at https://github.com/oomwoo/
+#
+# Copyright (C) 2016 oomwoo.com
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version 3.0
+# as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License <http://www.gnu.org/licenses/> for details.
+"""
+The joystick WebSocket and the preview stream have no login of their own
+    - a random token is made at startup; the page gets it from a WebIOPi
+      macro, behind WebIOPi's password, and adds it to the URL: ?token=...
+    - browsers send Origin with WebSocket requests: it must be a page from
+      the robot itself (same host name, any port), not another web site
+"""
+
+import os
+import hmac
+import binascii
+try:
+    from urlparse import urlparse, parse_qs
+except ImportError:
+    from urllib.parse import urlparse, parse_qs
+
+
+def new_token():
+    return binascii.hexlify(os.urandom(16)).decode()
+
+
+def url_token(path):
+    """Token of a request path such as /stream.mjpg?token=..., None if missing"""
+    tokens = parse_qs(urlparse(path).query).get("token")
+    return tokens[0] if tokens else None
+
+
+def same_origin(headers):
+    """headers: lower case names. True without Origin (not a browser) or
+    when the Origin host name is the one the request was sent to"""
+    origin = headers.get("origin")
+    if origin is None:
+        return True
+    host = urlparse("//" + headers.get("host", "")).hostname
+    return host is not None and urlparse(origin).hostname == host
+
+
+def authorized(path, headers, token):
+    t = url_token(path)
+    # Constant time; bytes, Python 2 does not compare unicode with str
+    return t is not None and hmac.compare_digest(t.encode("utf-8"), token.encode("utf-8")) and same_origin(headers)
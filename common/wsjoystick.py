@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+# WebSocket joystick channel between the web page and the robot
+# See more at https://github.com/oomwoo/
+#
+# Copyright (C) 2016 oomwoo.com
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version 3.0
+# as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License <http://www.gnu.org/licenses/> for details.
+"""
+Minimal WebSocket (RFC 6455) joystick server, standard library only
+    - one persistent connection per page, no HTTP request per command
+    - text messages "<seq> <cmd>", seq increases per connection,
+      late (out-of-order) commands are dropped
+    - cmd "h" is a heartbeat; while motors run, if no message arrives
+      for timeout seconds (page closed, Wi-Fi lost) on_timeout() is called
+    - every accepted message is acknowledged with its seq
+    - connections need ws://<robot>:port/?token=<token> and, from a
+      browser, a page of the robot itself, see webauth.py
+JoystickClient is a matching client for tests.
+"""
+
+import os
+import time
+import base64
+import socket
+import struct
+import hashlib
+import threading
+from webauth import new_token, authorized
+
+
+guid = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+OP_TEXT = 0x1
+OP_CLOSE = 0x8
+OP_PING = 0x9
+OP_PONG = 0xA
+heartbeat = "h"
+
+
+def read_exactly(f, n):
+    data = f.read(n)
+    if len(data) < n:
+        raise EOFError()
+    return data
+
+
+def read_frame(f):
+    """(opcode, payload) of the next frame; fragmented messages are not supported"""
+    b1, b2 = bytearray(read_exactly(f, 2))
+    n = b2 & 0x7f
+    if n == 126:
+        n = struct.unpack(">H", read_exactly(f, 2))[0]
+    elif n == 127:
+        n = struct.unpack(">Q", read_exactly(f, 8))[0]
+    mask = bytearray(read_exactly(f, 4)) if b2 & 0x80 else None
+    data = bytearray(read_exactly(f, n))
+    if mask:
+        for i in range(n):
+            data[i] ^= mask[i % 4]
+    return b1 & 0x0f, bytes(data)
+
+
+def write_frame(sock, opcode, data, mask=False):
+    # Clients must mask their frames, servers must not
+    header = bytearray([0x80 | opcode])
+    mask_bit = 0x80 if mask else 0
+    n = len(data)
+    if n < 126:
+        header.append(mask_bit | n)
+    elif n < 65536:
+        header.append(mask_bit | 126)
+        header += struct.pack(">H", n)
+    else:
+        header.append(mask_bit | 127)
+        header += struct.pack(">Q", n)
+    data = bytearray(data)
+    if mask:
+        key = bytearray(os.urandom(4))
+        header += key
+        for i in range(n):
+            data[i] ^= key[i % 4]
+    sock.sendall(bytes(header + data))
+
+
+def read_headers(f):
+    headers = {}
+    while True:
+        line = f.readline().decode("latin-1").strip()
+        if not line:
+            return headers
+        if ":" in line:
+            key, value = line.split(":", 1)
+            headers[key.strip().lower()] = value.strip()
+
+
+def accept_key(key):
+    return base64.b64encode(hashlib.sha1((key + guid).encode()).digest()).decode()
+
+
+class JoystickServer(object):
+    """handler(cmd) runs on the connection thread, returns True while motors run.
+    token: required in the URL, a new random one if None"""
+    def __init__(self, port, handler, on_timeout, timeout=0.5, token=None):
+        self.handler = handler
+        self.token = token or new_token()
+        self.rejected = 0
+        self.on_timeout = on_timeout
+        self.timeout = timeout
+        self.last_message_time = 0
+        self.driving = False
+        self.commands = 0
+        self.dropped = 0
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(("", port))
+        self.sock.listen(4)
+        for target in [self.serve, self.watchdog]:
+            t = threading.Thread(target=target)
+            t.daemon = True
+            t.start()
+
+    def serve(self):
+        while True:
+            conn, addr = self.sock.accept()
+            t = threading.Thread(target=self.handle, args=(conn,))
+            t.daemon = True
+            t.start()
+
+    def handshake(self, conn, f):
+        request = f.readline().decode("latin-1").split()  # GET /?token=... HTTP/1.1
+        headers = read_headers(f)
+        key = headers.get("sec-websocket-key")
+        if key is None or len(request) < 2:
+            conn.sendall(b"HTTP/1.1 400 Bad Request\r\n\r\n")
+            return False
+        if not authorized(request[1], headers, self.token):
+            self.rejected += 1
+            conn.sendall(b"HTTP/1.1 403 Forbidden\r\n\r\n")
+            return False
+        conn.sendall(("HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\n"
+                      "Connection: Upgrade\r\nSec-WebSocket-Accept: %s\r\n\r\n" % accept_key(key)).encode())
+        return True
+
+    def handle(self, conn):
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        f = conn.makefile("rb")
+        last_seq = -1
+        try:
+            if not self.handshake(conn, f):
+                return
+            while True:
+                opcode, data = read_frame(f)
+                if opcode == OP_CLOSE:
+                    write_frame(conn, OP_CLOSE, b"")
+                    break
+                if opcode == OP_PING:
+                    write_frame(conn, OP_PONG, data)
+                    continue
+                if opcode != OP_TEXT:
+                    continue
+                seq, cmd = data.decode().split(" ", 1)
+                seq = int(seq)
+                self.last_message_time = time.time()
+                if seq <= last_seq:
+                    self.dropped += 1
+                    continue
+                last_seq = seq
+                if cmd != heartbeat:
+                    self.driving = bool(self.handler(cmd))
+                    self.commands += 1
+                write_frame(conn, OP_TEXT, str(seq).encode())
+        except (EOFError, ValueError, socket.error):
+            pass  # Connection lost; the watchdog stops the motors
+        finally:
+            f.close()
+            conn.close()
+
+    def watchdog(self):
+        # Dead-man switch
+        while True:
+            time.sleep(self.timeout / 4)
+            if self.driving and time.time() - self.last_message_time > self.timeout:
+                self.driving = False
+                self.on_timeout()
+
+
+class JoystickClient(object):
+    """Sends commands, receive() returns the acknowledged seq"""
+    def __init__(self, host, port, token):
+        self.sock = socket.create_connection((host, port))
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        key = base64.b64encode(os.urandom(16)).decode()
+        self.sock.sendall(("GET /?token=%s HTTP/1.1\r\nHost: %s:%d\r\nUpgrade: websocket\r\n"
+                           "Connection: Upgrade\r\nSec-WebSocket-Key: %s\r\n"
+                           "Sec-WebSocket-Version: 13\r\n\r\n" % (token, host, port, key)).encode())
+        self.f = self.sock.makefile("rb")
+        status = self.f.readline().decode("latin-1")
+        headers = read_headers(self.f)
+        if " 101 " not in status or headers.get("sec-websocket-accept") != accept_key(key):
+            raise IOError("WebSocket handshake failed: " + status.strip())
+        self.seq = 0
+
+    def send(self, cmd, seq=None):
+        if seq is None:
+            self.seq += 1
+            seq = self.seq
+        write_frame(self.sock, OP_TEXT, ("%d %s" % (seq, cmd)).encode(), mask=True)
+        return seq
+
+    def receive(self):
+        opcode, data = read_frame(self.f)
+        return int(data)
+
+    def close(self):
+        write_frame(self.sock, OP_CLOSE, b"", mask=True)
+        self.sock.close()
@@ -16,17 +16,21 @@
 # MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
 # GNU General Public License <http://www.gnu.org/licenses/> for details.
 
-import serial, time, sys, getopt, picamera, glob, re, subprocess, os
+import time, sys, getopt, glob, re, subprocess, os
 import threading
-import picamera.array
 import numpy as np
-from PIL import Image
-from neon.backends import gen_backend
-from neon.layers import Affine, Conv, Pooling
-from neon.models import Model
-from neon.transforms import Rectlin, Softmax
-from neon.initializers import Uniform
-from neon.data.dataiterator import ArrayIterator
+my_dir = os.path.expanduser("~") + "/dora/"
+sys.path.append(my_dir + "common")
+import hal
+from frames import FrameRing, VideoPortOutput, TimestampedOutput
+from recordings import frame_times_ext
+from recindex import RecordingIndex
+from preprocess import Preprocessor, to_image
+from inference import InferenceSession
+from cmdlog import CommandLog, export_text, cmdlog_ext, SOURCE_UART
+from vexlink import VexLink, LINK, CORTEX
+from latency import LatencyRecorder, print_summary
+from scenegate import SceneGate
 
 
 # Communication and camera args
@@ -41,36 +45,48 @@ hor_flip = False
 ver_flip = False
 video_file_ext = ".h264"
 log_file_ext = ".txt"
+text_log = True  # Also export binary command log to text when recording stops
 log_file = []
 iso = 0
 shutdown_on_exit = True
+serial_device = hal.serial_device  # "/dev/ttyAMA0", or "pty"/"pipe" off the Pi
+camera_source = hal.camera_source  # "picamera", or .h264/image directory to replay
 autonomous = False
 video_file_name = []
+video_output = []
 log_file_name = []
 autonomous_thread = []
+stats_period = 5  # Seconds between decision rate reports
+latency = LatencyRecorder()  # Frame capture to serial command, per stage, see common/latency.py
+latency_file = "latency.csv"  # Saved to my_dir on exit, "" to disable
 
 # CNN setup
 W = 32
 H = W
-my_dir = os.path.expanduser("~") + "/dora/"
 video_dir = my_dir + "train/video/"
 # param_file_name = my_dir + "train/model/trained_dora_model_24x24_3x3x16.prm"
 param_file_name = my_dir + "train/model/trained_dora_model_32x32.prm"
 class_names = ["forward", "left", "right", "backward"]    # from ROBOT-C bot.c
 nclasses = len(class_names)
-size = H, W
-
-be = gen_backend(backend='cpu', batch_size=1)    # NN backend
-init_uni = Uniform(low=-0.1, high=0.1)           # Unnecessary NN weight initialization
-bn = True                                        # enable NN batch normalization
-layers = [Conv((5, 5, 16), init=init_uni, activation=Rectlin(), batch_norm=bn),
-          Pooling((2, 2)),
-          Conv((3, 3, 32), init=init_uni, activation=Rectlin(), batch_norm=bn),
-          Pooling((2, 2)),
-          Affine(nout=50, init=init_uni, activation=Rectlin(), batch_norm=bn),
-          Affine(nout=nclasses, init=init_uni, activation=Softmax())]
-model = Model(layers=layers)
-model.load_params(param_file_name, load_states=False)
+engine = "neon"  # "neon", "numpy" (pure NumPy, no Neon import) or "int8" (quantized)
+scene_threshold = 2.0  # Reuse last decision while frames differ less (mean abs, 0..255), 0 to disable
+scene_max_age = 0.3  # Seconds a reused decision may be old
+
+if engine == "numpy":
+    # Exported weights, see common/npengine.py, Neon not loaded at all
+    from npengine import load_model
+    session = load_model(param_file_name)
+elif engine == "int8":
+    # Weights quantized by common/quantize.py
+    from quantize import QuantizedModel
+    session = QuantizedModel(param_file_name.replace(".prm", "_int8.npz"))
+else:
+    from neon.backends import gen_backend
+    from graphopt import compile_model
+
+    be = gen_backend(backend='cpu', batch_size=1)    # NN backend
+    # Batch norm folded, ReLU fused at load time, see common/graphopt.py
+    session = InferenceSession(compile_model(param_file_name), (3, H, W))
 
 def usage():
     print "python connect_to_vex_cortex.py"
@@ -86,6 +102,8 @@ def usage():
     print "  -m: horizontal mirror"
     print "  -v: vertical mirror"
     print "  -s: shut down system on exit (must run as super user)"
+    print "  -u " + serial_device + ": serial port, pty to simulate on a pseudo-terminal"
+    print "  -c " + camera_source + ": camera, or .h264 file or image directory to replay"
     print "  -?: print usage"
 
 
@@ -100,59 +118,76 @@ class AutonomousThread (threading.Thread):
         self.daemon = True
         debug_print("Autonomous thread init")
         self.cnt = 0
+        self.preprocessor = Preprocessor(W, H, w, h)
+        self.gate = SceneGate(scene_threshold, scene_max_age)
 	rm_files(my_dir + "train/debug/*")
     def run(self):
+        # Stream frames from the video port, always decide on the newest one
+        ring = FrameRing(h, w)
+        camera.start_recording(VideoPortOutput(ring, w, h), format='rgb', splitter_port=2)
+        self.reset_stats()
         while True:
             if not autonomous:
                 debug_print("Exiting autonomous thread")
+                camera.stop_recording(splitter_port=2)
                 break
 
-            # Grab a still frame
-            stream = picamera.array.PiRGBArray(camera)
-            camera.capture(stream, 'rgb', use_video_port=True)
+            frame, frame_time = ring.get()
+            if frame is None:
+                debug_print("Timeout waiting for a frame")
+                continue
 
             start_time = time.time()
-            debug_print("Grabbed a still frame")
-            image = Image.fromarray(stream.array)
-            image = image.resize(size, Image.ANTIALIAS)
-            if (debug):
-                image.save(my_dir + "train/debug/capture" + str(self.cnt) + ".png", "PNG")
-                self.cnt = self.cnt + 1
-            r, g, b = image.split()
-            image = Image.merge("RGB", (b, g, r))
-            image = np.asarray(image, dtype=np.float32)
-            image = np.transpose(image, (2, 0, 1))
-            x_new = image.reshape(1, 3*W*H) - 127
-
-            # Run neural network
-            inference_set = ArrayIterator(x_new, None, nclass=nclasses, lshape=(3, H, W))
-            out = model.get_outputs(inference_set)
-            debug_print("--- %s seconds per decision --- " % (time.time() - start_time))
-            decision = out.argmax()
-            debug_print(class_names[decision])
+            # Scene unchanged since the network last ran: reuse its decision
+            decision = self.gate.check(frame, frame_time)
+            preprocess_time = inference_time = time.time()
+            inferred = decision is None
+            if inferred:
+                x_new = self.preprocessor(frame)
+                preprocess_time = time.time()
+
+                # Run neural network
+                out = session.classify(x_new)
+                inference_time = time.time()
+                decision = out.argmax()
+                self.gate.update(decision, inference_time - start_time)
+            decision_time = time.time()
             send_cmd(decision)
+            latency.record(frame_time, start_time, preprocess_time, inference_time, decision_time, time.time())
+            self.update_stats(frame_time, ring.dropped)
 
+            debug_print(class_names[decision])
+            if debug and inferred:
+                to_image(x_new, W, H).save(my_dir + "train/debug/capture" + str(self.cnt) + ".png", "PNG")
+                self.cnt = self.cnt + 1
+
+    def reset_stats(self):
+        self.decisions = 0
+        self.latency = 0
+        self.stats_start_time = time.time()
 
-def get_file_max_idx(prefix, file_ext):
-    rs = "[0-9][0-9][0-9][0-9][0-9]"
-    file_names = glob.glob(prefix + rs + file_ext)
-    if not file_names:
-        return 0
-    numbers = [int((re.findall('\d+', s))[0]) for s in file_names]
-    return max(numbers) + 1
+    def update_stats(self, frame_time, dropped):
+        # Decisions per second, capture-to-actuation latency
+        now = time.time()
+        self.decisions += 1
+        self.latency += now - frame_time
+        if now - self.stats_start_time >= stats_period:
+            debug_print("%.1f decisions/s, %.1f ms capture-to-actuation, %d frames dropped, scene gate %r" %
+                        (self.decisions / (now - self.stats_start_time),
+                         1000 * self.latency / self.decisions, dropped, self.gate.stats()))
+            self.reset_stats()
 
 
 def start_recording():
-    global log_file, video_file_name, log_file_name
+    global log_file, video_file_name, log_file_name, video_output
     if not(camera.recording):
-        n1 = get_file_max_idx(file_name_prefix, video_file_ext)
-        n2 = get_file_max_idx(file_name_prefix, log_file_ext)
-        n = max(n1, n2)
-        s = str(n).zfill(5)
-        video_file_name = file_name_prefix + s + video_file_ext
-        log_file_name = file_name_prefix + s + log_file_ext
-        camera.start_recording(video_file_name, quality=quality)
-        log_file = open(log_file_name, "w")
+        base = recording_index.allocate()
+        video_file_name = base + video_file_ext
+        log_file_name = base + cmdlog_ext
+        # Save capture time of each frame to align commands with frames
+        video_output = TimestampedOutput(camera, video_file_name, base + frame_times_ext)
+        camera.start_recording(video_output, format='h264', quality=quality)
+        log_file = CommandLog(log_file_name)
         camera.led = True
 
         debug_print("Recording to " + log_file_name)
@@ -166,7 +201,11 @@ def stop_recording():
     if camera.recording:
         debug_print("Stopping recording")
         camera.stop_recording()
+        video_output.close()
         log_file.close()
+        if text_log:
+            export_text(log_file_name, log_file_name.replace(cmdlog_ext, log_file_ext))
+        recording_index.add(log_file_name.replace(cmdlog_ext, ""))
         camera.led = False
 
 
@@ -190,13 +229,10 @@ def enable_autonomous_driving(enable):
         autonomous_thread = []
 
 
-def write_to_log(txt):
+def write_to_log(cmd, value, t=None):
     if camera.recording:
-        # Prepend timestamp
-        s = repr(time.time()) + " " + txt
-        # Save all commands into log file
-        debug_print(s)
-        log_file.write(s)
+        # Queue all commands, written to log file in background
+        log_file.write(chr(cmd), value, SOURCE_UART, t)
 
 
 def debug_print(s):
@@ -205,12 +241,12 @@ def debug_print(s):
 
 
 def send_cmd(cmd_code):
-    cmd = 'c' + format(cmd_code, '02X') + '\n'
-    port.write(cmd)
-    debug_print("Sent cmd=" + cmd)
+    # Queued, replaces a drive command not sent yet
+    link.send(CORTEX, bytearray([cmd_code]))
+    debug_print("Sent cmd=c%02X" % cmd_code)
 
 
-opts, args = getopt.getopt(sys.argv[1:], "p:l:w:h:f:q:b:i:r:?ds")
+opts, args = getopt.getopt(sys.argv[1:], "p:l:w:h:f:q:b:i:r:u:c:?ds")
 for opt, arg in opts:
     if opt == '-d':
         debug = True
@@ -230,6 +266,10 @@ for opt, arg in opts:
         fps = int(arg)
     elif opt == '-p':
         file_name_prefix = arg
+    elif opt == '-u':
+        serial_device = arg
+    elif opt == '-c':
+        camera_source = arg
     elif opt == '-m':
         hor_flip = Not(hor_flip)
     elif opt == '-v':
@@ -238,11 +278,12 @@ for opt, arg in opts:
         usage()
         sys.exit(2)
 
-port = serial.Serial("/dev/ttyAMA0", baudrate=115200, timeout=3.0)
+port = hal.open_serial(serial_device, baudrate=115200, timeout=0.1)
 print "Note: this code works on Raspberry Pi v2 only, NOT v3"
 file_name_prefix = video_dir + file_name_prefix
+recording_index = RecordingIndex(file_name_prefix, video_file_ext)
 
-camera = picamera.PiCamera()
+camera = hal.open_camera(camera_source)
 camera.resolution = (w, h)
 if fps > 0:
     camera.framerate = fps
@@ -253,22 +294,24 @@ camera.vflip = ver_flip
 camera.led = False
 camera.exposure_mode = 'fixedfps'
 
+# Frames are read and written in background threads, see common/vexlink.py
+link = VexLink(port)
+stats_time = time.time()
 while True:
-    rcv = port.readline()
+    frame = link.receive(timeout=3.0)
+    if debug and time.time() - stats_time >= stats_period:
+        debug_print("Link: " + repr(link.stats()))
+        stats_time = time.time()
 
-    if len(rcv) == 0:
+    if frame is None:
         debug_print("Timeout receiving command")
-        continue        
-    else:
-        write_to_log(rcv)
+        continue
+    frame_type, payload, frame_time = frame
+    val = bytearray(payload)[0] if payload else 0
+    write_to_log(frame_type, val, frame_time)
 
-    # Parse link command, if present
-    #   If the link control command is present ('Lxx'),
-    # it must be the first command in the received string
-    # This is to accelerate Python code running on Raspberry Pi
-    # (no need to parse the whole string looking for Lxx)
-    if rcv[0] == 'L':
-        val = int(rcv[1:3], 16)
+    # Link command
+    if frame_type == LINK:
 
         # autonomous mode - ignore all commands except return to Manual Control
         if autonomous and not val == 1:
@@ -289,22 +332,26 @@ while True:
         elif val == 3:
             # L03: start recording
             if not autonomous and start_recording():
-                write_to_log(rcv)
+                write_to_log(frame_type, val, frame_time)
         elif val == 4:
             # L04: stop capture
-            if camera.recording():
+            if camera.recording:
                 stop_recording()
         elif val == 254:
             # LFD: discard current recording (if human made a mistake in training)
-            if camera.recording():
+            if camera.recording:
                 debug_print("Discarding current recording")
                 stop_recording()
-                # Delete video and associated log
+                # Delete video and associated logs
                 os.remove(video_file_name)
+                os.remove(video_file_name.replace(video_file_ext, frame_times_ext))
                 os.remove(log_file_name)
+                if text_log:
+                    os.remove(log_file_name.replace(cmdlog_ext, log_file_ext))
+                recording_index.remove(log_file_name.replace(cmdlog_ext, ""))
                 # Resume recording
                 if start_recording():
-                    write_to_log(rcv)
+                    write_to_log(frame_type, val, frame_time)
         elif val == 255:
             # TODO LFE: quit script (and shut down Raspberry Pi by default)
             debug_print("Shutting down Raspberry Pi")
@@ -312,10 +359,13 @@ while True:
         else:
             # L00 and otherwise: none (no command)
             debug_print("Unsupported link command or no command")
-    else:
-        write_to_log(rcv)
 
 stop_recording()
 enable_autonomous_driving(False)
+link.close()
+print "Link: " + repr(link.stats())
+if latency_file and latency.count:
+    latency.dump(my_dir + latency_file)
+    print_summary(latency.summary())
 if shutdown_on_exit:
 	os.system("sudo shutdown now -h")
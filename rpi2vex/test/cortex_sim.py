@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# Stand-in for the VEX Cortex side of the Raspberry Pi UART link
+# See more at https://github.com/oomwoo/
+#
+# Copyright (C) 2016 oomwoo.com
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version 3.0
+# as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License <http://www.gnu.org/licenses/> for details.
+"""
+Talks to rpi2vex.py like vex/bot.c does, every 20 ms: sends link and user
+command frames, reads drive commands from the Pi, expires them after
+USER_CMD_MAX_AGE loops. Runs a fixed session: record while "driving",
+stop recording, drive autonomously, return to manual control, terminate.
+    python rpi2vex.py -d -u pty -c <recording or image dir>
+    python cortex_sim.py /dev/pts/N
+"""
+
+import os
+import sys
+import time
+import getopt
+sys.path.append(os.path.expanduser("~") + "/dora/common")
+from hal import StreamPort
+from vexlink import LINK, USER
+from cortexsim import CortexStandIn
+
+
+loop_period = 0.02  # bot.c wait1Msec(20)
+record_seconds = 5
+autonomous_seconds = 10
+corrupt_pct = 0  # Corrupt one byte in this percentage of frames sent
+
+
+def usage():
+    print "python cortex_sim.py [options] /dev/pts/N"
+    print "  -r n: seconds of recording, default %d" % record_seconds
+    print "  -a n: seconds of autonomous driving, default %d" % autonomous_seconds
+    print "  -e pct: corrupt a byte in pct%% of frames sent, default %d" % corrupt_pct
+    print "  -?: print usage"
+
+
+opts, args = getopt.getopt(sys.argv[1:], "r:a:e:?")
+for opt, arg in opts:
+    if opt == '-r':
+        record_seconds = float(arg)
+    elif opt == '-a':
+        autonomous_seconds = float(arg)
+    elif opt == '-e':
+        corrupt_pct = float(arg)
+    elif opt == '-?':
+        usage()
+        sys.exit(2)
+if len(args) != 1:
+    usage()
+    sys.exit(2)
+
+fd = os.open(args[0], os.O_RDWR | os.O_NOCTTY)
+cortex = CortexStandIn(StreamPort(fd, fd, timeout=0), corrupt_pct=corrupt_pct)
+
+
+def run(seconds, link_cmd=None, user_cmds=None):
+    # bot.c UserControlFunction() loop
+    n = 0
+    next_time = time.time()
+    end_time = next_time + seconds
+    while time.time() < end_time:
+        if link_cmd is not None:
+            cortex.send(LINK, link_cmd)
+            link_cmd = None
+        if user_cmds:
+            cortex.send(USER, user_cmds[n // 25 % len(user_cmds)])
+        cortex.step()
+        n += 1
+        next_time += loop_period
+        time.sleep(max(0, next_time - time.time()))
+
+
+start_time = time.time()
+run(record_seconds, 3, [0, 1, 0, 2])  # L03 start recording, drive
+run(1, 4)  # L04 stop recording
+run(autonomous_seconds, 2)  # L02 autonomous control
+run(1, 1)  # L01 manual control
+cortex.send(LINK, 255)  # LFF terminate link
+seconds = time.time() - start_time
+
+received = len(cortex.commands)
+print "Sent %d frames (%d corrupted) in %.1f s" % (cortex.sent, cortex.corrupted, seconds)
+print "Received %d drive commands, %.1f/s while autonomous, %d expired" % (
+    received, received / autonomous_seconds, cortex.expired)
+print "Receive CRC errors %d, bytes skipped %d" % (cortex.decoder.crc_errors, cortex.decoder.skipped)
@@ -5,19 +5,30 @@
 # Distributed under GNU General Public License v3
 # Use solely at your own risk
 # Absolutely no warranty expressed or implied
-import webiopi
-from Adafruit_MotorHAT import Adafruit_MotorHAT, Adafruit_DCMotor
-import time, sys, getopt, picamera, glob, re, subprocess, os
+import time
+script_start_time = time.time()
+import sys, getopt, glob, re, subprocess, os
 import threading
-import picamera.array
+import functools
+import traceback
+import collections
+import Queue
+import json
 import numpy as np
-from PIL import Image
-from neon.backends import gen_backend
-from neon.layers import Affine, Conv, Pooling
-from neon.models import Model
-from neon.transforms import Rectlin, Softmax
-from neon.initializers import Uniform
-from neon.data.dataiterator import ArrayIterator
+my_dir = "/home/pi/dora/"
+sys.path.append(my_dir + "common")
+from hal import webiopi, motor_hat_class, open_camera  # Real or simulated, see common/hal.py
+from frames import FrameRing, VideoPortOutput, TimestampedOutput
+from recordings import frame_times_ext
+from recindex import RecordingIndex
+from preprocess import Preprocessor, to_image
+from inference import InferenceSession
+from cmdlog import CommandLog, export_text, cmdlog_ext
+from wsjoystick import JoystickServer
+from webauth import new_token
+from preview import JpegFrameOutput, PreviewServer
+from latency import LatencyRecorder
+from scenegate import SceneGate
 
 
 # Configuration defaults
@@ -36,15 +47,27 @@ hor_flip = True
 ver_flip = True
 video_file_ext = ".h264"
 log_file_ext = ".txt"
-
-global autonomous, camera, autonomous_override
+text_log = True  # Also export binary command log to text when recording stops
+stats_period = 5  # Seconds between decision rate reports
+preview_port = 8002  # MJPEG preview at http://<robot>:8002/stream.mjpg?token=<web_token>, 0 to disable
+preview_size = (160, 120)
+preview_fps = 10  # Highest preview frame rate sent to each browser
+latency_file = "latency.csv"  # Decision latency per stage, saved to my_dir on exit, "" to disable
+upload_destination = ""  # rsync target of upload_recordings over ssh (key login), e.g. "me@pc:dora/rpi2/video/"
+upload_state = ""
+
+global autonomous, camera_manager, autonomous_override
 autonomous = False
 autonomous_override = False
 log_file = []
 video_file_name = []
+video_output = []
+recording_index = []
 log_file_name = []
 autonomous_thread = []
-camera = []
+camera_manager = []
+preview_output = []
+preview_server = []
 USER_CMD_DRIVE_FORWARD = 0
 USER_CMD_TURN_LEFT = 1
 USER_CMD_TURN_RIGHT = 2
@@ -54,86 +77,254 @@ USER_CMD_NONE = 4
 # CNN setup
 W = 32
 H = W
-my_dir = "/home/pi/dora/"
 video_dir = my_dir + "train/video/"
 # param_file_name = my_dir + "train/model/trained_dora_model_24x24_3x3x16.prm"
 param_file_name = my_dir + "train/model/trained_dora_model_32x32.prm"
 class_names = ["forward", "left", "right", "backward"]    # from ROBOT-C bot.c
 nclasses = len(class_names)
-size = H, W
+engine = "neon"  # "neon", "numpy" (pure NumPy, no Neon import) or "int8" (quantized)
+scene_threshold = 2.0  # Reuse last decision while frames differ less (mean abs, 0..255), 0 to disable
+scene_max_age = 0.3  # Seconds a reused decision may be old
 file_name_prefix = video_dir + file_name_prefix
 last_user_cmd = USER_CMD_NONE
+prewarm_network = True  # Load neural network in background right after setup()
+session = []
+network_loader = []
+network_ready = threading.Event()
+network_error = ""  # Why the last load failed, shown by get_state()
+startup_times = {}
+
+# Macros post commands to control threads and return at once;
+# toggles wait for theirs to run, then return the new state
+control_queue = Queue.Queue()  # Motors, speed, command log
+camera_queue = Queue.Queue()  # Camera, recording, autonomous driving; may take seconds
+toggle_timeout = 10  # Longest a toggle waits, s; get_state() shows busy until done
+motor_latency = collections.deque(maxlen=1000)  # Macro call to motor command, s
+control_threads = []
+recording = False
+latency = LatencyRecorder()  # Frame capture to motor command, per stage, see common/latency.py
+
+# WebSocket joystick channel, see index.html; macros remain as fallback
+joystick_port = 8001  # 0 to disable
+joystick_timeout = 0.5  # Stop motors if the page goes silent this long, s
+joystick_server = []
+web_token = new_token()  # In joystick and preview URLs, index.html gets it from get_web_token(), see common/webauth.py
+
+def load_network():
+  # Slow (Neon import, model build), runs in background, see start_loading_network()
+  global session, network_loader, network_error
+  start_time = time.time()
+  try:
+    if engine == "numpy":
+      # Exported weights, see common/npengine.py, Neon not loaded at all
+      from npengine import load_model
+      session = load_model(param_file_name)
+    elif engine == "int8":
+      # Weights quantized by common/quantize.py
+      from quantize import QuantizedModel
+      session = QuantizedModel(param_file_name.replace(".prm", "_int8.npz"))
+    else:
+      from neon.backends import gen_backend
+      from graphopt import compile_model
+
+      be = gen_backend(backend='cpu', batch_size=1)    # NN backend
+      # Batch norm folded, ReLU fused at load time, see common/graphopt.py
+      session = InferenceSession(compile_model(param_file_name), (3, H, W))
+  except Exception as e:
+    traceback.print_exc()
+    network_error = "%s: %s" % (type(e).__name__, e)
+    # Next start_loading_network() tries again
+    network_loader = []
+    return
+  debug_print("Neural network loaded in %.1f s" % (time.time() - start_time))
+  network_ready.set()
+
+def start_loading_network():
+  global network_loader, network_error
+  if network_loader == [] and not network_ready.is_set():
+    network_error = ""
+    network_loader = threading.Thread(target=load_network)
+    network_loader.daemon = True
+    network_loader.start()
+
+def process_start_time():
+  # When WebIOPi process started, from Linux /proc
+  try:
+    with open("/proc/stat") as f:
+      boot_time = [int(l.split()[1]) for l in f if l.startswith("btime")][0]
+    with open("/proc/self/stat") as f:
+      start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+    return boot_time + start_ticks / float(os.sysconf("SC_CLK_TCK"))
+  except (IOError, IndexError, ValueError):
+    return script_start_time
+
+def note_startup_time(event):
+  # Report time from process start to the first event of each kind
+  if event not in startup_times:
+    startup_times[event] = time.time() - process_start_time()
+    debug_print("Startup: first %s %.2f s after process start" % (event, startup_times[event]))
+
+def macro(func):
+  # webiopi.macro, also measures time to first macro
+  @functools.wraps(func)
+  def timed_macro(*args):
+    note_startup_time("macro")
+    return func(*args)
+  return webiopi.macro(timed_macro)
+
+def post(commands, func, *args):
+  commands.put((time.time(), func, args))
+
+def post_and_wait(commands, func, *args):
+  # False if the command has not run within toggle_timeout
+  done = threading.Event()
+  def run():
+    try:
+      func(*args)
+    finally:
+      done.set()
+  post(commands, run)
+  return done.wait(toggle_timeout)
+
+class ControlThread (threading.Thread):
+  # Runs posted commands one at a time, in order
+  def __init__(self, commands, latency=None):
+    threading.Thread.__init__(self)
+    self.daemon = True
+    self.commands = commands
+    self.latency = latency
+    self.busy = False
 
-be = gen_backend(backend='cpu', batch_size=1)    # NN backend
-init_uni = Uniform(low=-0.1, high=0.1)           # Unnecessary NN weight initialization
-bn = True                                        # enable NN batch normalization
-layers = [Conv((5, 5, 16), init=init_uni, activation=Rectlin(), batch_norm=bn),
-          Pooling((2, 2)),
-          Conv((3, 3, 32), init=init_uni, activation=Rectlin(), batch_norm=bn),
-          Pooling((2, 2)),
-          Affine(nout=50, init=init_uni, activation=Rectlin(), batch_norm=bn),
-          Affine(nout=nclasses, init=init_uni, activation=Softmax())]
-model = Model(layers=layers)
-model.load_params(param_file_name, load_states=False)
+  def run(self):
+    while True:
+      post_time, func, args = self.commands.get()
+      if func is None:
+        break
+      self.busy = True
+      try:
+        func(*args)
+      except Exception:
+        traceback.print_exc()
+      if self.latency is not None:
+        self.latency.append(time.time() - post_time)
+      self.busy = self.commands.qsize() > 0
+
+def start_control_threads():
+  global control_threads
+  control_threads = [ControlThread(control_queue, motor_latency), ControlThread(camera_queue)]
+  for t in control_threads:
+    t.start()
+
+def stop_control_threads():
+  for t in control_threads:
+    post(t.commands, None)
+    t.join(5)
+
+def latency_percentiles(latency):
+  if len(latency) == 0:
+    return {}
+  x = 1000 * np.array(latency)
+  return dict((str(p), round(float(np.percentile(x, p)), 2)) for p in [50, 90, 99])
 
 # Motor setup
-mh = Adafruit_MotorHAT(addr=0x60)
+MotorHAT = motor_hat_class()
+mh = MotorHAT(addr=0x60)
 right_motor = mh.getMotor(1)
 left_motor = mh.getMotor(3)
 
-def open_camera():
-  global camera
-  if camera != []:
-    camera.close()
-
-  debug_print("Opening camera")
-  camera = picamera.PiCamera()
-  camera.resolution = (w, h)
-  if fps > 0:
-    camera.framerate = fps
-  camera.hflip = hor_flip
-  camera.vflip = ver_flip
-  #  camera.exposure_mode = 'fixedfps'
-  time.sleep(0.2)  # Let camera exposure settle
-
-def close_camera():
-  global camera
-  if camera != []:
-    debug_print("Closing camera")
-    camera.close()
-    camera = []
+class CameraManager(object):
+  # Opens the camera once; recording, inference and preview each stream
+  # from their own splitter port and start/stop without disturbing the others
+  recording_splitter = 1  # camera.frame, used by TimestampedOutput, reports on port 1
+  inference_splitter = 2
+  preview_splitter = 3
+
+  def __init__(self, on_open=None):
+    self.camera = None
+    self.outputs = {}
+    self.lock = threading.RLock()
+    self.on_open = on_open  # Called each time the camera is opened, e.g. after release_camera()
+
+  def open(self):
+    with self.lock:
+      if self.camera is not None:
+        return self.camera
+      debug_print("Opening camera")
+      camera = open_camera()
+      camera.resolution = (w, h)
+      if fps > 0:
+        camera.framerate = fps
+      camera.hflip = hor_flip
+      camera.vflip = ver_flip
+      #  camera.exposure_mode = 'fixedfps'
+      time.sleep(0.2)  # Let camera exposure settle
+      self.camera = camera
+      if self.on_open is not None:
+        try:
+          self.on_open()
+        except Exception:
+          # Recording and driving go on without the preview
+          traceback.print_exc()
+      return camera
+
+  def start(self, port, output, format, **kwargs):
+    with self.lock:
+      self.open().start_recording(output, format=format, splitter_port=port, **kwargs)
+      self.outputs[port] = output
+
+  def stop(self, port):
+    with self.lock:
+      if port in self.outputs:
+        self.camera.stop_recording(splitter_port=port)
+        del self.outputs[port]
+      if not self.outputs:
+        self.close()
+
+  def is_active(self, port):
+    return port in self.outputs
+
+  def close(self):
+    with self.lock:
+      for port in list(self.outputs):
+        self.camera.stop_recording(splitter_port=port)
+      self.outputs = {}
+      if self.camera is not None:
+        debug_print("Closing camera")
+        self.camera.close()
+        self.camera = None
 
 def is_camera_recording():
-  if camera == []:
-    return False
-  return camera.recording
+  return camera_manager.is_active(CameraManager.recording_splitter)
+
+def start_preview():
+  global preview_output, preview_server
+  preview_output = JpegFrameOutput()
+  camera_manager.start(CameraManager.preview_splitter, preview_output, 'mjpeg', resize=preview_size)
+  if preview_server == []:
+    preview_server = PreviewServer(preview_output, preview_port, preview_fps, web_token)
+  else:
+    preview_server.output = preview_output
+
+def close_camera():
+  camera_manager.close()
 
 def rm_files(file_path_name):
   command = "rm " + file_path_name #+ " 2> /dev/null"
   subprocess.call(command, shell=True)
 
-def debug_start_timing():
-  if debug:
-    global start_time
-    start_time = time.time()
-
-def debug_stop_timing():
-  if debug:
-    debug_print("--- %s seconds per decision --- " % (time.time() - start_time))
-
 def drive(cmd):
   if cmd == USER_CMD_DRIVE_FORWARD:
-    left_motor.run(Adafruit_MotorHAT.BACKWARD)
-    right_motor.run(Adafruit_MotorHAT.FORWARD)
+    left_motor.run(MotorHAT.BACKWARD)
+    right_motor.run(MotorHAT.FORWARD)
   elif cmd == USER_CMD_TURN_LEFT:
-    left_motor.run(Adafruit_MotorHAT.BACKWARD)
-    right_motor.run(Adafruit_MotorHAT.RELEASE)
+    left_motor.run(MotorHAT.BACKWARD)
+    right_motor.run(MotorHAT.RELEASE)
   elif cmd == USER_CMD_TURN_RIGHT:
-    left_motor.run(Adafruit_MotorHAT.RELEASE)
-    right_motor.run(Adafruit_MotorHAT.FORWARD)
+    left_motor.run(MotorHAT.RELEASE)
+    right_motor.run(MotorHAT.FORWARD)
   elif cmd == USER_CMD_DRIVE_BACKWARD:
-    left_motor.run(Adafruit_MotorHAT.FORWARD)
-    right_motor.run(Adafruit_MotorHAT.BACKWARD)
+    left_motor.run(MotorHAT.FORWARD)
+    right_motor.run(MotorHAT.BACKWARD)
   else:
     stop_motors()
 
@@ -149,16 +340,32 @@ class AutonomousThread (threading.Thread):
     self.daemon = True
     debug_print("Autonomous thread init")
     self.cnt = 0
+    self.preprocessor = Preprocessor(W, H, w, h)
+    self.gate = SceneGate(scene_threshold, scene_max_age)
+    self.ring = None
     rm_files(my_dir + "train/debug/*")
 
   def run(self):
-    global camera, autonomous_override
-    open_camera()
-    
+    global autonomous_override, autonomous
+    # Stream frames from the video port, always decide on the newest one;
+    # full size, downsampled by Preprocessor exactly like the training images
+    ring = FrameRing(h, w)
+    camera_manager.start(CameraManager.inference_splitter, VideoPortOutput(ring, w, h), 'rgb', resize=(w, h))
+    self.ring = ring
+    if not network_ready.is_set():
+      debug_print("Waiting for neural network to load")
+      while autonomous and not network_ready.wait(0.1):
+        if network_error:
+          print("Neural network failed to load, autonomous driving off: " + network_error)
+          autonomous = False
+          camera_manager.stop(CameraManager.inference_splitter)
+          return
+    self.reset_stats()
+
     while True:
       if not autonomous:
         debug_print("Exiting autonomous thread")
-        close_camera()
+        camera_manager.stop(CameraManager.inference_splitter)
         turn_off_motors()
         break
 
@@ -166,67 +373,76 @@ class AutonomousThread (threading.Thread):
         time.sleep(0)
         continue
 
-      # Grab a still frame
-      stream = picamera.array.PiRGBArray(camera)
-      camera.capture(stream, 'rgb', use_video_port=False)
-
-      debug_print("Grabbed a still frame")
-      debug_start_timing()
-      image = Image.fromarray(stream.array)
-      image = image.resize(size, Image.ANTIALIAS)
-      if (debug):
-        image.save(my_dir + "train/debug/capture" + str(self.cnt) + ".png", "PNG")
-        self.cnt = self.cnt + 1
-      r, g, b = image.split()
-      image = Image.merge("RGB", (b, g, r))
-      image = np.asarray(image, dtype=np.float32)
-      image = np.transpose(image, (2, 0, 1))
-      x_new = image.reshape(1, 3*W*H) - 127
-
-      if autonomous_override:
-        time.sleep(0)
+      frame, frame_time = ring.get()
+      if frame is None:
+        debug_print("Timeout waiting for a frame")
         continue
 
-      # Run neural network
-      inference_set = ArrayIterator(x_new, None, nclass=nclasses, lshape=(3, H, W))
-      out = model.get_outputs(inference_set)
-      debug_stop_timing()
-      decision = out.argmax()
-      debug_print(class_names[decision])
+      start_time = time.time()
+      # Scene unchanged since the network last ran: reuse its decision
+      decision = self.gate.check(frame, frame_time)
+      preprocess_time = inference_time = time.time()
+      inferred = decision is None
+      if inferred:
+        x_new = self.preprocessor(frame)
+        preprocess_time = time.time()
+
+        if autonomous_override:
+          time.sleep(0)
+          continue
+
+        # Run neural network
+        out = session.classify(x_new)
+        inference_time = time.time()
+        decision = out.argmax()
+        self.gate.update(decision, inference_time - start_time)
+      decision_time = time.time()
 
       if not autonomous_override:
         drive(decision)
+        latency.record(frame_time, start_time, preprocess_time, inference_time, decision_time, time.time())
+        note_startup_time("decision")
+        self.update_stats(frame_time, ring.dropped)
 
-def get_file_max_idx(prefix, file_ext):
-  rs = "[0-9][0-9][0-9][0-9][0-9]"
-  file_names = glob.glob(prefix + rs + file_ext)
-  if not file_names:
-    return 0
-  numbers = [int((re.findall('\d+', s))[0]) for s in file_names]
-  return max(numbers) + 1
+      debug_print(class_names[decision])
+      if debug and inferred:
+        to_image(x_new, W, H).save(my_dir + "train/debug/capture" + str(self.cnt) + ".png", "PNG")
+        self.cnt = self.cnt + 1
+
+  def reset_stats(self):
+    self.decisions = 0
+    self.latency = 0
+    self.stats_start_time = time.time()
+
+  def update_stats(self, frame_time, dropped):
+    # Decisions per second, capture-to-actuation latency
+    now = time.time()
+    self.decisions += 1
+    self.latency += now - frame_time
+    if now - self.stats_start_time >= stats_period:
+      debug_print("%.1f decisions/s, %.1f ms capture-to-actuation, %d frames dropped, scene gate %r" %
+                  (self.decisions / (now - self.stats_start_time),
+                   1000 * self.latency / self.decisions, dropped, self.gate.stats()))
+      self.reset_stats()
 
 def start_recording():
   if autonomous:
     return False
 
-  global log_file, video_file_name, log_file_name, camera
+  global log_file, video_file_name, log_file_name, video_output, recording
 
   debug_print("Starting recording");  
-  if camera == []:
-    open_camera()
-  
-  if not(camera.recording):
-    n1 = get_file_max_idx(file_name_prefix, video_file_ext)
-    n2 = get_file_max_idx(file_name_prefix, log_file_ext)
-    n = max(n1, n2)
-    s = str(n).zfill(5)
+  if not is_camera_recording():
     global log_file_name_no_ext
-    log_file_name_no_ext = file_name_prefix + s
+    log_file_name_no_ext = recording_index.allocate()
     video_file_name = log_file_name_no_ext + video_file_ext
-    log_file_name = log_file_name_no_ext + log_file_ext
-    camera.start_recording(video_file_name, quality=quality)
-    log_file = open(log_file_name, "w")
+    log_file_name = log_file_name_no_ext + cmdlog_ext
+    # Save capture time of each frame to align commands with frames
+    video_output = TimestampedOutput(camera_manager.open(), video_file_name, log_file_name_no_ext + frame_times_ext)
+    camera_manager.start(CameraManager.recording_splitter, video_output, 'h264', quality=quality)
+    log_file = CommandLog(log_file_name)
     do_write_to_log(USER_CMD_NONE);
+    recording = True
 
     debug_print("Recording to " + log_file_name)
     return True
@@ -235,18 +451,22 @@ def start_recording():
 
 def stop_recording():
   if is_camera_recording():
-    global log_file, camera
+    global log_file, log_file_name_no_ext, recording
     debug_print("Stopping recording")
-    camera.stop_recording()
+    recording = False
+    camera_manager.stop(CameraManager.recording_splitter)
+    video_output.close()
     log_file.close()
-    close_camera()
-    global log_file_name_no_ext
+    if text_log:
+      export_text(log_file_name, log_file_name_no_ext + log_file_ext)
     os.system("sudo chown pi:pi " + log_file_name_no_ext + ".*")
+    recording_index.add(log_file_name_no_ext)
 
 def enable_autonomous_driving(enable):
   global autonomous, autonomous_thread
   if (not autonomous) and enable:
     stop_recording()
+    start_loading_network()
     autonomous = True
     autonomous_thread = AutonomousThread()
     autonomous_thread.start()
@@ -258,16 +478,14 @@ def enable_autonomous_driving(enable):
 
 def write_to_log(cmd):
   global last_user_cmd
-  if not autonomous and camera != [] and camera.recording:
+  if not autonomous and recording:
     do_write_to_log(last_user_cmd)
     do_write_to_log(cmd)
   last_user_cmd = cmd
 
 def do_write_to_log(cmd):
-  global log_file
-  s = repr(time.time()) + " u" + repr(cmd)  # Prepend timestamp
-  debug_print(s)
-  log_file.write(s + "\n")
+  # Queued, written to SD card in background
+  log_file.write('u', cmd)
 
 def debug_print(s):
   if debug:
@@ -276,10 +494,10 @@ def debug_print(s):
 # Disable motors on script shutdown
 def turn_off_motors():
   debug_print("Turning off all motors")
-  mh.getMotor(1).run(Adafruit_MotorHAT.RELEASE)
-  mh.getMotor(2).run(Adafruit_MotorHAT.RELEASE)
-  mh.getMotor(3).run(Adafruit_MotorHAT.RELEASE)
-  mh.getMotor(4).run(Adafruit_MotorHAT.RELEASE)
+  mh.getMotor(1).run(MotorHAT.RELEASE)
+  mh.getMotor(2).run(MotorHAT.RELEASE)
+  mh.getMotor(3).run(MotorHAT.RELEASE)
+  mh.getMotor(4).run(MotorHAT.RELEASE)
 
 def set_speed(speed):
   global motor_speed
@@ -292,92 +510,220 @@ def set_speed(speed):
   right_motor.setSpeed(speed)
 
 def stop_motors():
-  left_motor.run(Adafruit_MotorHAT.RELEASE)
-  right_motor.run(Adafruit_MotorHAT.RELEASE)
+  left_motor.run(MotorHAT.RELEASE)
+  right_motor.run(MotorHAT.RELEASE)
   write_to_log(USER_CMD_NONE)
 
 # Control over network
-@webiopi.macro
+@macro
 def go_forward():
-  drive_and_log(USER_CMD_DRIVE_FORWARD)
+  post(control_queue, drive_and_log, USER_CMD_DRIVE_FORWARD)
 
-@webiopi.macro
+@macro
 def go_backward():
-  drive_and_log(USER_CMD_DRIVE_BACKWARD)
+  post(control_queue, drive_and_log, USER_CMD_DRIVE_BACKWARD)
 
-@webiopi.macro
+@macro
 def turn_left():
-  drive_and_log(USER_CMD_TURN_LEFT)
+  post(control_queue, drive_and_log, USER_CMD_TURN_LEFT)
 
-@webiopi.macro
+@macro
 def turn_right():
-  drive_and_log(USER_CMD_TURN_RIGHT)
+  post(control_queue, drive_and_log, USER_CMD_TURN_RIGHT)
 
-@webiopi.macro
-def joystick_release():
+def release_joystick():
   global autonomous_override
   autonomous_override = False
   stop_motors()
 
-@webiopi.macro
-def stop():
+@macro
+def joystick_release():
+  post(control_queue, release_joystick)
+
+def stop_driving():
   global autonomous_override
   autonomous_override = True
   stop_motors()
 
-@webiopi.macro
+@macro
+def stop():
+  post(control_queue, stop_driving)
+
+@macro
 def shutdown_pi():
   debug_print("Shutting down\n")
   os.system("sudo poweroff")
 
-@webiopi.macro
-def toggle_self_driving():
+def toggle_autonomous_driving():
   enable_autonomous_driving(not autonomous)
-  return autonomous
 
-@webiopi.macro
+@macro
+def toggle_self_driving():
+  post_and_wait(camera_queue, toggle_autonomous_driving)
+  return get_state()
+
+@macro
 def increase_speed():
-    set_speed(motor_speed + motor_speed_increment)
+  post(control_queue, lambda: set_speed(motor_speed + motor_speed_increment))
 
-@webiopi.macro
+@macro
 def decrease_speed():
-    set_speed(motor_speed - motor_speed_increment)
+  post(control_queue, lambda: set_speed(motor_speed - motor_speed_increment))
 
-@webiopi.macro
-def toggle_recording():
+def toggle_camera_recording():
   if is_camera_recording():
     stop_recording()
   elif not autonomous:
     start_recording()
-  return is_camera_recording()
 
-@webiopi.macro
-def discard_recording():
+@macro
+def toggle_recording():
+  post_and_wait(camera_queue, toggle_camera_recording)
+  return get_state()
+
+def discard_camera_recording():
   if is_camera_recording():
     debug_print("Discarding current recording")
     stop_recording()
-    # Delete last video and associated log
+    # Delete last video and associated logs
     os.remove(video_file_name)
+    os.remove(log_file_name_no_ext + frame_times_ext)
     os.remove(log_file_name)
+    if text_log:
+      os.remove(log_file_name_no_ext + log_file_ext)
+    recording_index.remove(log_file_name_no_ext)
+
+@macro
+def discard_recording():
+  post(camera_queue, discard_camera_recording)
   return True
 
-@webiopi.macro
-def upload_recordings():
-  # TODO
-  debug_print("Uploading recordings");
+def release_camera():
   enable_autonomous_driving(False)
+  stop_recording()
   close_camera()
-  turn_off_motors()
+
+def upload_new_recordings():
+  # Recordings not uploaded yet, listed by the recording index, no directory scan
+  global upload_state
+  release_camera()
+  files = recording_index.not_uploaded()
+  if not files:
+    upload_state = "nothing to upload"
+    return
+  upload_state = "uploading %d recordings" % len(files)
+  debug_print("Uploading %d recordings to %s" % (len(files), upload_destination))
+  file_list = "".join(f + "\n" for name in sorted(files) for f in files[name])
+  try:
+    p = subprocess.Popen(["rsync", "-a", "--files-from=-", recording_index.video_dir + "/", upload_destination],
+                         stdin=subprocess.PIPE)
+    p.communicate(file_list)
+    status = p.returncode
+  except OSError as e:
+    status = str(e)
+  if status == 0:
+    recording_index.mark_uploaded(files)
+    upload_state = "uploaded %d recordings" % len(files)
+  else:
+    upload_state = "upload failed: rsync %s" % status
+  debug_print(upload_state)
+
+@macro
+def upload_recordings():
+  if not upload_destination:
+    debug_print("Set upload_destination in dora.py to upload recordings")
+    return False
+  post(camera_queue, upload_new_recordings)
+  post(control_queue, turn_off_motors)
+  return True
+
+# WebSocket joystick commands, same as the macros
+joystick_commands = {"f": USER_CMD_DRIVE_FORWARD, "b": USER_CMD_DRIVE_BACKWARD,
+                     "l": USER_CMD_TURN_LEFT, "r": USER_CMD_TURN_RIGHT}
+
+def on_joystick_command(cmd):
+  # Returns True while motors run, arms the dead-man switch
+  if cmd in joystick_commands:
+    post(control_queue, drive_and_log, joystick_commands[cmd])
+    return True
+  elif cmd == "x":
+    post(control_queue, release_joystick)
+  elif cmd == "s":
+    post(control_queue, stop_driving)
   return False
 
+def on_joystick_timeout():
+  debug_print("Joystick went silent, stopping motors")
+  post(control_queue, release_joystick)
+
+@macro
+def get_state():
+  # Polled by index.html; busy while camera commands are pending
+  return json.dumps({"recording": recording, "autonomous": autonomous,
+                     "speed": motor_speed, "network_ready": network_ready.is_set(),
+                     "network_error": network_error, "upload": upload_state,
+                     "busy": control_threads[1].busy or not camera_queue.empty(),
+                     "motor_latency_ms": latency_percentiles(list(motor_latency)),
+                     "camera": camera_stats()})
+
+@macro
+def get_web_token():
+  # Behind WebIOPi's password, unlike the joystick and preview ports
+  return web_token
+
+@macro
+def get_latency():
+  # Percentiles and histograms of autonomous decision latency per stage, ms
+  return json.dumps(latency.summary())
+
+def camera_stats():
+  # Process CPU load since last call, frames per consumer
+  global cpu_times
+  now = (time.time(), sum(os.times()[:2]))
+  load = 100 * (now[1] - cpu_times[1]) / max(now[0] - cpu_times[0], 1e-3)
+  cpu_times = now
+  stats = {"cpu_percent": round(load, 1)}
+  if is_camera_recording():
+    stats["recorded"] = video_output.frames
+    stats["recording_dropped"] = video_output.dropped
+  if autonomous_thread != [] and autonomous_thread.ring is not None:
+    stats["inference_frames"] = autonomous_thread.ring.seq
+    stats["scene_gate"] = autonomous_thread.gate.stats()
+    stats["inference_dropped"] = autonomous_thread.ring.dropped
+  if preview_server != []:
+    stats["preview_encoded"] = preview_output.frames
+    stats["preview_sent"] = preview_server.sent
+  return stats
+
+cpu_times = (time.time(), sum(os.times()[:2]))
+
 # Called by WebIOPi at script loading
 def setup():
+  global recording_index, joystick_server, camera_manager
   set_speed(default_motor_speed)
   stop_motors()
+  recording_index = RecordingIndex(file_name_prefix, video_file_ext)
+  # The preview runs whenever the camera is open
+  camera_manager = CameraManager(start_preview if preview_port else None)
+  start_control_threads()
+  if preview_port:
+    post(camera_queue, camera_manager.open)
+  if joystick_port:
+    joystick_server = JoystickServer(joystick_port, on_joystick_command,
+                                     on_joystick_timeout, joystick_timeout, web_token)
+  note_startup_time("setup")
+  if prewarm_network:
+    start_loading_network()
 
 # Called by WebIOPi at server shutdown
 def destroy():
   debug_print("Exiting...")
+  stop_control_threads()
   enable_autonomous_driving(False)
+  stop_recording()
   close_camera()
+  if preview_server != []:
+    preview_server.close()
   turn_off_motors()
+  if latency_file and latency.count:
+    latency.dump(my_dir + latency_file)
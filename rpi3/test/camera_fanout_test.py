@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# Measure CPU load and dropped frames with recording, inference and preview active
+# See more at https://github.com/oomwoo/
+#
+# Copyright (C) 2016 oomwoo.com
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version 3.0
+# as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License <http://www.gnu.org/licenses/> for details.
+"""
+Opens the camera once and streams from three splitter ports, like dora.py:
+H.264 recording, RGB frames for the neural network, MJPEG preview.
+A consumer takes RGB frames at the neural network's pace. Open
+the printed http://<robot>:8002/stream.mjpg?token=... in a browser to load
+the preview too.
+"""
+
+import os
+import sys
+import time
+import picamera
+sys.path.append(os.path.expanduser("~") + "/dora/common")
+from frames import FrameRing, VideoPortOutput, TimestampedOutput
+from preview import JpegFrameOutput, PreviewServer
+
+w = 160
+h = 120
+fps = 30
+seconds = 20
+decision_time = 0.03  # Stand-in for preprocessing + neural network
+out_dir = "/tmp/"
+
+camera = picamera.PiCamera(clock_mode="raw")
+camera.resolution = (w, h)
+camera.framerate = fps
+time.sleep(0.2)
+
+ring = FrameRing(h, w)
+video_output = TimestampedOutput(camera, out_dir + "fanout.h264", out_dir + "fanout.pts")
+preview_output = JpegFrameOutput()
+camera.start_recording(video_output, format='h264', splitter_port=1)
+camera.start_recording(VideoPortOutput(ring, w, h), format='rgb', splitter_port=2, resize=(w, h))
+camera.start_recording(preview_output, format='mjpeg', splitter_port=3, resize=(w, h))
+preview_server = PreviewServer(preview_output, 8002, 10)
+print("Preview at http://<robot>:8002/stream.mjpg?token=" + preview_server.token)
+
+start_time = time.time()
+start_cpu = sum(os.times()[:2])
+decisions = 0
+while time.time() - start_time < seconds:
+    frame, frame_time = ring.get()
+    if frame is None:
+        continue
+    time.sleep(decision_time)
+    decisions += 1
+elapsed = time.time() - start_time
+cpu = sum(os.times()[:2]) - start_cpu
+
+for port in [3, 2, 1]:
+    camera.stop_recording(splitter_port=port)
+video_output.close()
+camera.close()
+preview_server.close()
+
+print("CPU load %.1f%% of one core over %.1f s" % (100 * cpu / elapsed, elapsed))
+print("Recording: %d frames, %d dropped" % (video_output.frames, video_output.dropped))
+print("Inference: %d frames, %d decisions, %d skipped (newest frame wins)" % (ring.seq, decisions, ring.dropped))
+print("Preview: %d JPEG frames encoded, %d sent" % (preview_output.frames, preview_server.sent))
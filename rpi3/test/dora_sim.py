@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# Run dora.py on a Linux PC with simulated camera and motors
+# See more at https://github.com/oomwoo/
+#
+# Copyright (C) 2016 oomwoo.com
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version 3.0
+# as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License <http://www.gnu.org/licenses/> for details.
+"""
+Loads dora.py without WebIOPi, camera or Motor HAT (see common/hal.py),
+drives with the joystick macros, records (if the camera replays an .h264
+recording), then drives autonomously with the NumPy engine.
+Reports motor commands, latencies and camera stats. Wrap in cProfile to profile:
+    python -m cProfile -s cumtime dora_sim.py -c rec00001.h264
+"""
+
+import os
+import sys
+import time
+import json
+import getopt
+import tempfile
+repo_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(repo_dir + "/common")
+sys.path.append(repo_dir + "/rpi3")
+
+camera_source = "fake"
+seconds = 10
+model = repo_dir + "/train/model/trained_dora_model_32x32.prm"
+
+
+def usage():
+    print "python dora_sim.py [options]"
+    print "  -c source: .h264 recording or image directory to replay, default " + camera_source
+    print "  -t n: seconds of autonomous driving, default %d" % seconds
+    print "  -n file: model, default " + model
+    print "  -?: print usage"
+
+
+opts, args = getopt.getopt(sys.argv[1:], "c:t:n:?")
+for opt, arg in opts:
+    if opt == '-c':
+        camera_source = arg
+    elif opt == '-t':
+        seconds = int(arg)
+    elif opt == '-n':
+        model = arg
+    elif opt == '-?':
+        usage()
+        sys.exit(2)
+
+os.environ["DORA_CAMERA"] = camera_source
+os.environ["DORA_MOTORS"] = "sim"
+import dora
+from latency import print_summary
+
+# Keep recordings and debug images out of /home/pi
+work_dir = tempfile.mkdtemp() + "/"
+os.makedirs(work_dir + "train/debug")
+dora.my_dir = work_dir
+dora.file_name_prefix = work_dir + "rec"
+dora.param_file_name = model
+dora.engine = "numpy"
+dora.debug = False
+dora.joystick_port = 0
+dora.preview_port = 0
+dora.setup()
+
+macros = [dora.go_forward, dora.turn_left, dora.turn_right, dora.go_backward]
+recording = camera_source.endswith(".h264")
+if recording:
+    dora.toggle_recording()
+for i in range(100):
+    macros[i % len(macros)]()
+    time.sleep(0.02)
+    dora.joystick_release()
+if recording:
+    dora.toggle_recording()
+
+while not dora.network_ready.wait(0.1) and not dora.network_error:
+    pass
+dora.toggle_self_driving()
+time.sleep(seconds)
+state = json.loads(dora.get_state())
+latency = json.loads(dora.get_latency())
+dora.toggle_self_driving()
+dora.destroy()
+
+commands = list(dora.mh.commands)
+runs = [c for c in commands if c[2] == "run"]
+print "Motor commands: %d, %d run, %d set speed" % (len(commands), len(runs), len(commands) - len(runs))
+print "Macro to motor command, ms: " + repr(state["motor_latency_ms"])
+print "Camera: " + repr(state["camera"])
+if state["network_error"]:
+    print "Neural network failed to load: " + state["network_error"]
+print_summary(latency)
+if recording:
+    print "Recorded: " + ", ".join(sorted(os.listdir(work_dir)))
+print "Work directory " + work_dir
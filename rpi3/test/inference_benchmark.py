@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# Measure time per decision of the driving neural network
+# See more at https://github.com/oomwoo/
+#
+# Copyright (C) 2016 oomwoo.com
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version 3.0
+# as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License <http://www.gnu.org/licenses/> for details.
+"""
+Compare time per decision: ArrayIterator + model.get_outputs() per frame
+versus a persistent InferenceSession, with the model as trained and compiled
+(batch norm folded, see common/graphopt.py), versus the NumPy engine.
+No camera needed.
+"""
+
+import os
+import sys
+import time
+import numpy as np
+from neon.backends import gen_backend
+from neon.layers import Affine, Conv, Pooling
+from neon.models import Model
+from neon.transforms import Rectlin, Softmax
+from neon.initializers import Uniform
+from neon.data.dataiterator import ArrayIterator
+my_dir = os.path.expanduser("~") + "/dora/"
+sys.path.append(my_dir + "common")
+from preprocess import Preprocessor
+from inference import InferenceSession
+from npengine import NumpyModel
+from graphopt import compile_model
+
+w = 160
+h = 120
+W = 32  # CNN input image size
+H = W
+decisions = 200
+param_file_name = my_dir + "train/model/trained_dora_model_32x32.prm"
+class_names = ["forward", "left", "right", "backward"]  # from ROBOT-C bot.c
+nclasses = len(class_names)
+
+be = gen_backend(backend='cpu', batch_size=1)    # NN backend
+init_uni = Uniform(low=-0.1, high=0.1)           # Unnecessary NN weight initialization
+bn = True                                        # enable NN batch normalization
+layers = [Conv((5, 5, 16), init=init_uni, activation=Rectlin(), batch_norm=bn),
+          Pooling((2, 2)),
+          Conv((3, 3, 32), init=init_uni, activation=Rectlin(), batch_norm=bn),
+          Pooling((2, 2)),
+          Affine(nout=50, init=init_uni, activation=Rectlin(), batch_norm=bn),
+          Affine(nout=nclasses, init=init_uni, activation=Softmax())]
+model = Model(layers=layers)
+model.load_params(param_file_name, load_states=False)
+
+# Random camera frames
+frames = np.random.randint(0, 256, size=(decisions, h, w, 3)).astype(np.uint8)
+preprocessor = Preprocessor(W, H, w, h)
+
+start_time = time.time()
+before = []
+for frame in frames:
+    x_new = preprocessor(frame)
+    inference_set = ArrayIterator(x_new, None, nclass=nclasses, lshape=(3, H, W))
+    before.append(model.get_outputs(inference_set)[0])
+before_time = (time.time() - start_time) / decisions
+
+session = InferenceSession(model, (3, H, W))
+start_time = time.time()
+after = []
+for frame in frames:
+    x_new = preprocessor(frame)
+    after.append(session.classify(x_new))
+after_time = (time.time() - start_time) / decisions
+
+compiled_session = InferenceSession(compile_model(param_file_name), (3, H, W))
+start_time = time.time()
+compiled = []
+for frame in frames:
+    x_new = preprocessor(frame)
+    compiled.append(compiled_session.classify(x_new))
+compiled_time = (time.time() - start_time) / decisions
+
+np_model = NumpyModel(param_file_name)
+start_time = time.time()
+np_out = []
+for frame in frames:
+    x_new = preprocessor(frame)
+    np_out.append(np_model.classify(x_new))
+np_time = (time.time() - start_time) / decisions
+
+print "ArrayIterator per frame: %.2f ms per decision" % (before_time * 1000)
+print "InferenceSession:        %.2f ms per decision" % (after_time * 1000)
+print "Compiled session:        %.2f ms per decision" % (compiled_time * 1000)
+print "NumPy engine:            %.2f ms per decision" % (np_time * 1000)
+print "Max output difference %g (session), %g (compiled), %g (NumPy engine)" % (
+    np.max(np.abs(np.array(before) - np.array(after))),
+    np.max(np.abs(np.array(before) - np.array(compiled))),
+    np.max(np.abs(np.array(before) - np.array(np_out))))
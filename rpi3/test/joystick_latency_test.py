@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# Compare joystick command round trip: WebSocket channel versus WebIOPi macros
+# See more at https://github.com/oomwoo/
+#
+# Copyright (C) 2016 oomwoo.com
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version 3.0
+# as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License <http://www.gnu.org/licenses/> for details.
+"""
+Sends press/release pairs to a running dora.py over both paths and
+reports round trip percentiles. Run on the Pi or on a PC on the same Wi-Fi.
+Motors will run: put the robot on a stand.
+"""
+
+import os
+import sys
+import time
+import getopt
+import base64
+import urllib2
+import numpy as np
+sys.path.append(os.path.expanduser("~") + "/dora/common")
+from wsjoystick import JoystickClient
+
+
+host = "localhost"
+http_port = 8000
+joystick_port = 8001
+user = "webiopi"
+password = "raspberry"
+commands = 200
+
+
+def usage():
+    print "python joystick_latency_test.py [options]"
+    print "  -a host: robot address, default " + host
+    print "  -n n: number of commands per path, default %d" % commands
+    print "  -?: print usage"
+
+
+opts, args = getopt.getopt(sys.argv[1:], "a:n:?")
+for opt, arg in opts:
+    if opt == '-a':
+        host = arg
+    elif opt == '-n':
+        commands = int(arg)
+    elif opt == '-?':
+        usage()
+        sys.exit(2)
+
+
+def report(name, round_trips):
+    x = 1000 * np.array(round_trips)
+    print "%-10s %6.2f %6.2f %6.2f %6.2f" % ((name,) + tuple(np.percentile(x, [50, 90, 99])) + (x.max(),))
+
+
+# WebIOPi macros, one HTTP POST per command
+auth = "Basic " + base64.b64encode(user + ":" + password)
+macro_times = []
+for i in range(commands):
+    name = "go_forward" if i % 2 == 0 else "joystick_release"
+    request = urllib2.Request("http://%s:%d/macros/%s" % (host, http_port, name), data="")
+    request.add_header("Authorization", auth)
+    start_time = time.time()
+    urllib2.urlopen(request).read()
+    macro_times.append(time.time() - start_time)
+
+# WebSocket channel, one message per command, acknowledged by seq
+request = urllib2.Request("http://%s:%d/macros/get_web_token" % (host, http_port), data="")
+request.add_header("Authorization", auth)
+client = JoystickClient(host, joystick_port, urllib2.urlopen(request).read())
+ws_times = []
+for i in range(commands):
+    start_time = time.time()
+    seq = client.send("f" if i % 2 == 0 else "x")
+    while client.receive() != seq:
+        pass
+    ws_times.append(time.time() - start_time)
+client.close()
+
+print "Round trip, ms: 50%    90%    99%    max"
+report("macro", macro_times)
+report("websocket", ws_times)
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# Measure joystick latency of dora.py under a load of macro calls
+# See more at https://github.com/oomwoo/
+#
+# Copyright (C) 2016 oomwoo.com
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version 3.0
+# as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License <http://www.gnu.org/licenses/> for details.
+"""
+Press and release the joystick at a steady rate while another thread
+toggles recording and polls state, like index.html does.
+Reports HTTP round trip percentiles per macro and, from get_state,
+dora.py's own macro-to-motor latency percentiles.
+Motors will run: put the robot on a stand.
+"""
+
+import sys
+import time
+import json
+import getopt
+import base64
+import threading
+import urllib2
+import numpy as np
+
+
+url = "http://localhost:8000"
+user = "webiopi"
+password = "raspberry"
+seconds = 30
+joystick_rate = 10  # Presses per second
+toggle_period = 3  # Seconds between toggle_recording calls
+
+
+def usage():
+    print "python macro_load_test.py [options]"
+    print "  -u url: WebIOPi server, default " + url
+    print "  -t n: test duration, seconds, default %d" % seconds
+    print "  -r n: joystick presses per second, default %d" % joystick_rate
+    print "  -?: print usage"
+
+
+opts, args = getopt.getopt(sys.argv[1:], "u:t:r:?")
+for opt, arg in opts:
+    if opt == '-u':
+        url = arg
+    elif opt == '-t':
+        seconds = int(arg)
+    elif opt == '-r':
+        joystick_rate = int(arg)
+    elif opt == '-?':
+        usage()
+        sys.exit(2)
+
+auth = "Basic " + base64.b64encode(user + ":" + password)
+round_trips = {}
+lock = threading.Lock()
+
+
+def call_macro(name):
+    request = urllib2.Request(url + "/macros/" + name, data="")
+    request.add_header("Authorization", auth)
+    start_time = time.time()
+    reply = urllib2.urlopen(request).read()
+    with lock:
+        round_trips.setdefault(name, []).append(time.time() - start_time)
+    return reply
+
+
+def joystick(end_time):
+    macros = ["go_forward", "turn_left", "turn_right", "go_backward"]
+    n = 0
+    while time.time() < end_time:
+        call_macro(macros[n % len(macros)])
+        call_macro("joystick_release")
+        n += 1
+        time.sleep(1.0 / joystick_rate)
+
+
+def load(end_time):
+    next_toggle = time.time() + toggle_period
+    while time.time() < end_time:
+        call_macro("get_state")
+        if time.time() >= next_toggle:
+            call_macro("toggle_recording")
+            next_toggle += toggle_period
+        time.sleep(0.5)
+
+
+end_time = time.time() + seconds
+threads = [threading.Thread(target=joystick, args=(end_time,)),
+           threading.Thread(target=load, args=(end_time,))]
+for t in threads:
+    t.start()
+for t in threads:
+    t.join()
+
+# Leave recording off
+state = json.loads(call_macro("get_state"))
+if state["recording"]:
+    call_macro("toggle_recording")
+
+print "HTTP round trip, ms:    50%    90%    99%    max  calls"
+for name in sorted(round_trips):
+    x = 1000 * np.array(round_trips[name])
+    print "%-20s %6.1f %6.1f %6.1f %6.1f %6d" % ((name,) + tuple(np.percentile(x, [50, 90, 99])) + (x.max(), len(x)))
+print "dora.py macro to motor command, ms: " + repr(state["motor_latency_ms"])
@@ -17,6 +17,7 @@ Train robot to drive autonomously. Use a small convolutional neural network.
 """
 
 import os
+import sys
 import time
 import picamera
 import picamera.array
@@ -27,15 +28,15 @@ from neon.layers import Affine, Conv, Pooling
 from neon.models import Model
 from neon.transforms import Rectlin, Softmax
 from neon.initializers import Uniform
-from neon.data.dataiterator import ArrayIterator
+my_dir = os.path.expanduser("~") + "/dora/"
+sys.path.append(my_dir + "common")
+from preprocess import preprocess, to_image
+from inference import InferenceSession
 
 
 def show_sample(x):
     # Input to CNN - this is what neural network "sees"
-    image = x.reshape(3, W, H)
-    image = image[[2, 1, 0], :, :]
-    image = np.transpose(image, (1, 2, 0))
-    image = Image.fromarray(np.uint8(image + 127))
+    image = to_image(x, W, H)
     # image.show()
 
 w = 160
@@ -43,7 +44,6 @@ h = 120
 W = 32  # CNN input image size
 H = W
 fps = 90
-my_dir = os.path.expanduser("~") + "/dora/"
 # param_file_name = my_dir + "train/model/trained_dora_model_24x24_3x3x16.prm"
 param_file_name = my_dir + "train/model/trained_dora_model_32x32.prm"
 class_names = ["forward", "left", "right", "backward"]  # from ROBOT-C bot.c
@@ -76,22 +76,16 @@ layers = [Conv((5, 5, 16), init=init_uni, activation=Rectlin(), batch_norm=bn),
           Affine(nout=nclasses, init=init_uni, activation=Softmax())]
 model = Model(layers=layers)
 model.load_params(param_file_name, load_states=False)
+session = InferenceSession(model, (3, H, W))
 
 start_time = time.time()
 
 # Convert image to sample
-size = H, W
-image = image.resize(size, Image.ANTIALIAS)
-r, g, b = image.split()
-image = Image.merge("RGB", (b, g, r))
-image = np.asarray(image, dtype=np.float32)
-image = np.transpose(image, (2, 0, 1))
-x_new = image.reshape(1, 3*W*H) - 127
+x_new = preprocess(stream.array, W, H)
 show_sample(x_new)
 
 # Run neural network
-inference_set = ArrayIterator(x_new, None, nclass=nclasses, lshape=(3, H, W))
-out = model.get_outputs(inference_set)
+out = session.classify(x_new)
 print "Recognized as " + class_names[out.argmax()]
 
 print "--- %s seconds --- " % (time.time() - start_time)
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+# Compact training data set: one memory-mapped array of pre-resized images
+# See more at https://github.com/oomwoo/
+#
+# Copyright (C) 2016 oomwoo.com
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version 3.0
+# as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License <http://www.gnu.org/licenses/> for details.
+"""
+Array data set, an alternative to JPEG macrobatches + ImageLoader
+    - images.npy: N x 3 x H x W uint8, already resized, BGR, CNN input + 127
+    - labels.npy: N target classes
+    - split.npy: N flags, 1 for validation set, the images BatchWriter
+      put in val_file.csv.gz: ImageLoader and array runs validate alike
+    - names.npy: N source image file names
+Images are decoded and resized once, when the data set is written;
+training reads minibatches straight from the memory-mapped file.
+"""
+
+import os
+import sys
+import glob
+import numpy as np
+from neon.data.dataiterator import NervanaDataIterator
+sys.path.append(os.path.expanduser("~") + "/dora/common")
+from preprocess import load_sample, mean
+from evaluate import read_file_list
+
+
+def write_array_dataset(image_dir, array_dir, size, val_file_name):
+    """Convert image_dir/<class>/*.jpg into an array data set of size x size images,
+    validation set as listed in val_file_name (BatchWriter's val_file.csv.gz)"""
+    val_names = set(os.path.relpath(f, image_dir) for f in read_file_list(val_file_name, image_dir)[0])
+    file_names = []
+    labels = []
+    for class_dir in sorted(glob.glob(image_dir + "[0-9]*")):
+        names = sorted(glob.glob(class_dir + "/*.jpg"))
+        file_names += names
+        labels += [int(os.path.basename(class_dir))] * len(names)
+
+    if not os.path.isdir(array_dir):
+        os.makedirs(array_dir)
+    images = np.lib.format.open_memmap(array_dir + "images.npy", mode='w+', dtype=np.uint8,
+                                       shape=(len(file_names), 3, size, size))
+    for i, file_name in enumerate(file_names):
+        x = load_sample(file_name, size, size) + mean
+        images[i] = np.clip(np.round(x), 0, 255).reshape(3, size, size)
+    images.flush()
+    del images
+
+    names = [os.path.relpath(f, image_dir) for f in file_names]
+    split = np.array([name in val_names for name in names], dtype=np.uint8)
+    np.save(array_dir + "labels.npy", np.array(labels, dtype=np.int32))
+    np.save(array_dir + "split.npy", split)
+    np.save(array_dir + "names.npy", np.array(names))
+    return len(file_names)
+
+
+class ArrayDataset(NervanaDataIterator):
+    """Feeds an array data set to Neon, drop-in for ImageLoader/ArrayIterator.
+    No image decoding, one uint8 -> float32 conversion per minibatch."""
+    def __init__(self, array_dir, set_name='train', shuffle=False, nclass=None, name=None):
+        super(ArrayDataset, self).__init__(name=name)
+        self.images = np.load(array_dir + "images.npy", mmap_mode='r')
+        self.labels = np.load(array_dir + "labels.npy")
+        split = np.load(array_dir + "split.npy")
+        self.idx = np.where(split == (1 if set_name == 'validation' else 0))[0]
+        self.ndata = len(self.idx)
+        self.nclass = nclass or int(self.labels.max()) + 1
+        self.shape = self.images.shape[1:]
+        self.lshape = self.shape
+        self.shuffle = shuffle
+        self.start = 0
+        nfeatures = int(np.prod(self.shape))
+        self.host_x = np.empty((nfeatures, self.be.bsz), dtype=np.float32)
+        self.host_y = np.zeros((self.nclass, self.be.bsz), dtype=np.float32)
+        self.dev_x = self.be.iobuf(nfeatures)
+        self.dev_y = self.be.iobuf(self.nclass)
+
+    @property
+    def nbatches(self):
+        return -((self.start - self.ndata) // self.be.bsz)
+
+    def reset(self):
+        self.start = 0
+
+    def __iter__(self):
+        bsz = self.be.bsz
+        order = np.random.permutation(self.idx) if self.shuffle else self.idx
+        for i1 in range(self.start, self.ndata, bsz):
+            if i1 + bsz > self.ndata:
+                # Wrap around to fill the last minibatch, like ArrayIterator
+                self.start = i1 + bsz - self.ndata
+            batch = np.sort(order.take(np.arange(i1, i1 + bsz), mode='wrap'))
+            self.host_x[:] = self.images[batch].reshape(bsz, -1).T
+            self.host_x -= mean
+            self.host_y.fill(0)
+            self.host_y[self.labels[batch], np.arange(bsz)] = 1
+            self.dev_x.set(self.host_x)
+            self.dev_y.set(self.host_y)
+            yield self.dev_x, self.dev_y
@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+# Augment training images in worker processes while the network trains
+# See more at https://github.com/oomwoo/
+#
+# Copyright (C) 2016 oomwoo.com
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version 3.0
+# as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License <http://www.gnu.org/licenses/> for details.
+"""
+Prefetching, augmenting loader for the array data set (see arrayset.py)
+    - random contrast and brightness, small translations (edge pixels
+      repeated), left/right mirror with left and right labels swapped
+    - worker processes write augmented minibatches into shared memory
+      buffers, two per worker, filled ahead of the training step
+    - each minibatch is augmented with its own random seed: the same
+      minibatches for any number of workers
+Usage: python augment.py [options]
+    Reports samples/s and epoch time of ImageLoader (as in trainbot.py)
+    and of this loader without and with worker processes.
+"""
+
+import os
+import sys
+import time
+import getopt
+import multiprocessing
+import numpy as np
+from arrayset import ArrayDataset
+sys.path.append(os.path.expanduser("~") + "/dora/common")
+from preprocess import mean
+
+
+mirror_classes = np.array([0, 2, 1, 3])  # forward, left <-> right, backward, see bot.c
+
+
+def usage():
+    print "python augment.py [options]"
+    print "  Compare training data loaders: samples/s and epoch time"
+    print "  -w n: worker processes, default number of cores - 1"
+    print "  -s n: image size, for ImageLoader, default size of the array data set"
+    print "  -d dir: array data set directory, see bot2neon.py -a"
+    print "  -n dir: Neon macrobatch directory, ImageLoader skipped if missing"
+    print "  -?: print usage"
+
+
+def augment(images, labels, rng, contrast_range=(75, 125), brightness=20, max_shift=2, mirror=True):
+    """images: (N, C, H, W) uint8 CNN input + mean, labels: (N,) classes.
+    Returns (N, C*H*W) float32 CNN input and labels."""
+    x = images.astype(np.float32)
+    n, C, H, W = x.shape
+    if contrast_range:
+        # Percent, like ImageLoader contrast_range; around each image's mean
+        c = rng.uniform(contrast_range[0], contrast_range[1], n).reshape(n, 1, 1, 1) / 100.0
+        m = x.reshape(n, -1).mean(axis=1).reshape(n, 1, 1, 1)
+        x = (x - m) * c + m
+    if brightness:
+        x += rng.uniform(-brightness, brightness, n).reshape(n, 1, 1, 1)
+    if max_shift:
+        p = max_shift
+        padded = np.pad(x, ((0, 0), (0, 0), (p, p), (p, p)), 'edge')
+        dy = rng.randint(0, 2 * p + 1, n)
+        dx = rng.randint(0, 2 * p + 1, n)
+        for i in range(n):
+            x[i] = padded[i, :, dy[i]:dy[i] + H, dx[i]:dx[i] + W]
+    if mirror:
+        flip = rng.rand(n) < 0.5
+        x[flip] = x[flip, :, :, ::-1]
+        labels = np.where(flip, mirror_classes[labels], labels)
+    np.clip(x, 0, 255, out=x)
+    x -= mean
+    return x.reshape(n, -1), labels
+
+
+def augment_worker(images, labels, xs, ys, tasks, done, options):
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        slot, batch, seed = task
+        xs[slot], ys[slot] = augment(images[batch], labels[batch], np.random.RandomState(seed), **options)
+        done.put(slot)
+
+
+class AugmentedDataset(ArrayDataset):
+    """Training set of an array data set, augmented every epoch.
+    Drop-in for ArrayDataset; workers=0 augments in the training process."""
+    def __init__(self, array_dir, workers=2, contrast_range=(75, 125), brightness=20,
+                 max_shift=2, mirror=True, nclass=None, name=None):
+        super(AugmentedDataset, self).__init__(array_dir, set_name='train', shuffle=True,
+                                               nclass=nclass, name=name)
+        self.options = {'contrast_range': contrast_range, 'brightness': brightness,
+                        'max_shift': max_shift, 'mirror': mirror}
+        self.workers = []
+        self.pending = 0
+        self.samples = 0
+        self.wait_seconds = 0  # Training process waiting for minibatches
+        if workers == 0:
+            return
+        bsz = self.be.bsz
+        nslots = 2 * workers
+        nfeatures = int(np.prod(self.shape))
+        # Allocated before the workers fork, shared with them
+        self.xs = np.frombuffer(multiprocessing.RawArray('f', nslots * bsz * nfeatures),
+                                dtype=np.float32).reshape(nslots, bsz, nfeatures)
+        self.ys = np.frombuffer(multiprocessing.RawArray('i', nslots * bsz),
+                                dtype=np.int32).reshape(nslots, bsz)
+        self.tasks = multiprocessing.Queue()
+        self.done = multiprocessing.Queue()
+        for i in range(workers):
+            p = multiprocessing.Process(target=augment_worker, args=(
+                self.images, self.labels, self.xs, self.ys, self.tasks, self.done, self.options))
+            p.daemon = True
+            p.start()
+            self.workers.append(p)
+
+    def load(self, x, y):
+        self.host_x[:] = x.T
+        self.host_y.fill(0)
+        self.host_y[y, np.arange(len(y))] = 1
+        self.dev_x.set(self.host_x)
+        self.dev_y.set(self.host_y)
+        self.samples += len(y)
+
+    def __iter__(self):
+        bsz = self.be.bsz
+        order = np.random.permutation(self.idx)
+        batches = []
+        for i1 in range(self.start, self.ndata, bsz):
+            if i1 + bsz > self.ndata:
+                # Wrap around to fill the last minibatch, like ArrayDataset
+                self.start = i1 + bsz - self.ndata
+            batches.append(np.sort(order.take(np.arange(i1, i1 + bsz), mode='wrap')))
+        seeds = np.random.randint(2 ** 31 - 1, size=len(batches))
+
+        if not self.workers:
+            for batch, seed in zip(batches, seeds):
+                x, y = augment(self.images[batch], self.labels[batch], np.random.RandomState(seed), **self.options)
+                self.load(x, y)
+                yield self.dev_x, self.dev_y
+            return
+
+        # Minibatches left over from an epoch that was not iterated to the end
+        while self.pending:
+            self.done.get()
+            self.pending -= 1
+        nslots = len(self.xs)
+        for i in range(min(nslots, len(batches))):
+            self.tasks.put((i, batches[i], seeds[i]))
+            self.pending += 1
+        ready = set()
+        for i in range(len(batches)):
+            slot = i % nslots
+            start_time = time.time()
+            while slot not in ready:
+                ready.add(self.done.get())
+                self.pending -= 1
+            self.wait_seconds += time.time() - start_time
+            ready.remove(slot)
+            self.load(self.xs[slot], self.ys[slot])
+            # Copied to the backend, the slot is free for minibatch i + nslots
+            if i + nslots < len(batches):
+                self.tasks.put((slot, batches[i + nslots], seeds[i + nslots]))
+                self.pending += 1
+            yield self.dev_x, self.dev_y
+
+    def close(self):
+        for p in self.workers:
+            self.tasks.put(None)
+        for p in self.workers:
+            p.join(5)
+        self.workers = []
+
+
+def time_epoch(loader):
+    """Seconds and samples for one epoch, each minibatch copied to the backend"""
+    start_time = time.time()
+    samples = 0
+    for x, t in loader:
+        samples += loader.be.bsz
+    return time.time() - start_time, samples
+
+
+if __name__ == "__main__":
+    from neon.backends import gen_backend
+    my_dir = os.path.expanduser("~") + "/dora/train/"
+    array_dir = my_dir + "array/"
+    data_dir = my_dir + "neon/"
+    workers = max(multiprocessing.cpu_count() - 1, 1)
+    img_size = 0
+    opts, args = getopt.getopt(sys.argv[1:], "w:s:d:n:?")
+    for opt, arg in opts:
+        if opt == '-w':
+            workers = int(arg)
+        elif opt == '-s':
+            img_size = int(arg)
+        elif opt == '-d':
+            array_dir = arg
+        elif opt == '-n':
+            data_dir = arg
+        elif opt == '-?':
+            usage()
+            sys.exit(2)
+
+    be = gen_backend(backend='cpu', batch_size=128)
+    loaders = []
+    if os.path.isdir(data_dir):
+        from neon.data.imageloader import ImageLoader
+        size = img_size or np.load(array_dir + "images.npy", mmap_mode='r').shape[2]
+        loaders.append(("ImageLoader", ImageLoader(repo_dir=data_dir, set_name='train', inner_size=size,
+                                                   scale_range=0, shuffle=True, contrast_range=(75, 125))))
+    loaders.append(("AugmentedDataset, no workers", AugmentedDataset(array_dir, workers=0)))
+    loaders.append(("AugmentedDataset, %d workers" % workers, AugmentedDataset(array_dir, workers=workers)))
+    for name, loader in loaders:
+        time_epoch(loader)  # Warm up: page cache, worker start
+        seconds, samples = time_epoch(loader)
+        print "%-32s %8.0f samples/s, %.2f s per epoch" % (name, samples / seconds, seconds)
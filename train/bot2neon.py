@@ -16,18 +16,35 @@
 # GNU General Public License <http://www.gnu.org/licenses/> for details.
 """
 Convert robot training data to Nervana Systems Neon format
-    - convert video into series of JPG images
+    - decode video, save frames matching commands as JPG images,
+      matched on recorded frame capture times (rec*.pts) if available
     - convert joystick/motor command to target class for training
         - create list of images and target class for neon
+    - only new recordings are converted, see manifest.json; frames of
+      deleted or modified recordings are removed
+    - macro-batches (and the -a array data set) are not appended to: Neon's
+      BatchWriter writes them from scratch, with a new validation split,
+      whenever images were added or removed; a rerun with nothing new
+      leaves them as they are and takes a fraction of a second
 """
 
 import sys
 import subprocess
 import getopt
 import glob
-import re
 import os
-from neon.data import BatchWriter
+import time
+import shutil
+import tempfile
+import hashlib
+import json
+import multiprocessing
+import numpy as np
+from PIL import Image
+sys.path.append(os.path.expanduser("~") + "/dora/common")
+from recordings import find_log, read_log, read_frame_times, align_frames, select_frames
+from video import probe_video, decode_frames
+from recindex import list_recordings
 
 
 def usage():
@@ -37,21 +54,12 @@ def usage():
     print "  -s n: keep one frame out of each n frames, default no skip"
     print "  -m: horizontal mirror"
     print "  -v: vertical mirror"
+    print "  -j n: convert n recordings in parallel, default 1"
+    print "  -a n: also write array data set of n x n images for trainbot.py -a"
+    print "  -f: forget converted recordings, rescan video directory, rebuild data set from scratch"
     print "  -?: print usage"
 
 
-def extract_command_value(s, cmd):
-    i = s.find(cmd)
-    if i == -1:
-        return -1
-    return int(s[i+1:i+3], 16)
-
-
-def extract_time(s):
-    i = s.find(' ')
-    return float(s[0:i])
-
-
 def rm_files(file_path_name):
     command = "rm -r " + file_path_name #+ " 2> /dev/null"
     subprocess.call(command, shell=True)
@@ -67,12 +75,20 @@ ver_flip = False
 validation_pct = 10
 frame_skip = False
 skip_frame_extraction = False
+rebuild = False
+num_jobs = 1
+frame_range_fps = 120  # Highest camera frame rate a recording may use
+frame_range_margin = 10  # Seconds of video before first/after last log entry
+jpeg_quality = 95
+array_size = 0  # Also write array data set of array_size x array_size images
 my_dir = os.path.expanduser("~") + "/dora/"
 video_dir = my_dir + "rpi2/video/"
 dataset_dir = my_dir + "train/dataset/"
 out_data_dir = my_dir + "train/neon/"
+array_dir = my_dir + "train/array/"
+manifest_file_name = my_dir + "train/manifest.json"  # Recordings already in data set
 
-opts, args = getopt.getopt(sys.argv[1:], "mv?ws:")
+opts, args = getopt.getopt(sys.argv[1:], "mv?ws:j:a:f")
 
 for opt, arg in opts:
     if opt == '-m':
@@ -83,116 +99,275 @@ for opt, arg in opts:
         frame_skip = int(arg)
     elif opt == '-w':
         skip_frame_extraction = True
+    elif opt == '-j':
+        num_jobs = int(arg)
+    elif opt == '-a':
+        array_size = int(arg)
+    elif opt == '-f':
+        rebuild = True
     elif opt == '-?':
         usage()
         sys.exit(2)
 
 
-def extract_frames():
-    # Wipe data set directory
-    rm_files(dataset_dir)
-    create_dir(dataset_dir)
+def frame_range(video_file_name):
+    # Upper bound on frames in a recording, reserves unique output frame numbers
+    times, commands, log_start_time, log_end_time = read_log(find_log(video_file_name), 'u')
+    return int((log_end_time - log_start_time + frame_range_margin) * frame_range_fps)
+
+
+def convert_recording(job):
+    # Runs in a worker process, extracts frames into a private workspace
+    video_file_name, start_frame_number, max_frames, work_dir = job
+    start_time = time.time()
+    work_dir += os.path.basename(video_file_name) + "/"
+    os.mkdir(work_dir)
+
+    # Count frames without decoding, keep one out of each frame_skip frames
+    nframes, w, h = probe_video(video_file_name)
+    kept = range(0, nframes, frame_skip) if frame_skip else range(nframes)
+    numbers = [start_frame_number + n for n in range(len(kept))]
+    if len(numbers) > max_frames:
+        raise RuntimeError(video_file_name + ": more frames than reserved, increase frame_range_fps")
+
+    # Read bot commands and their timestamps
+    log_file_name = find_log(video_file_name)
+    times, commands, log_start_time, log_end_time = read_log(log_file_name, 'u')
+
+    # Frame capture times recorded by the robot, else assume evenly spaced frames
+    pts = read_frame_times(video_file_name)
+    if pts is not None and len(pts) != nframes:
+        print "%s: %d frame times for %d frames, interpolating" % (video_file_name, len(pts), nframes)
+        pts = None
+    if pts is not None and len(numbers) > 1:
+        frame_times = pts[kept] - log_start_time
+        frame_period = (frame_times[-1] - frame_times[0]) / (len(numbers) - 1)
+    else:
+        frame_period = (log_end_time - log_start_time) / len(numbers)
+        frame_times = (np.array(numbers) - start_frame_number) * frame_period
 
-    # Glob recordings
-    file_names = glob.glob(video_dir + "*.h264")
+    # find frame best matching each command time
+    frame_idx = align_frames(times - log_start_time, frame_times)
+    selected = [(kept[idx], str(numbers[idx]).zfill(8) + ".jpg", i)
+                for idx, i in select_frames(frame_idx, commands)]
 
-    start_frame_number = 1
-    class_list = []
+    # Decode video in-process, save only frames matched to commands
+    wanted = dict((n, file_name) for n, file_name, i in selected)
+    last = max(wanted) if wanted else -1
+    video_filter = ",".join([f for f, on in [("hflip", hor_flip), ("vflip", ver_flip)] if on])
+    for n, frame in enumerate(decode_frames(video_file_name, w, h, video_filter, nframes=nframes)):
+        if n in wanted:
+            Image.fromarray(frame).save(work_dir + wanted[n], quality=jpeg_quality)
+        if n >= last:
+            break
+    selected = [(file_name, i) for n, file_name, i in selected]
+    return video_file_name, work_dir, selected, len(numbers), 1 / frame_period, time.time() - start_time
 
-    # Iterate over each recording file set
-    for video_file_name in file_names:
-        print "Extracting frames from " + video_file_name
-
-        # Delete old files
-        rm_files(video_dir + "*.jpg")
-
-        # Extract frames from video(s)
-        cmd = "avconv -i " + video_file_name + " -qscale 1 "
-        if hor_flip or ver_flip or frame_skip:
-            cmd += "-vf \""
-            if frame_skip:
-                cmd += "select=''not(mod(n\," + str(frame_skip) + "))''"
-                if hor_flip or ver_flip:
-                    cmd += ","
-            if hor_flip:
-                cmd += "hflip"
-                if ver_flip:
-                    cmd += ","
-            if ver_flip:
-                cmd += "vflip"
-            cmd += "\""
-        cmd += " -start_number " + str(start_frame_number) + " " + video_dir + "%08d.jpg"  # 2>&1"
-        subprocess.check_output(cmd, shell=True)
-
-        # Read list of extracted frames and their timestamps
-        file_names = glob.glob(video_dir + "[0-9][0-9][0-9][0-9][0-9][0-9][0-9][0-9].jpg")
-        numbers = [int((re.findall('\d+', s))[0]) for s in file_names]
-
-        # Read bot commands and their timestamps
-        log_file_name = video_file_name.replace(".h264", ".txt")
-        with open(log_file_name) as f:
-            lines = f.read().splitlines()
-
-        # note time of the 1st log entry
-        log_start_time = extract_time(lines[0])
-
-        # note time of last log entry
-        log_end_time = extract_time(lines[-1])
-
-        # One frame time
-        frame_period = (log_end_time - log_start_time) / len(numbers)
 
-        frame_times = [(n - start_frame_number) * frame_period for n in numbers]
-        print video_file_name + " FPS " + "{:.2f}".format(1 / frame_period)
+def recording_files(video_file_name):
+    # Video and its log, if there is one
+    return [f for f in [video_file_name, find_log(video_file_name)] if os.path.exists(f)]
 
-        frame_file_names = []
 
-        print "Sorting frames ..."
-        for l in lines:
-            # line has user command?
-            i = extract_command_value(l, 'u')
-            if i < 0:
-                continue
-            # get time in seconds from the moment log started
-            t = extract_time(l) - log_start_time
-            # find image number best matching that time
-            frame_times_diff = [abs(ft - t) for ft in frame_times]
-            frame_idx = frame_times_diff.index(min(frame_times_diff))
-            frame_no = numbers[frame_idx]
+def recording_stat(video_file_name):
+    # Cheap change check, size and modification time of video and log
+    stat = []
+    for file_name in recording_files(video_file_name):
+        st = os.stat(file_name)
+        stat += [st.st_size, st.st_mtime]
+    return stat
+
+
+def recording_hash(video_file_name):
+    h = hashlib.sha1()
+    for file_name in recording_files(video_file_name):
+        with open(file_name, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+    return h.hexdigest()
+
+
+def conversion_options():
+    return [frame_skip, hor_flip, ver_flip]
+
+
+def new_manifest():
+    return {"next_frame_number": 1, "recordings": {}}
+
 
+def load_manifest():
+    if not os.path.exists(manifest_file_name):
+        return None
+    with open(manifest_file_name) as f:
+        return json.load(f)
+
+
+def save_manifest(manifest):
+    with open(manifest_file_name + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.rename(manifest_file_name + ".tmp", manifest_file_name)
+
+
+def remove_stale_recordings(manifest):
+    # Delete frames of recordings that were deleted or modified since conversion
+    recordings = manifest["recordings"]
+    removed = 0
+    for name in sorted(recordings):
+        rec = recordings[name]
+        video_file_name = video_dir + name
+        if os.path.exists(video_file_name) and rec["options"] == conversion_options():
+            stat = recording_stat(video_file_name)
+            if stat == rec["stat"]:
+                continue
+            if recording_hash(video_file_name) == rec["hash"]:
+                rec["stat"] = stat
+                continue
+        if rec["outputs"]:
+            print "Removing %d frames of %s" % (len(rec["outputs"]), name)
+        for path in rec["outputs"]:
+            if os.path.exists(dataset_dir + path):
+                os.remove(dataset_dir + path)
+        del recordings[name]
+        removed += 1
+    return removed
+
+
+def extract_frames(manifest):
+    recordings = manifest["recordings"]
+    changed = remove_stale_recordings(manifest)
+
+    # Recordings not converted yet, from the recording index (rescanned with -f)
+    file_names = [f for f in list_recordings(video_dir, rescan=rebuild)
+                  if os.path.basename(f) not in recordings and os.path.exists(f)]
+
+    # Nothing to label frames with; converted once the log shows up
+    for video_file_name in [f for f in file_names if len(recording_files(f)) < 2]:
+        print "Warning: %s has no command log, skipped" % video_file_name
+        recordings[os.path.basename(video_file_name)] = {
+            "stat": recording_stat(video_file_name), "hash": recording_hash(video_file_name),
+            "frames": [], "options": conversion_options(),
+            "classes": {}, "outputs": [], "skipped": "no command log"}
+        file_names.remove(video_file_name)
+    if not file_names:
+        print "No new recordings"
+        return changed
+
+    # Workspaces of all jobs in one directory, removed even if a job fails
+    work_dir = tempfile.mkdtemp(prefix="bot2neon", dir=video_dir) + "/"
+    try:
+        return convert_recordings(manifest, file_names, work_dir)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def convert_recordings(manifest, file_names, work_dir):
+    recordings = manifest["recordings"]
+
+    # Reserve a range of frame numbers for each recording, output names stay unique
+    jobs = []
+    start_frame_number = manifest["next_frame_number"]
+    for video_file_name in file_names:
+        max_frames = frame_range(video_file_name)
+        jobs.append((video_file_name, start_frame_number, max_frames, work_dir))
+        start_frame_number += max_frames
+
+    start_time = time.time()
+    print "Extracting frames from %d recordings, %d jobs" % (len(jobs), num_jobs)
+    if num_jobs > 1:
+        pool = multiprocessing.Pool(num_jobs)
+        try:
+            results = pool.map(convert_recording, jobs)
+        finally:
+            # After a failed job, stop the others writing into the workspace
+            pool.terminate()
+            pool.join()
+    else:
+        results = map(convert_recording, jobs)
+
+    # Merge per-recording results into data set
+    print "Sorting frames ..."
+    total_frames = 0
+    for job, result in zip(jobs, results):
+        video_file_name, job_dir, selected, nframes, fps, seconds = result
+        print "%s FPS %.2f: %d frames, %d selected, %.1f s, %.1f frames/s" % (
+            video_file_name, fps, nframes, len(selected), seconds, nframes / seconds)
+        total_frames += nframes
+        outputs = []
+        classes = {}
+        for file_name, i in selected:
             # Create class sub-directory
             subdir_name = str(i)
-            if i not in class_list:
+            if not os.path.isdir(dataset_dir + subdir_name):
                 create_dir(dataset_dir + subdir_name)
-                class_list.append(i)
-
-            # Add image name + target class to Neon image list
-            file_name = str(frame_no).zfill(8) + ".jpg"
-            if file_name in frame_file_names:
-                continue
-            frame_file_names.append(file_name)
 
             # Move jpg file
-            src = video_dir + file_name
-            dst = dataset_dir + subdir_name + '/' + file_name
-            os.rename(src, dst)
+            os.rename(job_dir + file_name, dataset_dir + subdir_name + '/' + file_name)
+            outputs.append(subdir_name + '/' + file_name)
+            classes[subdir_name] = classes.get(subdir_name, 0) + 1
+
+        recordings[os.path.basename(video_file_name)] = {
+            "stat": recording_stat(video_file_name), "hash": recording_hash(video_file_name),
+            "frames": list(job[1:3]), "options": conversion_options(),
+            "classes": classes, "outputs": outputs}
+    manifest["next_frame_number"] = start_frame_number
+
+    seconds = time.time() - start_time
+    print "Extracted %d frames in %.1f s, %.1f frames/s" % (total_frames, seconds, total_frames / seconds)
+    return True
 
-        start_frame_number = max(numbers) + 1
 
-    # Delete unused frames
-    rm_files(video_dir + "*.jpg")
+def dataset_signature():
+    # Changes when any image is added or deleted, including manual deletions
+    h = hashlib.sha1()
+    for class_dir in sorted(glob.glob(dataset_dir + "*/")):
+        h.update(class_dir.encode())
+        for file_name in sorted(os.listdir(class_dir)):
+            h.update(file_name.encode())
+    return h.hexdigest()
+
+
+def write_batches():
+    # All images, BatchWriter cannot append to existing macro-batches
+    from neon.data import BatchWriter
+    rm_files(out_data_dir + "*")
+    bw = BatchWriter(out_dir=out_data_dir, image_dir=dataset_dir,
+                     macro_size=3072, file_pattern="*.jpg", target_size=0,
+                     validation_pct=validation_pct/100.0)
+    bw.run()
 
 
 # avconv -i video0.avi -vf "select=''not(mod(n\,5))'',showinfo,vflip,hflip"  %08d.jpg
+manifest = None if rebuild else load_manifest()
+keep_manifest = manifest is not None or not skip_frame_extraction
+if manifest is None:
+    manifest = new_manifest()
+    if not skip_frame_extraction:
+        # Wipe data set directory
+        rm_files(dataset_dir)
+        create_dir(dataset_dir)
+
 if not skip_frame_extraction:
-    extract_frames()
-
-# Write macro-batches
-rm_files(out_data_dir + "*")
-bw = BatchWriter(out_dir=out_data_dir, image_dir=dataset_dir,
-                 macro_size=3072, file_pattern="*.jpg", target_size=0,
-                 validation_pct=validation_pct/100.0)
-bw.run()
+    extract_frames(manifest)
+
+# Write macro-batches, unless data set images are the same as last time
+signature = dataset_signature()
+if signature != manifest.get("batches") or not glob.glob(out_data_dir + "*"):
+    write_batches()
+    manifest["batches"] = signature
+else:
+    print "Data set unchanged, macro-batches in %s are up to date" % out_data_dir
+
+# Write array data set
+if array_size and [array_size, signature] != manifest.get("array"):
+    from arrayset import write_array_dataset
+    start_time = time.time()
+    # Same validation split as the macro-batches
+    n = write_array_dataset(dataset_dir, array_dir, array_size, out_data_dir + "val_file.csv.gz")
+    print "Wrote %d %dx%d images to %s in %.1f s" % (n, array_size, array_size, array_dir, time.time() - start_time)
+    manifest["array"] = [array_size, signature]
+
+if keep_manifest:
+    save_manifest(manifest)
 
 print "Please visually inspect sorted images for errors in " + dataset_dir
 print "If you see erroneous images, delete them and rerun this script with -w"
@@ -0,0 +1,261 @@
+#!/usr/bin/env python
+# Score a trained neural network against recorded human drives
+# See more at https://github.com/oomwoo/
+#
+# Copyright (C) 2016 oomwoo.com
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version 3.0
+# as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License <http://www.gnu.org/licenses/> for details.
+"""
+Offline replay of recordings through a model, no camera or robot needed
+    - decode rec*.h264, preprocess every frame like the robot does
+    - run the model on large batches of frames
+    - label each frame with the human command in effect at its capture time:
+      the last one logged at or before it, if at most -x seconds old;
+      frames without one (or with a command that is not a class) are "other"
+    - report confusion matrix, agreement on frames with a driving command
+      over time, and frames/s
+    - optionally simulate the robot's scene-change gate, report frames
+      skipped and how many decisions match always running the network
+Usage: python replay.py [options] model.prm [rec00001.h264 ...]
+    Replays all recordings in the video directory if none given.
+    Exit status is 1 if agreement is below the -a threshold
+    or gated decisions match always-infer less than -k.
+"""
+
+import sys
+import getopt
+import os
+import time
+import numpy as np
+sys.path.append(os.path.expanduser("~") + "/dora/common")
+from recordings import find_log, read_log, read_frame_times, commands_in_effect
+from video import probe_video, decode_frames
+from recindex import list_recordings
+from preprocess import Preprocessor
+from scenegate import SceneGate
+
+
+class_names = ["forward", "left", "right", "backward"]    # from ROBOT-C bot.c
+nclasses = len(class_names)
+other = nclasses  # Label of frames without a driving command
+engine = "numpy"
+batch_size = 128
+hor_flip = False
+ver_flip = False
+window = 10.0  # Seconds per agreement-over-time bin
+command_expiry = 0.25  # Seconds a logged command stays in effect; rpi2 logs a held command every 20 ms
+min_agreement = 0
+gate_threshold = 0  # Also simulate SceneGate with this threshold
+gate_max_age = 0.3
+min_gate_match = 99  # Percent of gated decisions that must match always-infer
+video_dir = os.path.expanduser("~") + "/dora/rpi2/video/"
+
+
+def usage():
+    print "python replay.py [options] model.prm [rec00001.h264 ...]"
+    print "  Run model over recorded video, compare decisions with logged commands"
+    print "  -d dir: video directory, default " + video_dir
+    print "  -e engine: neon, numpy or int8 (model_int8.npz), default " + engine
+    print "  -b n: frames per batch, default %d" % batch_size
+    print "  -m: horizontal mirror"
+    print "  -v: vertical mirror"
+    print "  -t n: agreement over time bin, seconds, default %g" % window
+    print "  -x n: seconds a logged command stays in effect, default %g" % command_expiry
+    print "  -a pct: fail (exit status 1) if agreement is below pct"
+    print "  -g n: simulate scene gate (see common/scenegate.py) with threshold n"
+    print "  -s n: scene gate max age, seconds, default %g" % gate_max_age
+    print "  -k pct: fail if fewer gated decisions match always-infer, default %g" % min_gate_match
+    print "  -?: print usage"
+
+
+def load_model(param_file_name):
+    """Model with get_outputs() on (N, C*H*W) input, and its input shape"""
+    if engine == "numpy":
+        from npengine import load_model
+        model = load_model(param_file_name)
+        return model, model.lshape
+    if engine == "int8":
+        from quantize import QuantizedModel
+        model = QuantizedModel(param_file_name.replace(".prm", "_int8.npz"))
+        return model, model.lshape
+    from neon.backends import gen_backend
+    from npengine import load_prm
+    from inference import InferenceSession
+    from graphopt import compile_model
+    gen_backend(backend='cpu', batch_size=batch_size)
+    lshape = tuple(load_prm(param_file_name)['train_input_shape'])
+    # Compiled like on the robot, layers come from the .prm file, any architecture works
+    return InferenceSession(compile_model(param_file_name), lshape), lshape
+
+
+def label_frames(video_file_name, nframes):
+    """Class of the command in effect at each frame, other for frames
+    without one, and frame times relative to the log start"""
+    times, commands, log_start_time, log_end_time = read_log(find_log(video_file_name), 'u')
+    pts = read_frame_times(video_file_name)
+    if pts is not None and len(pts) == nframes:
+        frame_times = pts - log_start_time
+    else:
+        frame_times = np.arange(nframes) * (log_end_time - log_start_time) / nframes
+    labels = commands_in_effect(times - log_start_time, commands, frame_times, command_expiry)
+    labels[(labels < 0) | (labels > other)] = other
+    return labels, frame_times
+
+
+def replay(model, lshape, video_file_name, nframes, w, h, frame_times, gate=None):
+    """Model decision for every frame, seconds spent in the model and, with
+    a SceneGate, for each frame the frame whose decision the robot would use"""
+    C, H, W = lshape
+    preprocessor = Preprocessor(W, H, w, h)
+    batch = np.empty((batch_size, C * H * W), dtype=np.float32)
+    decisions = np.empty(nframes, dtype=np.int32)
+    source = np.arange(nframes)
+    model_time = 0
+    n = 0
+    i = 0
+
+    def run(n, i):
+        start_time = time.time()
+        decisions[i - n:i] = model.get_outputs(batch[:n]).argmax(axis=1)
+        return time.time() - start_time
+
+    video_filter = ",".join([f for f, on in [("hflip", hor_flip), ("vflip", ver_flip)] if on])
+    for frame in decode_frames(video_file_name, w, h, video_filter, nframes=nframes):
+        if i >= nframes:
+            break
+        if gate is not None:
+            reused = gate.check(frame, frame_times[i])
+            if reused is None:
+                gate.update(i)
+            else:
+                source[i] = reused
+        batch[n] = preprocessor(frame)[0]
+        n += 1
+        i += 1
+        if n == batch_size:
+            model_time += run(n, i)
+            n = 0
+    if n:
+        model_time += run(n, i)
+    return decisions[:i], model_time, source[:i]
+
+
+def agreement_over_time(decisions, labels, frame_times):
+    """Percent agreement on frames with a driving command per window, None where none"""
+    bins = (frame_times // window).astype(int)
+    pct = []
+    for b in range(bins.max() + 1 if len(bins) else 0):
+        labeled = (bins == b) & (labels < other)
+        pct.append(100.0 * np.mean(decisions[labeled] == labels[labeled]) if labeled.any() else None)
+    return pct
+
+
+def print_confusion(confusion):
+    # Rows: human command, columns: model decision
+    names = class_names + ["other"]
+    print "Confusion, human (rows) vs model (columns):"
+    print "%10s" % "" + "".join(["%10s" % s for s in class_names]) + "    recall"
+    for c in range(len(names)):
+        total = confusion[c].sum()
+        if c == nclasses and total == 0:
+            continue
+        recall = "%8.1f%%" % (100.0 * confusion[c, c] / total) if total and c < nclasses else "%9s" % "-"
+        print "%10s" % names[c] + "".join(["%10d" % k for k in confusion[c]]) + " " + recall
+
+
+if __name__ == "__main__":
+    opts, args = getopt.getopt(sys.argv[1:], "d:e:b:mvt:x:a:g:s:k:?")
+    for opt, arg in opts:
+        if opt == '-d':
+            video_dir = arg
+        elif opt == '-e':
+            engine = arg
+        elif opt == '-b':
+            batch_size = int(arg)
+        elif opt == '-m':
+            hor_flip = True
+        elif opt == '-v':
+            ver_flip = True
+        elif opt == '-t':
+            window = float(arg)
+        elif opt == '-x':
+            command_expiry = float(arg)
+        elif opt == '-a':
+            min_agreement = float(arg)
+        elif opt == '-g':
+            gate_threshold = float(arg)
+        elif opt == '-s':
+            gate_max_age = float(arg)
+        elif opt == '-k':
+            min_gate_match = float(arg)
+        elif opt == '-?':
+            usage()
+            sys.exit(2)
+    if len(args) < 1 or engine not in ["neon", "numpy", "int8"]:
+        usage()
+        sys.exit(2)
+
+    param_file_name = args[0]
+    video_file_names = args[1:] or list_recordings(video_dir)
+    model, lshape = load_model(param_file_name)
+    print "Model %s, engine %s, input %s, %d frames per batch" % (
+        param_file_name, engine, "x".join(map(str, lshape)), batch_size)
+
+    confusion = np.zeros((nclasses + 1, nclasses), dtype=np.int64)
+    total_frames = 0
+    total_model_time = 0
+    gate_frames = 0
+    gate_matches = 0
+    gate_hits = 0
+    start_time = time.time()
+    for video_file_name in video_file_names:
+        rec_start_time = time.time()
+        nframes, w, h = probe_video(video_file_name)
+        labels, frame_times = label_frames(video_file_name, nframes)
+        gate = SceneGate(gate_threshold, gate_max_age) if gate_threshold else None
+        decisions, model_time, source = replay(model, lshape, video_file_name, nframes, w, h, frame_times, gate)
+        labels = labels[:len(decisions)]
+        frame_times = frame_times[:len(decisions)]
+        seconds = time.time() - rec_start_time
+        labeled = labels < other
+        np.add.at(confusion, (labels, decisions), 1)
+        agreement = 100.0 * np.mean(decisions[labeled] == labels[labeled]) if labeled.any() else 0
+        pct = agreement_over_time(decisions, labels, frame_times)
+        print "%s: %d frames, %d labeled, agreement %.1f%%, %.1f frames/s (model %.1f frames/s)" % (
+            os.path.basename(video_file_name), len(decisions), labeled.sum(), agreement,
+            len(decisions) / seconds, len(decisions) / max(model_time, 1e-9))
+        print "  per %gs: %s" % (window, " ".join(["%3.0f" % p if p is not None else "  -" for p in pct]))
+        if gate is not None:
+            # Decisions the robot would make with the gate versus always inferring
+            matches = np.sum(decisions[source] == decisions)
+            print "  scene gate: %.1f%% of frames skipped, %.2f%% decisions match always-infer" % (
+                100.0 * gate.hits / len(decisions), 100.0 * matches / len(decisions))
+            gate_frames += len(decisions)
+            gate_matches += matches
+            gate_hits += gate.hits
+        total_frames += len(decisions)
+        total_model_time += model_time
+    seconds = time.time() - start_time
+
+    print_confusion(confusion)
+    nlabeled = confusion[:nclasses].sum()
+    agreement = 100.0 * np.trace(confusion[:nclasses]) / nlabeled if nlabeled else 0
+    print "Agreement %.1f%% on %d frames with a driving command, %d other" % (
+        agreement, nlabeled, confusion[other].sum())
+    print "%d frames in %.1f s, %.1f frames/s, model alone %.1f frames/s" % (
+        total_frames, seconds, total_frames / seconds, total_frames / max(total_model_time, 1e-9))
+    failed = agreement < min_agreement
+    if gate_frames:
+        gate_match = 100.0 * gate_matches / gate_frames
+        print "Scene gate threshold %g, max age %g s: %.1f%% of frames skipped, %.2f%% decisions match" % (
+            gate_threshold, gate_max_age, 100.0 * gate_hits / gate_frames, gate_match)
+        failed = failed or gate_match < min_gate_match
+    if failed:
+        sys.exit(1)
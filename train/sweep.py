@@ -0,0 +1,265 @@
+#!/usr/bin/env python
+# Train many variants of the driving network in parallel, pick the fastest good one
+# See more at https://github.com/oomwoo/
+#
+# Copyright (C) 2016 oomwoo.com
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version 3.0
+# as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License <http://www.gnu.org/licenses/> for details.
+"""
+Resolution/architecture sweep
+    - grid of input size, first convolution filter size, layer widths
+      and learning rate; network shaped like trainbot.py: conv, pool,
+      3x3 conv, pool, affine, softmax, batch norm on each
+    - one array data set per input size (see arrayset.py), same validation split
+    - configurations train concurrently, one process each, as many
+      processes as cores by default; BLAS/OpenMP threads are limited to
+      cores / processes per process so they do not oversubscribe the CPU
+    - after training, time per decision is measured one model at a time,
+      batch norm folded as on the robot (see common/graphopt.py)
+    - results table sweep.csv: validation error, parameters after folding,
+      ms per decision, training time
+    - best model: fastest with validation error at most -x percent,
+      lowest error if none is given; its .prm is copied to -o
+Usage: python sweep.py [options]
+"""
+
+import os
+import sys
+import time
+import getopt
+import shutil
+import multiprocessing
+sys.path.append(os.path.expanduser("~") + "/dora/common")
+# NumPy and Neon are imported once thread limits are set, see limit_threads()
+
+
+sizes = [16, 24, 32]
+filters = [3, 5]
+widths = ["16-32-50", "8-16-32"]  # First conv, second conv, affine
+learning_rates = [0.01]
+num_epochs = 30
+processes = multiprocessing.cpu_count()
+threads = 0  # BLAS threads per process, 0: cores / processes
+max_error = None
+rewrite = False
+engine = "neon"
+class_names = ["forward", "left", "right", "backward"]    # from ROBOT-C bot.c
+nclasses = len(class_names)
+my_dir = os.path.expanduser("~") + "/dora/train/"
+dataset_dir = my_dir + "dataset/"
+neon_dir = my_dir + "neon/"  # val_file.csv.gz written by bot2neon.py
+array_dir = my_dir + "array/"
+out_dir = my_dir + "sweep/"
+best_file_name = my_dir + "model/trained_dora_model_best.prm"
+
+
+def usage():
+    print "python sweep.py [options]"
+    print "  Train network variants in parallel, write sweep.csv, copy the best model"
+    print "  -s list: input sizes, default " + ",".join(map(str, sizes))
+    print "  -f list: first convolution filter sizes, default " + ",".join(map(str, filters))
+    print "  -w list: widths conv-conv-affine, default " + ",".join(widths)
+    print "  -l list: learning rates, default " + ",".join(map(str, learning_rates))
+    print "  -e n: epochs, default %d" % num_epochs
+    print "  -j n: parallel trainings, default %d (cores)" % processes
+    print "  -t n: BLAS/OpenMP threads per training, default cores / parallel trainings"
+    print "  -x pct: best model is the fastest with validation error up to pct"
+    print "  -r: rewrite array data sets"
+    print "  -n engine: time decisions with neon (compiled) or numpy, default " + engine
+    print "  -d dir: results and models, default " + out_dir
+    print "  -o file: copy best model here, default " + best_file_name
+    print "  -?: print usage"
+
+
+def config_name(c):
+    return "%dx%d_%dx%d_%s_lr%g" % (c['size'], c['size'], c['filter'], c['filter'], c['widths'], c['lr'])
+
+
+def limit_threads(n):
+    # Read by the BLAS and OpenMP runtimes when NumPy or Neon is first imported
+    for name in ["OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"]:
+        os.environ[name] = str(n)
+
+
+def build_layers(filter_size, widths):
+    from neon.initializers import Uniform
+    from neon.layers import Affine, Conv, Pooling
+    from neon.transforms import Rectlin, Softmax
+    w1, w2, w3 = map(int, widths.split("-"))
+    init_uni = Uniform(low=-0.1, high=0.1)
+    bn = True
+    return [Conv((filter_size, filter_size, w1), init=init_uni, activation=Rectlin(), batch_norm=bn),
+            Pooling((2, 2)),
+            Conv((3, 3, w2), init=init_uni, activation=Rectlin(), batch_norm=bn),
+            Pooling((2, 2)),
+            Affine(nout=w3, init=init_uni, activation=Rectlin(), batch_norm=bn),
+            Affine(nout=nclasses, init=init_uni, activation=Softmax())]
+
+
+def train_config(c):
+    """Runs in a pool process: train one configuration, save its .prm"""
+    from neon.backends import gen_backend
+    from neon.layers import GeneralizedCost
+    from neon.models import Model
+    from neon.optimizers import GradientDescentMomentum
+    from neon.transforms import Misclassification, CrossEntropyMulti
+    from neon.callbacks.callbacks import Callbacks
+    from arrayset import ArrayDataset
+    from augment import AugmentedDataset
+
+    start_time = time.time()
+    result = dict(c)
+    try:
+        gen_backend(backend='cpu', batch_size=128, rng_seed=0)
+        size_dir = array_dir + "%d/" % c['size']
+        # Augmented in this process, the sweep is parallel across configurations
+        train = AugmentedDataset(size_dir, workers=0, nclass=nclasses)
+        test = ArrayDataset(size_dir, set_name='validation', nclass=nclasses)
+        mlp = Model(layers=build_layers(c['filter'], c['widths']))
+        opt_gdm = GradientDescentMomentum(learning_rate=c['lr'], momentum_coef=0.9)
+        cost = GeneralizedCost(costfunc=CrossEntropyMulti())
+        mlp.fit(train, optimizer=opt_gdm, num_epochs=num_epochs, cost=cost, callbacks=Callbacks(mlp))
+        result['val_error'] = 100.0 * float(mlp.eval(test, metric=Misclassification()))
+        mlp.save_params(c['file_name'])
+    except Exception as e:
+        result['error'] = str(e)
+    result['train_seconds'] = time.time() - start_time
+    return result
+
+
+def count_params(param_file_name):
+    # Parameters the robot loads, after batch norm folding
+    from npengine import load_prm, fold_layers
+    return sum(op[key].size for op in fold_layers(load_prm(param_file_name)) for key in ['W', 'b'] if key in op)
+
+
+def ms_per_decision(param_file_name, size, decisions=200):
+    import numpy as np
+    from preprocess import mean
+    from evaluate import time_per_decision
+    images = np.load(array_dir + "%d/images.npy" % size, mmap_mode='r')
+    x = images[:decisions].reshape(-1, 3 * size * size).astype(np.float32) - mean
+    if engine == "numpy":
+        from npengine import NumpyModel
+        model = NumpyModel(param_file_name)
+    else:
+        from inference import InferenceSession
+        from graphopt import compile_model
+        model = InferenceSession(compile_model(param_file_name), (3, size, size))
+    return 1000 * time_per_decision(model, x)
+
+
+if __name__ == "__main__":
+    opts, args = getopt.getopt(sys.argv[1:], "s:f:w:l:e:j:t:x:rn:d:o:?")
+    for opt, arg in opts:
+        if opt == '-s':
+            sizes = [int(s) for s in arg.split(",")]
+        elif opt == '-f':
+            filters = [int(s) for s in arg.split(",")]
+        elif opt == '-w':
+            widths = arg.split(",")
+        elif opt == '-l':
+            learning_rates = [float(s) for s in arg.split(",")]
+        elif opt == '-e':
+            num_epochs = int(arg)
+        elif opt == '-j':
+            processes = int(arg)
+        elif opt == '-t':
+            threads = int(arg)
+        elif opt == '-x':
+            max_error = float(arg)
+        elif opt == '-r':
+            rewrite = True
+        elif opt == '-n':
+            engine = arg
+        elif opt == '-d':
+            out_dir = arg
+        elif opt == '-o':
+            best_file_name = arg
+        elif opt == '-?':
+            usage()
+            sys.exit(2)
+    if engine not in ["neon", "numpy"]:
+        usage()
+        sys.exit(2)
+    if not os.path.isdir(out_dir):
+        os.makedirs(out_dir)
+    threads = threads or max(1, multiprocessing.cpu_count() // processes)
+    # This process too: NumPy imported here before the pool forks keeps its thread count
+    limit_threads(threads)
+
+    # Array data set per input size, validation split of the macro-batches like bot2neon.py -a
+    for size in sizes:
+        size_dir = array_dir + "%d/" % size
+        if rewrite or not os.path.exists(size_dir + "images.npy"):
+            from arrayset import write_array_dataset
+            start_time = time.time()
+            n = write_array_dataset(dataset_dir, size_dir, size, neon_dir + "val_file.csv.gz")
+            print "Wrote %d %dx%d images to %s in %.1f s" % (n, size, size, size_dir, time.time() - start_time)
+
+    configs = []
+    for size in sizes:
+        for f in filters:
+            for w in widths:
+                for lr in learning_rates:
+                    c = {'size': size, 'filter': f, 'widths': w, 'lr': lr}
+                    c['name'] = config_name(c)
+                    c['file_name'] = out_dir + "trained_dora_model_" + c['name'] + ".prm"
+                    configs.append(c)
+    print "Training %d configurations, %d epochs, %d at a time, %d threads each" % (
+        len(configs), num_epochs, processes, threads)
+
+    # A fresh process per configuration, forked before this process creates a Neon backend
+    start_time = time.time()
+    pool = multiprocessing.Pool(processes, initializer=limit_threads, initargs=(threads,), maxtasksperchild=1)
+    results = []
+    for r in pool.imap_unordered(train_config, configs):
+        if 'error' in r:
+            print "%s: failed, %s" % (r['name'], r['error'])
+        else:
+            print "%s: validation error %.1f%%, trained in %.0f s" % (r['name'], r['val_error'], r['train_seconds'])
+        results.append(r)
+    pool.close()
+    pool.join()
+    print "Sweep trained in %.0f s" % (time.time() - start_time)
+
+    # Time decisions one model at a time, nothing else running
+    results = [r for r in results if 'error' not in r]
+    if engine == "neon":
+        from neon.backends import gen_backend
+        gen_backend(backend='cpu', batch_size=1)
+    for r in results:
+        r['params'] = count_params(r['file_name'])
+        r['ms_per_decision'] = ms_per_decision(r['file_name'], r['size'])
+    results.sort(key=lambda r: (r['val_error'], r['ms_per_decision']))
+
+    columns = ["name", "size", "filter", "widths", "lr", "val_error", "params", "ms_per_decision", "train_seconds"]
+    with open(out_dir + "sweep.csv", "w") as f:
+        f.write(",".join(columns) + "\n")
+        for r in results:
+            f.write(",".join([str(round(r[k], 3)) if isinstance(r[k], float) else str(r[k]) for k in columns]) + "\n")
+    print "%-32s %9s %8s %8s" % ("model", "val err", "params", "ms")
+    for r in results:
+        print "%-32s %8.1f%% %8d %8.3f" % (r['name'], r['val_error'], r['params'], r['ms_per_decision'])
+    print "Wrote " + out_dir + "sweep.csv"
+
+    if results:
+        if max_error is None:
+            best = results[0]
+        else:
+            good = [r for r in results if r['val_error'] <= max_error]
+            if not good:
+                print "No model with validation error up to %g%%" % max_error
+                sys.exit(1)
+            best = min(good, key=lambda r: r['ms_per_decision'])
+        shutil.copy(best['file_name'], best_file_name)
+        print "Best %s: %.1f%% validation error, %.3f ms per decision, copied to %s" % (
+            best['name'], best['val_error'], best['ms_per_decision'], best_file_name)
+        print "Set W = %d and param_file_name in rpi3/dora.py or rpi2vex/rpi2vex.py" % best['size']
@@ -15,6 +15,7 @@
 
 import time
 import os
+import sys
 import numpy as np
 from PIL import Image
 from neon.backends import gen_backend
@@ -22,7 +23,9 @@ from neon.layers import Affine, Conv, Pooling
 from neon.models import Model
 from neon.transforms import Rectlin, Softmax
 from neon.initializers import Uniform
-from neon.data.dataiterator import ArrayIterator
+sys.path.append(os.path.expanduser("~") + "/dora/common")
+from preprocess import load_sample
+from inference import InferenceSession
 
 
 # Install Imagemagick to view images
@@ -50,8 +53,7 @@ model.load_params(param_file_name, load_states=False)
 # Load images to classify
 W = img_size
 H = img_size
-L = W*H*3
-size = H, W
+session = InferenceSession(model, (3, H, W))
 
 def test_recognition(test_file_name):
     # Load image
@@ -60,16 +62,10 @@ def test_recognition(test_file_name):
     print("Loaded " + test_file_name)
 
     # Convert image to sample
-    image = image.resize(size, Image.ANTIALIAS)
-    r, g, b = image.split()
-    image = Image.merge("RGB", (b, g, r))
-    image = np.asarray(image, dtype=np.float32)
-    image = np.transpose(image, (2, 0, 1))
-    x_new = image.reshape(1, L) - 127
+    x_new = load_sample(test_file_name, W, H)
 
     # Run neural network
-    inference_set = ArrayIterator(x_new, None, nclass=nclasses, lshape=(3, H, W))
-    out = model.get_outputs(inference_set)
+    out = session.classify(x_new)
     print "Recognized as " + class_names[out.argmax()]
 
 test_recognition(image_dir + "forward.jpg")
@@ -17,6 +17,10 @@ Train robot to drive autonomously. Use a small convolutional neural network.
 """
 
 import os
+import sys
+import time
+import getopt
+import resource
 from neon.initializers import Uniform
 from neon.layers import Affine, Conv, Pooling, GeneralizedCost
 from neon.models import Model
@@ -25,6 +29,16 @@ from neon.transforms import Misclassification, Rectlin, Softmax, CrossEntropyMul
 from neon.callbacks.callbacks import Callbacks
 from neon.data.imageloader import ImageLoader
 from neon.backends import gen_backend
+sys.path.append(os.path.expanduser("~") + "/dora/common")
+from preprocess import load_sample as preprocess_sample
+
+
+def usage():
+    print "python trainbot.py"
+    print "  Train neural network on data set written by bot2neon.py"
+    print "  -a: train on array data set, see bot2neon.py -a"
+    print "  -w n: augment array data set in n worker processes, 0 in this process, implies -a, see augment.py"
+    print "  -?: print usage"
 
 
 img_size = 24    # Input to neural work is img_size x img_size
@@ -33,22 +47,53 @@ class_names = ["forward", "left", "right", "backward"]    # from ROBOT-C bot.c
 nclasses = len(class_names)
 my_dir = os.path.expanduser("~") + "/dora/train/"
 data_dir = my_dir + "neon/"
+array_dir = my_dir + "array/"
+use_array_dataset = False
+augment_workers = None  # No augmentation
 param_file_name = my_dir + "model/trained_dora_model_24x24_3x3x16.prm"
 image_dir = my_dir + "test/image/"
 
+opts, args = getopt.getopt(sys.argv[1:], "aw:?")
+for opt, arg in opts:
+    if opt == '-a':
+        use_array_dataset = True
+    elif opt == '-w':
+        use_array_dataset = True
+        augment_workers = int(arg)
+        if augment_workers < 0:
+            usage()
+            sys.exit(2)
+    elif opt == '-?':
+        usage()
+        sys.exit(2)
+
 be = gen_backend(backend='cpu', batch_size=128)
 
 # Define CNN
-train = ImageLoader(repo_dir=data_dir, set_name='train',
+if use_array_dataset:
+    from arrayset import ArrayDataset
+    if augment_workers is not None:
+        # Same transforms as ImageLoader below plus brightness, shifts and mirror
+        from augment import AugmentedDataset
+        train = AugmentedDataset(array_dir, workers=augment_workers, nclass=nclasses)
+    else:
+        train = ArrayDataset(array_dir, set_name='train', shuffle=True, nclass=nclasses)
+    test = ArrayDataset(array_dir, set_name='validation', nclass=nclasses)
+    if train.shape[1:] != (img_size, img_size):
+        print "Array data set holds %dx%d images, rerun bot2neon.py -a %d" % (
+            train.shape[2], train.shape[1], img_size)
+        sys.exit(2)
+else:
+    train = ImageLoader(repo_dir=data_dir, set_name='train',
+                            inner_size=img_size,
+                            scale_range=0,  # Force scaling to match inner_size
+                            shuffle=True,
+                            contrast_range=(75, 125))
+
+    test = ImageLoader(repo_dir=data_dir, set_name='validation',
                         inner_size=img_size,
-                        scale_range=0,  # Force scaling to match inner_size
-                        shuffle=True,
-                        contrast_range=(75, 125))
-
-test = ImageLoader(repo_dir=data_dir, set_name='validation',
-                    inner_size=img_size,
-                    do_transforms=False,
-                    scale_range=0)
+                        do_transforms=False,
+                        scale_range=0)
 
 init_uni = Uniform(low=-0.1, high=0.1)
 opt_gdm = GradientDescentMomentum(learning_rate=0.01,
@@ -69,7 +114,15 @@ mlp = Model(layers=layers)
 callbacks = Callbacks(mlp, eval_set=test)  # Track cost function
 
 # Train model
+start_time = time.time()
 mlp.fit(train, optimizer=opt_gdm, num_epochs=num_epochs, cost=cost, callbacks=callbacks)
+seconds = time.time() - start_time
+print "%.2f s per epoch, %.0f samples/s, peak RSS %.0f MB" % (
+    seconds / num_epochs, train.nbatches * be.bsz * num_epochs / seconds,
+    resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0)
+if augment_workers is not None:
+    print "Waited %.1f s for augmented minibatches" % train.wait_seconds
+    train.close()
 
 # Check performance
 print 'Misclassification error = %.1f%%' % (mlp.eval(test, metric=Misclassification())*100)
@@ -86,7 +139,6 @@ from neon.data.dataiterator import ArrayIterator
 W = img_size
 H = img_size
 L = W*H*3
-size = H, W
 x_new = np.zeros((128, L), dtype=np.float32)
 
 
@@ -94,14 +146,9 @@ def load_sample(test_file_name):
     image = Image.open(test_file_name)
     print("Loaded " + test_file_name)
     image.show()
-    image = image.resize(size, Image.ANTIALIAS)
-    r, g, b = image.split()
-    image = Image.merge("RGB", (b, g, r))
-    image = np.asarray(image, dtype=np.float32)
-    image = np.transpose(image, (2, 0, 1))
-    return image.reshape(1, L) - 127
-
-x_new[0] = load_sample(iamge_dir + "forward.jpg")
+    return preprocess_sample(test_file_name, W, H)
+
+x_new[0] = load_sample(image_dir + "forward.jpg")
 x_new[1] = load_sample(image_dir + "right.jpg")
 x_new[2] = load_sample(image_dir + "left.jpg")
 x_new[3] = load_sample(image_dir + "backward.jpg")
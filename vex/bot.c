@@ -335,16 +335,14 @@ void UserControlFunction()
 		// Send command(s) to Raspberry Pi
 		bool send_user_command = UserCmd != USER_CMD_NONE && !suppress_user_command;
 		if (LinkCmd != LINK_CMD_NONE)
-			SendUartCmd('L', (char) LinkCmd);
+			SendUartFrame('L', (char) LinkCmd);
 		if (send_user_command)
-			SendUartCmd('u', (char) UserCmd);
-		if (LinkCmd != LINK_CMD_NONE || send_user_command)
-			SendUartLF();		// Finish command(s) with line feed
+			SendUartFrame('u', (char) UserCmd);
 
 		// Receive command from Raspberry Pi
 		while (true)
 		{
-			uartCmd = GetUartCmd(&uartValue);
+			uartCmd = GetUartFrame(&uartValue);
 			if (uartCmd == 0)
 				break;
 
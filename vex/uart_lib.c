@@ -17,6 +17,19 @@ enum LinkCommand
 	LINK_CMD_SHUTDOWN = 255
 };
 
+// Framed binary protocol, see common/vexlink.py on the Raspberry Pi:
+// sync byte, type (command letter), payload length, payload, CRC-8 (polynomial 0x07)
+// of type, length and payload
+const unsigned char UART_FRAME_SYNC = 0xAA;
+const short UART_FRAME_MAX_PAYLOAD = 16;
+
+short nFrameState = 0;	// Bytes of the frame being received so far
+unsigned char frameType;
+unsigned char frameLength;
+unsigned char frameCrc;
+unsigned char framePayload[UART_FRAME_MAX_PAYLOAD];
+unsigned int nCrcErrors = 0;
+
 const char toHex[16] = { '0', '1', '2', '3', '4', '5', '6', '7', '8', '9', 'A', 'B', 'C', 'D', 'E', 'F' };
 
 void QueueUartChar(char value)
@@ -124,3 +137,88 @@ unsigned char GetUartCmd(char* value)
 	}
 
 }
+
+unsigned char Crc8(unsigned char crc, unsigned char data)
+{
+	short i;
+
+	crc = crc ^ data;
+	for (i = 0; i < 8; i++)
+	{
+		if (crc & 0x80)
+			crc = ((crc << 1) ^ 0x07) & 0xFF;
+		else
+			crc = (crc << 1) & 0xFF;
+	}
+	return crc;
+}
+
+void SendUartFrame(char type, char value)
+{
+	unsigned char crc;
+
+	QueueUartChar(UART_FRAME_SYNC);
+	QueueUartChar(type);
+	crc = Crc8(0, type);
+	QueueUartChar(1);
+	crc = Crc8(crc, 1);
+	QueueUartChar(value);
+	crc = Crc8(crc, value);
+	QueueUartChar(crc);
+}
+
+// Never waits: returns frame type once a complete frame with a valid CRC
+// has arrived, 0 otherwise. *value is the first payload byte.
+unsigned char GetUartFrame(char* value)
+{
+	short rcvChar;
+	unsigned char ch;
+
+	while (true)
+	{
+		rcvChar = GetUartChar();
+		if (rcvChar == -1)
+			return 0;
+
+		ch = (unsigned char) rcvChar;
+		if (nFrameState == 0)
+		{
+			if (ch == UART_FRAME_SYNC)
+				nFrameState = 1;
+		}
+		else if (nFrameState == 1)
+		{
+			frameType = ch;
+			frameCrc = Crc8(0, ch);
+			nFrameState = 2;
+		}
+		else if (nFrameState == 2)
+		{
+			frameLength = ch;
+			frameCrc = Crc8(frameCrc, ch);
+			if (frameLength > UART_FRAME_MAX_PAYLOAD)
+				nFrameState = 0;
+			else
+				nFrameState = 3;
+		}
+		else if (nFrameState < 3 + frameLength)
+		{
+			framePayload[nFrameState - 3] = ch;
+			frameCrc = Crc8(frameCrc, ch);
+			nFrameState++;
+		}
+		else
+		{
+			nFrameState = 0;
+			if (ch != frameCrc)
+			{
+				nCrcErrors++;
+				continue;
+			}
+			*value = 0;
+			if (frameLength > 0)
+				*value = framePayload[0];
+			return frameType;
+		}
+	}
+}